@@ -1,7 +1,15 @@
-"""Two ways to do reverse compliment 1). Using Method chaining 2). Using a loop"""
+"""Three ways to do reverse compliment 1). Using Method chaining 2). Using a loop 3). Using a translation table"""
+import os
+import tempfile
 import time
 import random
 
+from rev_comp_fasta import reverse_complement_fasta
+
+# translation table for rev_comp3, built once.  str.translate does the lookup in C for every character.
+# Every IUPAC code is complemented and the case is kept, like rev_comp_fasta.IUPAC_COMPLEMENT_TABLE
+COMPLEMENT_TABLE = str.maketrans('ACGTURYSWKMBDHVNacgturyswkmbdhvn', 'TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn')
+
 
 def main():
     """Business Logic"""
@@ -46,10 +54,19 @@ def rev_comp2(dna):
     return revcomp_dna
 
 
+def rev_comp3(dna):
+    """
+    Using a translation table to complement the DNA and slicing to reverse it
+    @param dna: Dna string
+    @return: reverse Complement
+    """
+    return dna.translate(COMPLEMENT_TABLE)[::-1]
+
+
 def run_code():
     """Simple function to test the timing of each function"""
     dna = generate_random_dna_str(5_000_000, 'ACGT')
-    functions = [rev_comp1, rev_comp2]
+    functions = [rev_comp1, rev_comp2, rev_comp3]
     timings = []  # timings[i] holds CPU time for functions[i]
 
     for function_name in functions:
@@ -63,6 +80,16 @@ def run_code():
     for cpu_time, function_name in sorted(zip(timings, functions)):  # sort by the first value
         print(f"{function_name.__name__:<9s}: {cpu_time:.4f} s")
 
+    # the streaming FASTA pipeline on the same sequence, file to file
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        infile = os.path.join(tmp_dir, 'dna.fasta')
+        with open(infile, 'w') as fh_out:
+            fh_out.write('>random\n' + '\n'.join(dna[i:i + 60] for i in range(0, len(dna), 60)) + '\n')
+        start = time.time()
+        for _ in range(0, 10):
+            reverse_complement_fasta(infile, os.path.join(tmp_dir, 'rev_comp.fasta'))
+        print(f"{'reverse_complement_fasta':<9s}: {time.time() - start:.4f} s (file to file)")
+
 
 def generate_random_dna_str(num, alphabet='AGCT'):
     """
@@ -71,7 +98,8 @@ def generate_random_dna_str(num, alphabet='AGCT'):
     @param alphabet: Alphabet to use
     @return: string
     """
-    return ''.join([random.choice(alphabet) for i in range(num)])
+    # random.choices draws all the bases in one call, instead of one random.choice call per base
+    return ''.join(random.choices(alphabet, k=num))
 
 
 def test_code():
@@ -85,6 +113,10 @@ def test_code():
     rev_com_dna_to_test = rev_comp2(dna)
     assert rev_comp_dna == rev_com_dna_to_test, "rev_comp2 did not work"
 
+    rev_com_dna_to_test = rev_comp3(dna)
+    assert rev_comp_dna == rev_com_dna_to_test, "rev_comp3 did not work"
+    assert rev_comp3('ACGTnnRYacgt') == 'acgtRYnnACGT', "rev_comp3 did not keep the IUPAC codes and the case"
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,171 @@
+"""
+Reverse complement every record of a FASTA file with bounded memory
+Each record's sequence is read backwards from its end in chunks, complemented with a bytes translation table
+(IUPAC ambiguity codes and lower case soft-masking are kept) and written out wrapped, so only one chunk is in memory
+no matter how large the records are.
+    python rev_comp_fasta.py --infile genome.fasta --outfile genome_rc.fasta
+"""
+import argparse
+import gzip
+import mmap
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator, Tuple
+
+import numpy as np
+
+# complement of every IUPAC code in both cases, U (RNA) becomes A.  Any other byte is kept as it is
+IUPAC_COMPLEMENT_TABLE = bytes.maketrans(b'ACGTURYSWKMBDHVNacgturyswkmbdhvn',
+                                         b'TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn')
+LINE_ENDS = b'\r\n \t'  # deleted from the sequence while translating
+CHUNK_LEN = 1 << 24  # bytes of sequence read at once
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def main():
+    """Business Logic"""
+    args = get_cli_args()
+    reverse_complement_fasta(args.infile, args.outfile, line_len=args.line_len, header_suffix=args.header_suffix)
+
+
+def rev_comp_bytes(dna: bytes) -> bytes:
+    """
+    Reverse complement a DNA sequence held in memory
+    @param dna: DNA bytes, IUPAC codes and case are kept
+    @return: reverse complement
+    """
+    return dna.translate(IUPAC_COMPLEMENT_TABLE)[::-1]
+
+
+def reverse_complement_fasta(infile: str = None, outfile: str = None, line_len: int = 60, header_suffix: str = '',
+                             chunk_len: int = CHUNK_LEN) -> None:
+    """
+    Write the reverse complement of every record of a FASTA file, in the same order as the input
+    @param infile: FASTA file, plain or gzip.  gzip input is first decompressed to a temporary file, since it
+                   can not be read backwards
+    @param outfile: FASTA file to write, gzip if it ends with .gz
+    @param line_len: Number of bases per output line
+    @param header_suffix: Text added to the end of every header, e.g. ' reverse complement'
+    @param chunk_len: Bytes of sequence read at once, bounds the memory used
+    @return: None
+    """
+    with open(infile, 'rb') as fh_in:
+        is_gzip = fh_in.read(2) == GZIP_MAGIC
+    tmp_file = None
+    if is_gzip:
+        with gzip.open(infile, 'rb') as fh_in, tempfile.NamedTemporaryFile(suffix='.fasta', delete=False) as fh_tmp:
+            shutil.copyfileobj(fh_in, fh_tmp, length=chunk_len)
+        tmp_file = infile = fh_tmp.name
+
+    try:
+        opener = gzip.open if outfile.endswith('.gz') else open
+        with open(infile, 'rb') as fh_in, opener(outfile, 'wb') as fh_out:
+            if os.fstat(fh_in.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fh_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for header, seq_start, seq_end in iter_record_spans(data):
+                    fh_out.write(header + header_suffix.encode('ascii') + b'\n')
+                    write_wrapped(fh_out, iter_rev_comp_chunks(data, seq_start, seq_end, chunk_len=chunk_len),
+                                  line_len=line_len)
+    finally:
+        if tmp_file:
+            os.remove(tmp_file)
+
+
+def iter_record_spans(data: mmap.mmap) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Generator of the header and the byte range of the sequence lines of every record
+    @param data: memory map of an uncompressed FASTA file
+    @return: Iterator of (header line without the line end, start, end)
+    """
+    header_start = 0 if data[:1] == b'>' else data.find(b'\n>') + 1
+    if header_start == 0 and data[:1] != b'>':
+        return  # no records
+    while True:
+        header_end = data.find(b'\n', header_start)
+        if header_end == -1:  # header on the last line, no sequence
+            yield data[header_start:].rstrip(b'\r\n'), len(data), len(data)
+            return
+        next_header = data.find(b'\n>', header_end)
+        seq_end = len(data) if next_header == -1 else next_header + 1
+        yield data[header_start:header_end].rstrip(b'\r'), header_end + 1, seq_end
+        if next_header == -1:
+            return
+        header_start = next_header + 1
+
+
+def iter_rev_comp_chunks(data, seq_start: int, seq_end: int, chunk_len: int = CHUNK_LEN) -> Iterator[bytes]:
+    """
+    Generator of the reverse complement of a record, reading its sequence lines from the end in chunks
+    @param data: memory map (or bytes) of the FASTA file
+    @param seq_start: Byte offset of the first sequence line
+    @param seq_end: Byte offset just after the last sequence line
+    @param chunk_len: Bytes read at once
+    @return: Iterator of reverse complemented bytes, line ends removed
+    """
+    end = seq_end
+    while end > seq_start:
+        start = max(seq_start, end - chunk_len)
+        yield data[start:end].translate(IUPAC_COMPLEMENT_TABLE, LINE_ENDS)[::-1]
+        end = start
+
+
+def write_wrapped(fh_out: BinaryIO, chunks: Iterator[bytes], line_len: int = 60) -> None:
+    """
+    Write a sequence given in chunks of any size as lines of line_len bases
+    @param fh_out: filehandle opened for writing bytes
+    @param chunks: Iterator of sequence bytes
+    @param line_len: Number of bases per line
+    @return: None
+    """
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        full_lines = len(pending) // line_len * line_len
+        if full_lines:
+            # add the newlines with one NumPy operation instead of one slice per line
+            lines = np.frombuffer(pending, dtype=np.uint8, count=full_lines).reshape(-1, line_len)
+            newlines = np.full((len(lines), 1), ord('\n'), dtype=np.uint8)
+            fh_out.write(np.hstack((lines, newlines)).tobytes())
+            pending = pending[full_lines:]
+    if pending:
+        fh_out.write(pending + b'\n')
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Reverse complement every record of a FASTA file')
+    parser.add_argument('--infile', dest='infile', type=str, required=True,
+                        help='FASTA file to reverse complement, plain or gzip')
+    parser.add_argument('--outfile', dest='outfile', type=str, required=True,
+                        help='FASTA file to write, gzip if it ends with .gz')
+    parser.add_argument('--line_len', dest='line_len', type=int, default=60, help='Bases per output line')
+    parser.add_argument('--header_suffix', dest='header_suffix', type=str, default='',
+                        help='Text added to the end of every header')
+    return parser.parse_args()
+
+
+def test_code():
+    """Test the functions work"""
+    assert rev_comp_bytes(b'ATGCAGCTGTGTTACGCGAT') == b'ATCGCGTAACACAGCTGCAT'
+    # ambiguity codes are complemented, soft-masked lower case stays lower case
+    assert rev_comp_bytes(b'ACGTnnRYacgtKM') == b'KMacgtRYnnACGT'
+
+    fasta = b'>seq1 first\nACGTA\nCCGGr\nNa\n>seq2\r\nTTTT\r\nGG\r\n>empty\n'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        infile = os.path.join(tmp_dir, 'in.fasta.gz')
+        with gzip.open(infile, 'wb') as fh_out:
+            fh_out.write(fasta)
+        outfile = os.path.join(tmp_dir, 'out.fasta')
+        # a tiny chunk_len so the records are read in many chunks
+        reverse_complement_fasta(infile, outfile, line_len=4, header_suffix=' rc', chunk_len=3)
+        with open(outfile, 'rb') as fh_in:
+            assert fh_in.read() == b'>seq1 first rc\ntNyC\nCGGT\nACGT\n>seq2 rc\nCCAA\nAA\n>empty rc\n'
+
+
+if __name__ == '__main__':
+    main()
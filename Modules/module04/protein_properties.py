@@ -0,0 +1,256 @@
+"""
+Molecular weight, length, amino acid composition and invalid residue count of every record of a protein FASTA
+The weights of protein_weights.get_protein_weights become NumPy arrays indexed by the byte of the residue, so a whole
+chunk of records is looked up at once instead of one dict lookup per residue:
+    RESIDUE_CODES[byte]   0-19 for the amino acids in AMINO_ACIDS order (either case), INVALID_CODE for anything else
+    RESIDUE_WEIGHTS[code] weight of the free amino acid, 0 for INVALID_CODE
+The file (plain or gzip) is read in chunks that end on a record boundary, each chunk becomes one block of columns,
+and the blocks are written to the output as they are done, so memory does not grow with the size of the proteome.
+With workers > 1 the chunks are computed in a process pool while the next ones are read:
+    python protein_properties.py --infile pdb_seqres.txt.gz --outfile pdb_seqres.properties.tsv --workers 4
+"""
+import argparse
+import gzip
+import io
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, TextIO
+
+import numpy as np
+
+from protein_weights import get_protein_weights
+
+AMINO_ACIDS = ''.join(sorted(get_protein_weights()))
+INVALID_CODE = len(AMINO_ACIDS)
+WATER_WEIGHT = 18.01528  # lost for every peptide bond, as in Bio.SeqUtils.molecular_weight
+CHUNK_LEN = 1 << 22  # bytes of FASTA computed at once
+WHITESPACE = b' \t\r\n'
+GZIP_MAGIC = b'\x1f\x8b'
+COLUMNS = ['id', 'length', 'molecular_weight', 'invalid'] + list(AMINO_ACIDS) + ['description']
+MALFORMED_FASTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'assignment3',
+                               'pdb_protein_malformed.fasta.gz')
+
+
+def get_residue_codes() -> np.ndarray:
+    """
+    @return: uint8 array of 256, the code of every byte: the position of the amino acid in AMINO_ACIDS, upper or
+             lower case, and INVALID_CODE for every other byte (X, B, Z, U, *, -, ...)
+    """
+    codes = np.full(256, INVALID_CODE, dtype=np.uint8)
+    for code, amino_acid in enumerate(AMINO_ACIDS):
+        codes[ord(amino_acid)] = codes[ord(amino_acid.lower())] = code
+    return codes
+
+
+def get_residue_weights() -> np.ndarray:
+    """
+    @return: float64 array of INVALID_CODE + 1, the weight of every residue code, 0 for INVALID_CODE
+    """
+    weights = get_protein_weights()
+    return np.array([weights[amino_acid] for amino_acid in AMINO_ACIDS] + [0.0])
+
+
+RESIDUE_CODES = get_residue_codes()
+RESIDUE_WEIGHTS = get_residue_weights()
+
+
+def main():
+    """Business Logic"""
+    args = get_cli_args()
+    num_records = write_protein_properties(args.infile, args.outfile, workers=args.workers)
+    print(f"{num_records} records written to {args.outfile}", file=sys.stderr)
+
+
+def write_protein_properties(infile: str = None, outfile: str = None, workers: int = 1,
+                             chunk_len: int = CHUNK_LEN) -> int:
+    """
+    Write the properties of every record of a FASTA file as a TSV with the COLUMNS, one block of rows per chunk
+    @param infile: FASTA file, plain or gzip
+    @param outfile: TSV to write, - for stdout
+    @param workers: Number of worker processes, 1 computes in this process
+    @param chunk_len: Bytes of FASTA per chunk
+    @return: Number of records
+    """
+    num_records = 0
+    out_fh = sys.stdout if outfile == '-' else open(outfile, 'w')
+    try:
+        out_fh.write('\t'.join(COLUMNS) + '\n')
+        for block in iter_protein_properties(infile, workers=workers, chunk_len=chunk_len):
+            write_block(out_fh, block)
+            num_records += len(block['id'])
+    finally:
+        if out_fh is not sys.stdout:
+            out_fh.close()
+    return num_records
+
+
+def iter_protein_properties(infile: str = None, workers: int = 1, chunk_len: int = CHUNK_LEN) -> Iterator[dict]:
+    """
+    Generator of the properties of a FASTA file, a block of columns per chunk, in the order of the file
+    @param infile: FASTA file, plain or gzip
+    @param workers: Number of worker processes, 1 computes in this process
+    @param chunk_len: Bytes of FASTA per chunk
+    @return: Iterator of dictionaries of column -> array, see get_chunk_properties
+    """
+    with _open_binary(infile) as in_fh:
+        chunks = iter_record_chunks(in_fh, chunk_len=chunk_len)
+        if workers == 1:
+            yield from map(get_chunk_properties, chunks)
+            return
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # a couple of chunks per worker in flight, so reading never runs far ahead of the workers
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(get_chunk_properties, chunk))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def iter_record_chunks(in_fh: BinaryIO = None, chunk_len: int = CHUNK_LEN) -> Iterator[bytes]:
+    """
+    Generator of chunks of about chunk_len bytes that hold whole records, every chunk starts with >
+    @param in_fh: FASTA filehandle open for reading bytes
+    @param chunk_len: Bytes read at once, a record longer than this makes a longer chunk
+    @return: Iterator of bytes
+    """
+    buffer = b''
+    while not buffer:  # skip the leading whitespace, even if it fills whole chunks
+        block = in_fh.read(chunk_len)
+        if not block:
+            return
+        buffer = block.lstrip(WHITESPACE)
+    if not buffer.startswith(b'>'):
+        raise ValueError("Sequence data before the first header.  Did you provide a FASTA formatted file?")
+    while buffer:
+        block = in_fh.read(chunk_len)
+        if not block:
+            yield buffer
+            return
+        buffer += block
+        end = buffer.rfind(b'\n>')
+        if end > 0:
+            yield buffer[:end + 1]
+            buffer = buffer[end + 1:]
+
+
+def get_chunk_properties(chunk: bytes = None) -> dict:
+    """
+    Compute the properties of every record of a chunk of whole FASTA records
+    @param chunk: bytes starting with >
+    @return: Dictionary of the COLUMNS -> arrays: id and description (the header split at the first space), length
+             (every residue), molecular_weight (of the valid residues, NaN if there are none), invalid (residues
+             not in AMINO_ACIDS) and the count of every amino acid
+    """
+    records = chunk[1:].split(b'\n>')
+    headers, sequences = [], []
+    for record in records:
+        header, _, sequence = record.partition(b'\n')
+        headers.append(header.strip().decode('utf-8', errors='replace').replace('\t', ' '))
+        sequences.append(sequence.translate(None, WHITESPACE))
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+
+    codes = RESIDUE_CODES[np.frombuffer(b''.join(sequences), dtype=np.uint8)]
+    record_ids = np.repeat(np.arange(len(records), dtype=np.int64), lengths)
+    composition = np.bincount(record_ids * (INVALID_CODE + 1) + codes,
+                              minlength=len(records) * (INVALID_CODE + 1)).reshape(len(records), INVALID_CODE + 1)
+    num_valid = lengths - composition[:, INVALID_CODE]
+    with np.errstate(invalid='ignore'):
+        molecular_weight = np.where(num_valid > 0, composition @ RESIDUE_WEIGHTS - WATER_WEIGHT * (num_valid - 1),
+                                    np.nan)
+
+    ids, descriptions = zip(*(header.partition(' ')[::2] for header in headers))
+    block = {'id': np.array(ids, dtype=object), 'length': lengths, 'molecular_weight': molecular_weight,
+             'invalid': composition[:, INVALID_CODE]}
+    for code, amino_acid in enumerate(AMINO_ACIDS):
+        block[amino_acid] = composition[:, code]
+    block['description'] = np.array([description.strip() for description in descriptions], dtype=object)
+    return block
+
+
+def write_block(out_fh: TextIO = None, block: dict = None) -> None:
+    """
+    Write a block of get_chunk_properties as TSV rows in the COLUMNS order
+    @param out_fh: filehandle open for writing
+    @param block: Dictionary of column -> array
+    @return: None
+    """
+    weights = [f'{weight:.4f}' if weight == weight else '' for weight in block['molecular_weight'].tolist()]
+    columns = [block[column].tolist() if column != 'molecular_weight' else weights for column in COLUMNS]
+    out_fh.writelines('\t'.join(map(str, row)) + '\n' for row in zip(*columns))
+
+
+def _open_binary(file: str = None) -> BinaryIO:
+    """
+    @param file: Path, plain or gzip
+    @return: filehandle reading bytes, decompressed
+    """
+    with open(file, 'rb') as in_fh:
+        is_gzip = in_fh.read(2) == GZIP_MAGIC
+    return gzip.open(file, 'rb') if is_gzip else open(file, 'rb')
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Molecular weight and composition of every record of a protein FASTA')
+    parser.add_argument('--infile', dest='infile', type=str, default=MALFORMED_FASTA,
+                        help='Protein FASTA, plain or gzip')
+    parser.add_argument('--outfile', dest='outfile', type=str, default='-', help='TSV to write, - for stdout')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='Number of worker processes, 0 for every core')
+    return parser.parse_args()
+
+
+def test_code() -> None:
+    """
+    Simple test of the code, against one dict lookup per residue
+    @return: None
+    """
+    weights = get_protein_weights()
+    rng = np.random.default_rng(7)
+    records = [(f'seq{num} chain {num}', ''.join(rng.choice(list(AMINO_ACIDS + 'XacU*'), size=length)))
+               for num, length in enumerate(rng.integers(0, 300, size=200))]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fasta = os.path.join(tmp_dir, 'test.fasta.gz')
+        with gzip.open(fasta, 'wt') as out_fh:
+            for header, sequence in records:
+                out_fh.write(f'>{header}\n' + ''.join(f'{sequence[i:i + 60]}\n' for i in range(0, len(sequence), 60)))
+        outfile = os.path.join(tmp_dir, 'test.tsv')
+        for workers in (1, 2):
+            assert write_protein_properties(fasta, outfile, workers=workers, chunk_len=1000) == len(records)
+            with open(outfile, 'r') as in_fh:
+                assert next(in_fh).rstrip('\n').split('\t') == COLUMNS
+                rows = [line.rstrip('\n').split('\t') for line in in_fh]
+            assert len(rows) == len(records)
+            for row, (header, sequence) in zip(rows, records):
+                valid = [residue.upper() for residue in sequence if residue.upper() in weights]
+                assert row[0] == header.split(' ')[0] and row[-1] == header.split(' ', 1)[1]
+                assert int(row[1]) == len(sequence) and int(row[3]) == len(sequence) - len(valid)
+                if valid:
+                    expected = sum(weights[residue] for residue in valid) - WATER_WEIGHT * (len(valid) - 1)
+                    assert abs(float(row[2]) - expected) < 1e-3
+                else:
+                    assert row[2] == ''
+                assert [int(count) for count in row[4:-1]] == [valid.count(residue) for residue in AMINO_ACIDS]
+
+    # leading blank lines longer than a chunk are skipped, not taken for an empty file
+    blank_lines = b'\n' * 3000 + b'>seq1\nACDE\n>seq2\nFG\n'
+    chunks = list(iter_record_chunks(io.BytesIO(blank_lines), chunk_len=1000))
+    assert b''.join(chunks) == blank_lines.lstrip() and get_chunk_properties(chunks[0])['id'][0] == 'seq1'
+
+    # the malformed file has headers and no sequence: kept, with a length of 0
+    block, = iter_protein_properties(MALFORMED_FASTA)
+    assert list(block['id']) == ['TEST1:A:sequence', 'TEST2:A:sequence', 'TEST3:A:sequence']
+    assert list(block['length']) == [0, 0, 0] and np.isnan(block['molecular_weight']).all()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,9 +17,10 @@ def print_unigene_data_data(file=None):  # noqa: C901  this if for flake8 ignori
     with open(file, "r") as in_fh:
         for line in in_fh:
             line = line.rstrip()
-            # go over the regular expressions that might match
-            for key, reg_exp in reg_exps.items():
-                # match single key-value values below here:
+            # the first word of the line is the key, so only its regular expression can match
+            key = line.split(None, 1)[0] if line else None
+            reg_exp = reg_exps.get(key)
+            if reg_exp:
                 match = reg_exp.match(line)
                 if match:
                     print(f"{key}: {match.group(1)}")
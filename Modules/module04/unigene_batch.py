@@ -0,0 +1,212 @@
+"""
+Batch version of unigene_parser for a directory of per gene UniGene files, like lecture10/UniGenes
+The files are parsed in a pool of workers started once for the whole batch, instead of one interpreter per file, and
+the records are merged into one cluster x field table written at the end:
+    <out_prefix>.tsv          one row per cluster ID, the first file a cluster is seen in wins
+    <out_prefix>.timing.tsv   every file with its number of records, seconds and error, if any
+Threads are enough when the files are on a slow or network file system, processes are faster when the parsing
+itself is the bottleneck:
+    python unigene_batch.py --unigene_dir ../../lecture10/UniGenes --out_prefix unigenes --executor process
+"""
+import argparse
+import csv
+import gzip
+import os
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from unigene_parser import RECORD_END, iter_unigene_records
+
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+SKIP_EXTENSIONS = ('.idx', '.tmp')
+SNIFF_LINES = 20  # lines looked at to decide if a file is a UniGene file
+
+FileResult = namedtuple('FileResult', ['file', 'rows', 'seconds', 'error'])
+
+
+def main():
+    """Business Logic"""
+    args = get_cli_args()
+    files = get_unigene_files(args.unigene_dir)
+    results = run_batch(files, executor=args.executor, workers=args.workers)
+    num_clusters = write_cluster_table(f'{args.out_prefix}.tsv', results)
+    write_timing_table(f'{args.out_prefix}.timing.tsv', results)
+    failed = [result for result in results if result.error]
+    print(f"{len(files)} files, {num_clusters} clusters, {len(failed)} failed, "
+          f"{sum(result.seconds for result in results):.2f} sec of parsing")
+    for result in failed:
+        print(f"{result.file}: {result.error}")
+
+
+def get_unigene_files(unigene_dir: str = None) -> list:
+    """
+    Find the UniGene files under a directory, by their content since they often have no extension
+    @param unigene_dir: Directory, searched recursively
+    @return: sorted list of paths
+    """
+    files = []
+    for dir_path, _, file_names in os.walk(unigene_dir):
+        for file_name in file_names:
+            file = os.path.join(dir_path, file_name)
+            if not file_name.endswith(SKIP_EXTENSIONS) and is_unigene_file(file):
+                files.append(file)
+    return sorted(files)
+
+
+def is_unigene_file(file: str = None) -> bool:
+    """
+    @param file: Path, plain or gzip
+    @return: True if the first non empty line starts with ID or the file starts with a record end
+    """
+    try:
+        with open(file, 'rb') as in_fh:
+            is_gzip = in_fh.read(2) == b'\x1f\x8b'
+        with (gzip.open if is_gzip else open)(file, 'rt', errors='replace') as in_fh:
+            for _, line in zip(range(SNIFF_LINES), in_fh):
+                if line.strip():
+                    return line.startswith('ID ') or line.strip() == RECORD_END
+    except (OSError, EOFError):
+        pass
+    return False
+
+
+def run_batch(files: list = None, executor: str = 'process', workers: int = None) -> list:
+    """
+    Parse every file in a pool, a file that fails is reported and does not stop the others
+    @param files: list of UniGene files
+    @param executor: 'thread' or 'process'
+    @param workers: Number of workers, default is the executor's default
+    @return: list of FileResult, in the order of files
+    """
+    if not files:
+        return []
+    pool_class = EXECUTORS[executor]
+    kwargs = {}
+    if pool_class is ProcessPoolExecutor:
+        # tens of thousands of small files, send them to the processes in chunks
+        workers = workers or os.cpu_count() or 1
+        kwargs['chunksize'] = max(1, len(files) // (workers * 4))
+    with pool_class(max_workers=workers) as pool:
+        return list(pool.map(parse_unigene_file, files, **kwargs))
+
+
+def parse_unigene_file(file: str = None) -> FileResult:
+    """
+    Worker: parse one file into flat rows
+    @param file: UniGene file
+    @return: FileResult, with the error instead of the rows when parsing failed
+    """
+    start = time.perf_counter()
+    try:
+        rows = [record_to_row(record) for record in iter_unigene_records(file)]
+        error = None
+    except Exception as err:  # pylint: disable=broad-except
+        # one bad file must not stop the batch
+        rows, error = [], f'{type(err).__name__}: {err}'
+    return FileResult(file, rows, time.perf_counter() - start, error)
+
+
+def record_to_row(record: dict = None) -> dict:
+    """
+    Flatten a record of unigene_parser into one row of the cluster table
+    @param record: Dictionary of a UniGene record
+    @return: Dictionary of column -> text.  Lists of tissues and repeated text fields are joined with |, the
+             repeated key-value fields (PROTSIM, SEQUENCE, STS, TXMAP) are counted in a <field>_count column
+    """
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, list):
+            if value and isinstance(value[0], dict):
+                row[f'{key}_count'] = len(value)
+            else:
+                row[key] = '|'.join(value)
+        else:
+            row[key] = value
+    return row
+
+
+def write_cluster_table(out_file: str = None, results: list = None) -> int:
+    """
+    Write the merged cluster x field table, once
+    @param out_file: TSV to write
+    @param results: list of FileResult
+    @return: Number of clusters written
+    """
+    clusters = {}
+    for result in results:
+        for row in result.rows:
+            if row.get('ID') not in clusters:
+                clusters[row.get('ID')] = dict(row, file=result.file)
+    columns = {'ID': None, 'GENE': None}  # columns in the order first seen, ID and GENE first
+    for row in clusters.values():
+        columns.update(dict.fromkeys(row))
+    with open(out_file, 'w', newline='') as out_fh:
+        writer = csv.DictWriter(out_fh, fieldnames=list(columns), delimiter='\t', restval='', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(clusters.values())
+    return len(clusters)
+
+
+def write_timing_table(out_file: str = None, results: list = None) -> None:
+    """
+    @param out_file: TSV to write
+    @param results: list of FileResult
+    @return: None
+    """
+    with open(out_file, 'w', newline='') as out_fh:
+        writer = csv.writer(out_fh, delimiter='\t', lineterminator='\n')
+        writer.writerow(['file', 'records', 'seconds', 'error'])
+        for result in results:
+            writer.writerow([result.file, len(result.rows), f'{result.seconds:.6f}', result.error or ''])
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Parse a directory of UniGene files into one table')
+    parser.add_argument('--unigene_dir', dest='unigene_dir', type=str, default='../../lecture10/UniGenes',
+                        help='Directory with the UniGene files, searched recursively')
+    parser.add_argument('--out_prefix', dest='out_prefix', type=str, default='unigenes',
+                        help='Writes <out_prefix>.tsv and <out_prefix>.timing.tsv')
+    parser.add_argument('--executor', dest='executor', choices=sorted(EXECUTORS), default='process',
+                        help='thread for I/O bound (e.g. network storage), process for CPU bound parsing')
+    parser.add_argument('--workers', dest='workers', type=int, default=None, help='Number of workers')
+    return parser.parse_args()
+
+
+def test_code(unigene_dir: str = '../../lecture10/UniGenes') -> None:
+    """
+    Simple test of the code
+    @param unigene_dir: Directory with the ADH2, CEACAM4, GLDC and TGM1 files
+    @return: None
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, 'broken'), 'w') as out_fh:
+            out_fh.write('ID          Hs.1\nSCOUNT      many\n//\n')
+        with open(os.path.join(tmp_dir, 'notes.txt'), 'w') as out_fh:
+            out_fh.write('not a UniGene file\n')
+        files = get_unigene_files(unigene_dir) + get_unigene_files(tmp_dir)
+        assert len(files) == 9
+        for executor in EXECUTORS:
+            results = run_batch(files, executor=executor, workers=2)
+            assert [result.file for result in results] == files
+            failed = [result for result in results if result.error]
+            assert len(failed) == 1 and failed[0].file.endswith('broken') and 'ValueError' in failed[0].error
+            out_prefix = os.path.join(tmp_dir, executor)
+            assert write_cluster_table(f'{out_prefix}.tsv', results) == 4
+            write_timing_table(f'{out_prefix}.timing.tsv', results)
+            with open(f'{out_prefix}.tsv', 'r') as in_fh:
+                rows = {row['GENE']: row for row in csv.DictReader(in_fh, delimiter='\t')}
+            assert sorted(rows) == ['ADH2', 'CEACAM4', 'GLDC', 'TGM1']
+            assert rows['TGM1']['ID'] == 'Hs.22' and rows['TGM1']['SEQUENCE_count'] == '24'
+            assert rows['CEACAM4']['EXPRESS'] == 'colon' and rows['CEACAM4']['TXMAP_count'] != ''
+            with open(f'{out_prefix}.timing.tsv', 'r') as in_fh:
+                assert len(in_fh.readlines()) == 10
+
+
+if __name__ == '__main__':
+    main()
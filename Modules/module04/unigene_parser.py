@@ -0,0 +1,267 @@
+"""
+Streaming parser of UniGene cluster files, like TGM1.unigene or the lecture10/UniGenes files
+Every line is "KEY value", and a record ends with "//".  Instead of trying every regular expression of
+regular_expression_example.get_compiled_regex on every line, the first token of the line picks its parser from
+FIELD_PARSERS with one dict lookup.  The repeated fields (PROTSIM, SEQUENCE, STS, TXMAP) are collected into lists
+of dictionaries and EXPRESS into a list of tissues.
+UniGeneIndex keeps the byte offset of every cluster ID in a file next to the UniGene file, so one cluster is read
+from a large dump with a seek instead of a scan:
+    python unigene_parser.py --infile Hs.data --cluster_id Hs.508950
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import tempfile
+from typing import BinaryIO, Iterator, Optional
+
+RECORD_END = '//'
+INDEX_SUFFIX = '.idx'
+EXPRESS_SEPARATOR_RE = re.compile(r'[|;]')
+
+
+def main():
+    """Business Logic"""
+    args = get_cli_args()
+    if args.cluster_id:
+        record = UniGeneIndex(args.infile).get(args.cluster_id)
+        if record is None:
+            raise SystemExit(f"{args.cluster_id} is not in {args.infile}")
+        print(json.dumps(record, indent=2))
+    else:
+        for record in iter_unigene_records(args.infile):
+            print(record['ID'], record.get('GENE', ''), record.get('TITLE', ''), sep='\t')
+
+
+def iter_unigene_records(file: str = None) -> Iterator[dict]:
+    """
+    Generator of the records of a UniGene file, plain or gzip, one record in memory at a time
+    @param file: Path to the UniGene file
+    @return: Iterator of dictionaries, see parse_unigene_lines
+    """
+    opener = gzip.open if _is_gzip(file) else open
+    with opener(file, 'rt') as in_fh:
+        yield from parse_unigene_lines(in_fh)
+
+
+def parse_unigene_lines(lines: Iterator[str] = None) -> Iterator[dict]:
+    """
+    Generator of the records of UniGene lines
+    @param lines: Iterator of lines, e.g. an open filehandle
+    @return: Iterator of dictionaries of KEY -> value.  The repeated fields are lists of dictionaries, EXPRESS a
+             list of tissues, SCOUNT an int, and every other field a str (a list of str if it is repeated)
+    """
+    record = {}
+    for line in lines:
+        key, _, value = line.rstrip('\r\n').partition(' ')
+        if key == RECORD_END:
+            if record:
+                yield record
+            record = {}
+        elif key:
+            FIELD_PARSERS.get(key, _add_text)(record, key, value.strip())
+    if record:  # last record without //
+        yield record
+
+
+class UniGeneIndex:
+    """Random access to the records of an uncompressed UniGene file by cluster ID"""
+
+    def __init__(self, file: str = None, index_file: str = None):
+        """
+        Load the index of the file, building it first when it is missing or older than the file
+        @param file: Path to the UniGene file
+        @param index_file: Path of the index, default is the file with .idx added
+        """
+        if _is_gzip(file):
+            raise ValueError(f"{file} is gzip compressed, the index needs an uncompressed file to seek in")
+        self.file = file
+        self.index_file = index_file or file + INDEX_SUFFIX
+        self.offsets = self._load()
+        if self.offsets is None:
+            self.offsets = build_unigene_index(file, self.index_file)
+
+    def __len__(self) -> int:
+        """Number of records"""
+        return len(self.offsets)
+
+    def __contains__(self, cluster_id: str) -> bool:
+        return cluster_id in self.offsets
+
+    def get(self, cluster_id: str) -> Optional[dict]:
+        """
+        @param cluster_id: UniGene cluster ID, e.g. Hs.508950
+        @return: the record, or None when the ID is not in the file
+        """
+        span = self.offsets.get(cluster_id)
+        if span is None:
+            return None
+        offset, length = span
+        with open(self.file, 'rb') as in_fh:
+            in_fh.seek(offset)
+            lines = in_fh.read(length).decode('utf-8').splitlines()
+        return next(parse_unigene_lines(lines))
+
+    def _load(self) -> Optional[dict]:
+        """
+        @return: Dict of cluster ID -> (offset, length) from the index file, None if it is missing or stale
+        """
+        try:
+            with open(self.index_file, 'r') as in_fh:
+                size, mtime = in_fh.readline().split('\t')
+                stat = os.stat(self.file)
+                if int(size) != stat.st_size or float(mtime) != stat.st_mtime:
+                    return None
+                return {cluster_id: (int(offset), int(length))
+                        for cluster_id, offset, length in (line.rstrip('\n').split('\t') for line in in_fh)}
+        except (OSError, ValueError):
+            return None
+
+
+def build_unigene_index(file: str = None, index_file: str = None) -> dict:
+    """
+    Scan a UniGene file once for the byte range of every record and write the index
+    Index file: a first line with the size and mtime of the UniGene file, then one "ID<tab>offset<tab>length" line
+    per record
+    @param file: Path to the uncompressed UniGene file
+    @param index_file: Path of the index to write, default is the file with .idx added
+    @return: Dict of cluster ID -> (offset, length)
+    """
+    with open(file, 'rb') as in_fh:
+        offsets = dict(_iter_record_spans(in_fh))
+    stat = os.stat(file)
+    index_file = index_file or file + INDEX_SUFFIX
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(index_file)), suffix='.tmp',
+                                     delete=False) as out_fh:
+        out_fh.write(f'{stat.st_size}\t{stat.st_mtime!r}\n')
+        out_fh.writelines(f'{cluster_id}\t{offset}\t{length}\n' for cluster_id, (offset, length) in offsets.items())
+    os.replace(out_fh.name, index_file)
+    return offsets
+
+
+def _iter_record_spans(in_fh: BinaryIO = None) -> Iterator[tuple]:
+    """
+    @param in_fh: UniGene file open for reading bytes
+    @return: Iterator of (cluster ID, (offset, length)), only the ID lines are decoded
+    """
+    start = offset = 0
+    cluster_id = None
+    for line in in_fh:
+        if line.startswith(b'ID '):
+            cluster_id = line[3:].strip().decode('utf-8')
+        offset += len(line)
+        if line.rstrip(b'\r\n') == RECORD_END.encode():
+            if cluster_id is not None:
+                yield cluster_id, (start, offset - start)
+            start, cluster_id = offset, None
+    if cluster_id is not None:  # last record without //
+        yield cluster_id, (start, offset - start)
+
+
+def _add_text(record: dict, key: str, value: str) -> None:
+    """Single text fields, e.g. ID or GENE, a list if the key is repeated"""
+    if key not in record:
+        record[key] = value
+    elif isinstance(record[key], list):
+        record[key].append(value)
+    else:
+        record[key] = [record[key], value]
+
+
+def _add_key_values(record: dict, key: str, value: str) -> None:
+    """Repeated "K1=V1; K2=V2" fields like PROTSIM and SEQUENCE, a part without = is kept as INTERVAL (TXMAP)"""
+    fields = {}
+    for part in value.split(';'):
+        name, equals, part_value = part.strip().partition('=')
+        if equals:
+            fields[name] = part_value
+        elif name:
+            fields['INTERVAL'] = name
+    record.setdefault(key, []).append(fields)
+
+
+def _add_sts(record: dict, key: str, value: str) -> None:
+    """Repeated "ACC=G07152 NAME=D14S1225 UNISTS=31136" fields, separated by spaces instead of ;"""
+    record.setdefault(key, []).append(dict(part.partition('=')[::2] for part in value.split()))
+
+
+def _add_express(record: dict, key: str, value: str) -> None:
+    """Tissues separated by | (or ; in older builds)"""
+    record.setdefault(key, []).extend(tissue.strip() for tissue in EXPRESS_SEPARATOR_RE.split(value)
+                                      if tissue.strip())
+
+
+def _add_count(record: dict, key: str, value: str) -> None:
+    """SCOUNT, the number of SEQUENCE lines"""
+    record[key] = int(value)
+
+
+# leading token of a line -> function adding its value to the record, unknown keys are kept as text
+FIELD_PARSERS = {
+    'PROTSIM': _add_key_values,
+    'SEQUENCE': _add_key_values,
+    'TXMAP': _add_key_values,
+    'STS': _add_sts,
+    'EXPRESS': _add_express,
+    'SCOUNT': _add_count,
+}
+
+
+def _is_gzip(file: str = None) -> bool:
+    """
+    @param file: Path
+    @return: True if the file starts with the gzip magic bytes
+    """
+    with open(file, 'rb') as in_fh:
+        return in_fh.read(2) == b'\x1f\x8b'
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Parse a UniGene file, or get one cluster from it')
+    parser.add_argument('--infile', dest='infile', type=str, default='TGM1.unigene', help='UniGene file')
+    parser.add_argument('--cluster_id', dest='cluster_id', type=str,
+                        help='Print only this cluster, with the byte offset index (built on first use)')
+    return parser.parse_args()
+
+
+def test_code(file: str = 'TGM1.unigene') -> None:
+    """
+    Simple test of the code
+    @param file: UniGene file with the TGM1 cluster
+    @return: None
+    """
+    record, = iter_unigene_records(file)
+    assert record['ID'] == 'Hs.508950' and record['GENE'] == 'TGM1' and record['SCOUNT'] == 105
+    assert len(record['SEQUENCE']) == 105 and len(record['PROTSIM']) == 35
+    assert record['PROTSIM'][0] == {'ORG': '9986', 'PROTGI': '291403635', 'PROTID': 'XP_002718148.1',
+                                    'PCT': '94.13', 'ALN': '816'}
+    assert record['STS'][1] == {'ACC': 'D14S1225', 'UNISTS': '31136'}
+    assert record['EXPRESS'][:2] == ['adipose tissue', 'bladder'] and record['EXPRESS'][-1] == 'adult'
+
+    lines = ['ID          Hs.12', 'GENE        CEACAM4', 'EXPRESS     colon',
+             'TXMAP       D19S425-D19S418; MARKER=sts-D90276; RHPANEL=GB4', '//',
+             'ID          Hs.22', 'EXPRESS     ;Esophagus;Germ Cell', 'SCOUNT      1']
+    first, second = parse_unigene_lines(lines)
+    assert first['TXMAP'] == [{'INTERVAL': 'D19S425-D19S418', 'MARKER': 'sts-D90276', 'RHPANEL': 'GB4'}]
+    assert second == {'ID': 'Hs.22', 'EXPRESS': ['Esophagus', 'Germ Cell'], 'SCOUNT': 1}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dump = os.path.join(tmp_dir, 'Hs.data')
+        with open(dump, 'w') as out_fh, open(file, 'r') as in_fh:
+            out_fh.write('\n'.join(lines) + '\n//\n' + in_fh.read())
+        index = UniGeneIndex(dump)
+        assert len(index) == 3 and 'Hs.12' in index and index.get('Hs.0') is None
+        assert index.get('Hs.508950') == record and index.get('Hs.22') == second
+        # a second index loads the file written by the first
+        assert UniGeneIndex(dump).offsets == index.offsets
+        with open(dump + INDEX_SUFFIX, 'r') as in_fh:
+            assert len(in_fh.readlines()) == 4
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Reproducible benchmarks for the kmer counters, the reverse complement functions and FASTA parsing
+    python benchmark_suite.py run --output results.json
+    python benchmark_suite.py compare --baseline timings.tsv --current results.json
+Every workload is run once to warm up and then repeated, the median and inter-quartile range (IQR) of the
+time.perf_counter timings are reported, and the peak memory is measured with tracemalloc in one extra run.
+Inputs are made from a fixed seed so two runs time the same data.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from functools import partial
+from itertools import product
+
+from count_kmers1 import count_trinucleotides
+from count_kmers2 import count_kmer
+from fasta_reader import read_fasta
+from motif_search import MotifAutomaton
+from packed_kmers import count_kmers_packed
+from utils import generate_random_dna
+
+DEFAULT_SEED = 42
+DEFAULT_REPEATS = 5
+DEFAULT_THRESHOLD = 0.10  # flag a regression when the median is more than 10% slower than the baseline
+MODULE02_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'module02')
+
+# name -> (function to time, function making its arguments from (size, seed), default sizes)
+WORKLOADS = {}
+_TEMP_FILES = []  # input files written by the workloads, removed at the end of run_benchmarks
+
+
+def main() -> None:
+    """Business Logic"""
+    args = get_cli_args()
+    if args.command == 'run':
+        results = run_benchmarks(workloads=args.workloads, sizes=args.sizes, repeats=args.repeats, seed=args.seed)
+        write_results(results, args.output)
+        print_results(results['results'])
+    else:
+        regressions = compare_results(baseline=load_results(args.baseline), current=load_results(args.current),
+                                      threshold=args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+
+
+def register_workload(name: str, function, make_args, sizes: tuple) -> None:
+    """
+    Add a workload to the suite
+    @param name: Name of the workload, used in the results and to match the baseline
+    @param function: Function to time
+    @param make_args: Function of (size, seed) returning the tuple of arguments for function
+    @param sizes: Default input sizes
+    @return: None
+    """
+    WORKLOADS[name] = (function, make_args, sizes)
+
+
+def random_dna(size: int, seed: int = DEFAULT_SEED) -> tuple:
+    """
+    @param size: Length of the DNA string
+    @param seed: Seed for the random numbers
+    @return: Tuple with one random DNA string
+    """
+    return (generate_random_dna(size, seed=seed).decode('ascii'),)
+
+
+def random_fasta_file(size: int, seed: int = DEFAULT_SEED) -> tuple:
+    """
+    Write a random FASTA file of 10 records wrapped at 60 bases, the file is removed when the suite exits
+    @param size: Total number of bases
+    @param seed: Seed for the random numbers
+    @return: Tuple with the path of the FASTA file
+    """
+    dna = random_dna(size, seed)[0]
+    record_len = max(1, size // 10)
+    with tempfile.NamedTemporaryFile('w', suffix='.fasta', delete=False) as out_fh:
+        for record, start in enumerate(range(0, size, record_len)):
+            seq = dna[start:start + record_len]
+            out_fh.write(f">record{record}\n")
+            out_fh.write('\n'.join(seq[i:i + 60] for i in range(0, len(seq), 60)) + '\n')
+    _TEMP_FILES.append(out_fh.name)
+    return (out_fh.name,)
+
+
+def _parse_fasta_file(file: str) -> int:
+    """
+    @param file: FASTA file to parse
+    @return: Number of records
+    """
+    return sum(1 for _ in read_fasta(file))
+
+
+def _reverse_complement_file(file: str) -> None:
+    """
+    @param file: FASTA file to reverse complement into a temporary file
+    @return: None
+    """
+    from rev_comp_fasta import reverse_complement_fasta  # module02 is on the path after _load_module02
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reverse_complement_fasta(file, os.path.join(tmp_dir, 'rev_comp.fasta'))
+
+
+def _load_module02():
+    """
+    Import module02/compare_rev_comp_dna.py, it is not on the path of this directory
+    @return: module
+    """
+    if MODULE02_DIR not in sys.path:
+        sys.path.append(MODULE02_DIR)  # for the modules compare_rev_comp_dna imports
+    spec = importlib.util.spec_from_file_location('compare_rev_comp_dna',
+                                                  os.path.join(MODULE02_DIR, 'compare_rev_comp_dna.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _register_default_workloads() -> None:
+    """
+    The workloads of this repository.  Names of the kmer counters match the columns of timings.tsv
+    @return: None
+    """
+    register_workload('count_trinucleotides', count_trinucleotides, random_dna, (20_000, 200_000))
+    trinucleotides = MotifAutomaton(''.join(bases) for bases in product('ACGT', repeat=3))
+    register_workload('count_trinucleotides_motif', trinucleotides.count, random_dna, (20_000, 200_000, 2_000_000))
+    register_workload('count_kmer', partial(count_kmer, cache=False), random_dna, (20_000, 200_000, 2_000_000))
+    register_workload('count_kmer_packed', partial(count_kmer, packed=True, cache=False), random_dna,
+                      (20_000, 200_000, 2_000_000))
+    register_workload('count_kmers_packed_k21', partial(count_kmers_packed, kmer_len=21), random_dna,
+                      (200_000, 2_000_000))
+    rev_comp = _load_module02()
+    register_workload('rev_comp1', rev_comp.rev_comp1, random_dna, (200_000, 2_000_000))
+    register_workload('rev_comp2', rev_comp.rev_comp2, random_dna, (20_000, 200_000))
+    register_workload('rev_comp3', rev_comp.rev_comp3, random_dna, (200_000, 2_000_000))
+    register_workload('read_fasta', _parse_fasta_file, random_fasta_file, (200_000, 2_000_000))
+    register_workload('reverse_complement_fasta', _reverse_complement_file, random_fasta_file,
+                      (200_000, 2_000_000))
+
+
+def run_benchmarks(workloads: list = None, sizes: list = None, repeats: int = DEFAULT_REPEATS,
+                   seed: int = DEFAULT_SEED) -> dict:
+    """
+    Run the workloads
+    @param workloads: Names of the workloads to run, default is all of them
+    @param sizes: Input sizes to use instead of the default sizes of each workload
+    @param repeats: Number of timed runs of each workload and size
+    @param seed: Seed for the inputs
+    @return: Dictionary with the run information and a list of results
+    """
+    if not WORKLOADS:
+        _register_default_workloads()
+    unknown = set(workloads or []) - set(WORKLOADS)
+    if unknown:
+        raise ValueError(f"Unknown workloads: {', '.join(sorted(unknown))}.  Known: {', '.join(WORKLOADS)}")
+    random.seed(seed)
+    results = []
+    try:
+        for name in workloads or WORKLOADS:
+            function, make_args, default_sizes = WORKLOADS[name]
+            for size in sizes or default_sizes:
+                results.append(time_workload(name, function, make_args(size, seed), size=size, repeats=repeats))
+    finally:
+        while _TEMP_FILES:
+            os.remove(_TEMP_FILES.pop())
+    return {'meta': {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'processor': platform.processor(),
+                     'seed': seed,
+                     'repeats': repeats},
+            'results': results}
+
+
+def time_workload(name: str, function, args: tuple, size: int = 0, repeats: int = DEFAULT_REPEATS) -> dict:
+    """
+    Time one workload: one warm up run, repeats timed runs, then one run under tracemalloc for the peak memory
+    @param name: Name of the workload
+    @param function: Function to time
+    @param args: Tuple of arguments for function
+    @param size: Input size, only recorded
+    @param repeats: Number of timed runs
+    @return: Dictionary of the result
+    """
+    function(*args)  # warm up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    quartiles = statistics.quantiles(timings, n=4) if len(timings) > 1 else [timings[0]] * 3
+    return {'workload': name,
+            'size': size,
+            'median': statistics.median(timings),
+            'iqr': quartiles[2] - quartiles[0],
+            'min': min(timings),
+            'max': max(timings),
+            'repeats': repeats,
+            'peak_memory_bytes': peak}
+
+
+def write_results(results: dict, file: str = None) -> None:
+    """
+    @param results: Dictionary from run_benchmarks
+    @param file: JSON file to write
+    @return: None
+    """
+    with open(file, 'w') as out_fh:
+        json.dump(results, out_fh, indent=2)
+
+
+def load_results(file: str = None) -> list:
+    """
+    Load results from a JSON file written by this suite, or from a TSV in the format of timings.tsv, i.e. a
+    length column and one column of seconds per function
+    @param file: JSON or TSV file
+    @return: list of result dictionaries with at least workload, size and median
+    """
+    if file.endswith('.json'):
+        with open(file, 'r') as in_fh:
+            return json.load(in_fh)['results']
+    results = []
+    with open(file, 'r') as in_fh:
+        columns = in_fh.readline().rstrip('\n').split('\t')
+        for line in in_fh:
+            values = line.rstrip('\n').split('\t')
+            results.extend({'workload': column, 'size': int(values[0]), 'median': float(value)}
+                           for column, value in zip(columns[1:], values[1:]))
+    return results
+
+
+def compare_results(baseline: list = None, current: list = None, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """
+    Print the current medians next to the baseline and flag the regressions.
+    Only workload and size pairs found in both are compared
+    @param baseline: list of result dictionaries
+    @param current: list of result dictionaries
+    @param threshold: Fraction slower than the baseline that counts as a regression
+    @return: list of the regressed (workload, size)
+    """
+    baseline_medians = {(result['workload'], result['size']): result['median'] for result in baseline}
+    regressions = []
+    print(f"{'workload':<24s} {'size':>11s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for result in current:
+        key = (result['workload'], result['size'])
+        if key not in baseline_medians:
+            continue
+        ratio = result['median'] / baseline_medians[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f"{key[0]:<24s} {key[1]:>11d} {baseline_medians[key]:>10.4f} {result['median']:>10.4f} "
+              f"{ratio:>7.2f}{flag}")
+    return regressions
+
+
+def print_results(results: list) -> None:
+    """
+    @param results: list of result dictionaries
+    @return: None
+    """
+    print(f"{'workload':<24s} {'size':>11s} {'median_s':>10s} {'iqr_s':>10s} {'peak_MB':>9s}")
+    for result in results:
+        print(f"{result['workload']:<24s} {result['size']:>11d} {result['median']:>10.4f} {result['iqr']:>10.4f} "
+              f"{result['peak_memory_bytes'] / 1e6:>9.1f}")
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the kmer counting, reverse complement and FASTA code')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks and write a JSON result file')
+    run_parser.add_argument('--output', dest='output', type=str, required=True, help='JSON file to write')
+    run_parser.add_argument('--workloads', dest='workloads', nargs='+', help='Workloads to run, default all')
+    run_parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', help='Input sizes, default per workload')
+    run_parser.add_argument('--repeats', dest='repeats', type=int, default=DEFAULT_REPEATS,
+                            help='Timed runs per workload and size')
+    run_parser.add_argument('--seed', dest='seed', type=int, default=DEFAULT_SEED, help='Seed for the inputs')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare a result file against a baseline')
+    compare_parser.add_argument('--baseline', dest='baseline', type=str, required=True,
+                                help='Baseline JSON result file, or a TSV like timings.tsv')
+    compare_parser.add_argument('--current', dest='current', type=str, required=True,
+                                help='JSON result file to check')
+    compare_parser.add_argument('--threshold', dest='threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='Fraction slower than the baseline that is flagged as a regression')
+
+    return parser.parse_args()
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    results = run_benchmarks(workloads=['count_kmer', 'rev_comp3', 'read_fasta'], sizes=[1000], repeats=3)
+    assert [result['workload'] for result in results['results']] == ['count_kmer', 'rev_comp3', 'read_fasta']
+    assert all(result['median'] > 0 and result['peak_memory_bytes'] > 0 for result in results['results'])
+    assert random_dna(100, seed=1) == random_dna(100, seed=1)
+
+    baseline = [{'workload': 'count_kmer', 'size': 1000, 'median': results['results'][0]['median'] / 2}]
+    assert compare_results(baseline=baseline, current=results['results']) == [('count_kmer', 1000)]
+
+
+if __name__ == '__main__':
+    main()
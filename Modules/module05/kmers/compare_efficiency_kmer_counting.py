@@ -1,5 +1,7 @@
 """Comparing the efficiency of the two ways of counting kmers"""
 import time
+from functools import partial
+
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
@@ -19,15 +21,17 @@ def run_code():
     # using these values in mlutiple places, so create variables for them
     version1 = "count_trinucleotides"
     version2 = "count_kmer"
+    version3 = "count_kmer_packed"
     length = "length"
     seconds = "seconds"
     cols = "algorithm"
     # create a dataframe
     # pylint: disable=C0103
-    df = pd.DataFrame(columns=[length, version1, version2])
+    df = pd.DataFrame(columns=[length, version1, version2, version3])
     # Go over each size for the DNA sequence
     for length_dna in [20_000, 200_000, 2_000_000, 20_000_000, 200_000_000]:
-        functions = {version1: count_trinucleotides, version2: count_kmer}
+        functions = {version1: count_trinucleotides, version2: partial(count_kmer, cache=False),
+                     version3: partial(count_kmer, packed=True, cache=False)}
         # get the random dna sequence
         dna = generate_random_dna_str(length_dna, 'ACGT')
         # store a timings dictionary that will be converted to a data frame
@@ -41,10 +45,7 @@ def run_code():
             timings_dict[key] = cpu_time
 
         # create a temporary dataframe
-        df_temp = pd.DataFrame([{length: timings_dict[length],
-                                 version1: timings_dict[version1],
-                                 version2: timings_dict[version2]}
-                                ])
+        df_temp = pd.DataFrame([timings_dict])
         # concatenate the dataframes
         df = pd.concat([df, df_temp], ignore_index=True)
     print(df)
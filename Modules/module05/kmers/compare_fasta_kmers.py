@@ -6,51 +6,117 @@ import argparse
 import sys
 from typing import TextIO
 
-from count_kmers2 import count_kmer
+import pandas as pd
+
+from fasta_reader import read_fasta
+from genome_index import build_index, compare_all, get_fasta_files, query_index
+from kmer_cache import get_default_cache
+from kmer_sketch import containment_estimate, jaccard_index_estimate, sketch_sequence
+from multi_k import compare_kmer_range
 
 
 def main():
     """
     Business Logic
     Assumptions here:  Each FASTA file provided at the command line only has 1 sequence in it, since only the first
-    sequence in the file will be analyzed
+    sequence in the file will be analyzed.  Files can be plain text or gzip
     """
     args = get_cli_args()
+    if args.genome_dir or args.manifest or args.query:
+        run_index_mode(args)
+        return
     infile1, infile2 = args.infile1, args.infile2
 
-    fh_in1 = get_filehandle(file=infile1, mode="r")
-    # get the two lists of data for the first file
-    _, seqs1 = get_fasta_lists(fh_in1)
+    # only the first record of each file is needed, so stop reading after it
+    seq1 = _get_first_sequence(infile1)
+    seq2 = _get_first_sequence(infile2)
 
-    fh_in2 = get_filehandle(file=infile2, mode="r")
-    # get the two lists of data for the second file
-    _, seqs2 = get_fasta_lists(fh_in2)
+    if args.sketch_size or args.scaled:
+        compare_genome_sketches(seq1=seq1, seq2=seq2, canonical=args.canonical,
+                                sketch_size=args.sketch_size, scaled=args.scaled)
+    else:
+        compare_genomes(seq1=seq1, seq2=seq2, canonical=args.canonical, cache=not args.no_cache)
 
-    fh_in1.close()
-    fh_in2.close()
 
-    compare_genomes(seq1=seqs1[0], seq2=seqs2[0])
+def run_index_mode(args: argparse.Namespace) -> None:
+    """
+    Many genomes at once: build (or update) the sketch index and write the all-vs-all matrices,
+    or compare a query genome against an existing index
+    @param args: Instance of argparse arguments
+    @return: None
+    """
+    if args.genome_dir or args.manifest:
+        fasta_files = get_fasta_files(genome_dir=args.genome_dir, manifest=args.manifest)
+        build_index(fasta_files, args.index_dir, kmer_len=args.kmer_len, num_hashes=args.sketch_size or 1000,
+                    scaled=args.scaled, canonical=args.canonical, workers=args.workers)
+        compare_all(args.index_dir, workers=args.workers)
+        print(f"Wrote jaccard and containment matrices for {len(fasta_files)} genomes to {args.index_dir}")
+    if args.query:
+        print(query_index(args.index_dir, args.query).to_csv(sep='\t', index=False, float_format='%.4f'), end='')
 
 
-def compare_genomes(seq1: str, seq2: str) -> None:
+def _get_first_sequence(file: str = None) -> str:
+    """
+    Get the sequence of the first record in a FASTA file (plain or gzip)
+    @param file: Path to the FASTA file
+    @return: DNA sequence
     """
-    Go over each FASTA sequence and compare them using kmers
+    try:
+        for _, seq in read_fasta(file):
+            return seq
+    except ValueError as err:
+        sys.exit(str(err))
+    sys.exit(f"No FASTA records found in {file}")
+
+
+def compare_genomes(seq1: str, seq2: str, canonical: bool = False, sig_dig: int = 4,
+                    cache: bool = False) -> pd.DataFrame:
+    """
+    Go over each FASTA sequence and compare them using kmers.
+    All kmer lengths are done together by multi_k.compare_kmer_range, so the sequences are only scanned once
     @param seq1: DNA seq1
     @param seq2: DNA seq2
-    @return: None
+    @param canonical: Compare canonical kmers, so a genome and its reverse complement are the same
+    @param sig_dig: Significant digits to round to
+    @param cache: Take the kmers of long sequences from the on-disk kmer_cache, counting them only when missing
+    @return: DataFrame with one row per kmer length
     """
     # go over different kmer lengths and find the jaccard index and jaccard containment
-    for kmer_len in range(2, 31, 1):
-        # get the counts
-        counts1 = count_kmer(seq1, kmer_len=kmer_len).keys()  # get all k-mers
-        counts2 = count_kmer(seq2, kmer_len=kmer_len).keys()  # get all k-mers
-
+    table = compare_kmer_range(seq1, seq2, kmer_lens=range(2, 31, 1), canonical=canonical,
+                               cache=get_default_cache() if cache else None)
+    for row in table.itertuples(index=False):
         # print out the jaccard index
-        print(f"kmer_len: {kmer_len}, "
-              f"jaccard_index: {jaccard_index(container1=counts1, container2=counts2)}")
+        print(f"kmer_len: {row.kmer_len}, "
+              f"jaccard_index: {round(row.jaccard_index, sig_dig)}")
         # print out the jaccard containment
-        print(f"kmer_len: {kmer_len}, "
-              f"jaccard_containment: {jaccard_containment(container1=counts1, container2=counts2)}")
+        print(f"kmer_len: {row.kmer_len}, "
+              f"jaccard_containment: {round(row.jaccard_containment, sig_dig)}")
+    return table
+
+
+def compare_genome_sketches(seq1: str, seq2: str, canonical: bool = False, sketch_size: int = 1000,
+                            scaled: int = 0, sig_dig: int = 4) -> None:
+    """
+    Same as compare_genomes, but estimate the jaccard index and jaccard containment from MinHash sketches
+    instead of comparing the full sets of kmers
+    @param seq1: DNA seq1
+    @param seq2: DNA seq2
+    @param canonical: Compare canonical kmers, so a genome and its reverse complement are the same
+    @param sketch_size: Number of hashes to keep for a bottom-s MinHash sketch
+    @param scaled: Use a FracMinHash sketch keeping about 1/scaled of the kmers instead of bottom-s
+    @param sig_dig: Significant digits to round to
+    @return: None
+    """
+    for kmer_len in range(2, 31, 1):
+        sketch1 = sketch_sequence(seq1, kmer_len=kmer_len, num_hashes=sketch_size, scaled=scaled,
+                                  canonical=canonical)
+        sketch2 = sketch_sequence(seq2, kmer_len=kmer_len, num_hashes=sketch_size, scaled=scaled,
+                                  canonical=canonical)
+
+        for name, estimate in (("jaccard_index", jaccard_index_estimate(sketch1, sketch2)),
+                               ("jaccard_containment", containment_estimate(sketch1, sketch2))):
+            print(f"kmer_len: {kmer_len}, {name}: {round(estimate.value, sig_dig)} "
+                  f"(95% CI {round(estimate.low, sig_dig)}-{round(estimate.high, sig_dig)})")
 
 
 def jaccard_index(container1: list, container2: list, sig_dig: int = 4) -> float:
@@ -123,53 +189,25 @@ def get_filehandle(file: str = None, mode: str = None) -> TextIO:
 def get_fasta_lists(fh_in: TextIO = None) -> (list, list):
     """
     list, list: get_fasta_lists(fh_in)
-    Takes : 1 arguments i.e. infile object. This functions opens the fh_in
-    and splits the header and sequence into corresponding list and returns them.
+    Takes : 1 arguments i.e. infile object. This functions reads the records from fh_in with
+    fasta_reader.read_fasta and splits the header and sequence into corresponding list and returns them.
+    Prefer read_fasta directly for large files, since these lists hold every record in memory.
     @param fh_in: A open filehand for reading
     @return: Two list of headers, list of sequences
     """
 
     header_list = []
     seq_list = []
-    current_seq = ''  # always initialize variables in python.
-
-    for line in fh_in:
-        # matched a new record
-        if line[0] == ">":
-            header_list.append(line[1:].rstrip('\n'))
-            if current_seq != '':
-                seq_list.append(current_seq)  # add on the data if there was sequence data
-            current_seq = ''  # reset the variable
-        else:
-            current_seq += line.rstrip('\n')
-
-    if current_seq:
-        seq_list.append(current_seq)
-
-    # where the lists the same size?
-    _verify_lists(header_list=header_list, seq_list=seq_list)
+    try:
+        for header, seq in read_fasta(fh_in):
+            header_list.append(header)
+            seq_list.append(seq)
+    except ValueError as err:
+        sys.exit(str(err))
 
     return header_list, seq_list
 
 
-def _verify_lists(header_list: list = None, seq_list: list = None) -> bool:
-    """
-    True : _verify_lists(header_list, seq_list)
-    Takes : 2 arguments i.e. Header list and Seq list. Returns nothing if the
-    size of the two lists are same and exists otherwise.
-    @param header_list: List of headers for the fasta fh_in
-    @param seq_list: List of sequences for the fasta fh_in
-    @return: Boolean, True or exists the program
-    """
-    size1 = len(header_list)
-    size2 = len(seq_list)
-    if size1 != size2:
-        sys.exit("Header and Sequence lists are different in size\n" +
-                 "Did you provide a FASTA formatted fh_in?")
-    else:
-        return True
-
-
 def get_cli_args() -> argparse.Namespace:
     """
     Just get the command line options using argparse
@@ -179,12 +217,48 @@ def get_cli_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Provide a FASTA fh_in to generate kmer comparision')
 
     parser.add_argument('--infile1', dest='infile1',
-                        type=str, help='Path to FASTA file 1 to open', required=True)
+                        type=str, help='Path to FASTA file 1 to open')
 
     parser.add_argument('--infile2', dest='infile2',
-                        type=str, help='Path to FASTA file 2 to open', required=True)
+                        type=str, help='Path to FASTA file 2 to open')
+
+    parser.add_argument('--genome_dir', dest='genome_dir', type=str,
+                        help='All-vs-all mode: compare every FASTA file in this directory')
+
+    parser.add_argument('--manifest', dest='manifest', type=str,
+                        help='All-vs-all mode: compare the FASTA files listed in this file, one path per line')
+
+    parser.add_argument('--query', dest='query', type=str,
+                        help='Compare this FASTA file against the genomes already in --index_dir')
+
+    parser.add_argument('--index_dir', dest='index_dir', type=str,
+                        help='Directory of the sketch index and the all-vs-all matrices')
+
+    parser.add_argument('--kmer_len', dest='kmer_len', type=int, default=21,
+                        help='kmer size of the sketches in the index')
+
+    parser.add_argument('--workers', dest='workers', type=int, default=None,
+                        help='Number of worker processes for the index, default is every core')
+
+    parser.add_argument('--canonical', dest='canonical', action='store_true',
+                        help='Count canonical kmers, min(kmer, reverse complement), so the strand does not matter')
+
+    parser.add_argument('--sketch_size', dest='sketch_size', type=int, default=0,
+                        help='Estimate the comparison from bottom-s MinHash sketches of this many hashes')
+
+    parser.add_argument('--scaled', dest='scaled', type=int, default=0,
+                        help='Estimate the comparison from FracMinHash sketches keeping 1/scaled of the kmers')
+
+    parser.add_argument('--no_cache', dest='no_cache', action='store_true',
+                        help='Do not use the kmer count cache (set its directory with KMER_CACHE_DIR)')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.genome_dir or args.manifest or args.query:
+        if not args.index_dir:
+            parser.error("--index_dir is required with --genome_dir, --manifest and --query")
+    elif not (args.infile1 and args.infile2):
+        parser.error("--infile1 and --infile2 are required, unless --genome_dir, --manifest or --query is used")
+    return args
 
 
 if __name__ == '__main__':
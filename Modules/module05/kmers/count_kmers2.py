@@ -1,4 +1,6 @@
 """Code to count DNA trinucleotides and then store them in a Dict and sort them out"""
+from kmer_cache import get_default_cache
+from packed_kmers import count_kmers_packed, decode_counts
 from utils import generate_random_dna_str, print_trinucleotides
 
 
@@ -9,14 +11,28 @@ def main() -> None:
     print_trinucleotides(counts, threshold=1000)
 
 
-def count_kmer(dna: str, kmer_len: int = 3) -> dict:
+def count_kmer(dna: str, kmer_len: int = 3, packed: bool = False, canonical: bool = False,
+               cache: bool = False) -> dict:
     '''
     Count the number of kmers that occur in the sequence dna (including overlapping occurrences)
     @param dna: The sequence to explore for kmers
     @param kmer_len: Int of the kmer size
+    @param packed: Use the 2-bit packed integer engine (packed_kmers), then decode the result into the Dict.
+                   The packed engine treats upper and lower case the same and skips kmers that are not all ACGT
+    @param canonical: Count min(kmer, reverse complement of kmer) so both strands give the same counts,
+                      this always uses the packed engine
+    @param cache: Let the packed engine take the counts of long sequences from the on-disk kmer_cache.  Off by
+                  default, so library calls and benchmarks never write to the cache directory
     @return: Dict of kmers with the value being the number of times it was found in the DNA String
     '''
 
+    if packed or canonical:
+        if cache:
+            keys, counts = get_default_cache().count_kmers(dna, kmer_len=kmer_len, canonical=canonical)
+        else:
+            keys, counts = count_kmers_packed(dna, kmer_len=kmer_len, canonical=canonical)
+        return decode_counts(keys, counts, kmer_len=kmer_len)
+
     kmers = {}
     for i in range(0, len(dna) - kmer_len + 1):
         kmer = dna[i:i + kmer_len]
@@ -37,6 +53,12 @@ def test_code() -> None:
     expected = {'GATT': 1, 'ATTA': 1, 'TTAC': 1, 'TACA': 1}
     assert counts == expected
 
+    # the packed engine has to give the same answer
+    assert count_kmer('GATTACA', kmer_len=4, packed=True) == expected
+
+    # TGTAATC is the reverse complement of GATTACA
+    assert count_kmer('GATTACA', kmer_len=4, canonical=True) == count_kmer('TGTAATC', kmer_len=4, canonical=True)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,47 @@
+"""
+File helpers for on-disk caches shared by several processes, used by kmer_cache
+    DirLock      exclusive flock on a lock file, taken by the writers of a cache directory
+    remove_file  os.remove that does not mind another process removing the file first
+"""
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows, writers are not locked against each other
+    fcntl = None
+
+
+class DirLock:
+    """Exclusive flock on a file, a no-op where fcntl is not available"""
+
+    def __init__(self, file: str):
+        """
+        @param file: Lock file, created if needed
+        """
+        self.file = file
+        self.handle = None
+
+    def __enter__(self):
+        """Block until the lock is taken"""
+        self.handle = open(self.file, 'a')
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the lock"""
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+def remove_file(file: str) -> None:
+    """
+    Remove a file that another process may have removed already
+    @param file: path
+    @return: None
+    """
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
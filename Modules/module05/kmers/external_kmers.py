@@ -0,0 +1,312 @@
+"""
+Count kmers out of core, for inputs whose distinct kmers do not fit in memory
+    1. Partition: the packed kmers are hash-partitioned into bucket files on disk, a chunk at a time.  A sequence
+       is encoded in windows that overlap by kmer_len - 1 bases, so a chromosome-sized record stays in the budget
+    2. Count: each bucket is read, sorted and counted on its own within the memory budget.  A bucket that is too big
+       (e.g. very skewed data) is partitioned again with another hash seed
+    3. Each bucket becomes a sorted run of (kmer, count) saved as two .npy files, which can be memory-mapped
+The output directory holds manifest.json plus the runs.  KmerRuns reads them back: merge-iterate every kmer in
+sorted order, or look up single kmers.
+"""
+import heapq
+import json
+import math
+import os
+import tempfile
+import tracemalloc
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from fasta_reader import iter_sequences
+from kmer_sketch import hash_kmers
+from packed_kmers import MAX_KMER_LEN, count_kmers_packed, decode_kmers, encode_dna, iter_kmer_codes
+from utils import generate_random_dna
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2  # bytes
+BYTES_PER_KMER = 8  # one uint64
+SORT_OVERHEAD = 4  # counting a bucket needs about this many copies of it (values, sort, unique keys and counts)
+MANIFEST_FILE = 'manifest.json'
+MAX_SPLIT_DEPTH = 8  # a bucket of one repeated kmer can not be split by hashing, stop and count it anyway
+MERGE_BLOCK = 1 << 16  # kmers read from each run at a time while merging
+UNSIZED_NUM_BUCKETS = 16  # for an iterator of unknown size, buckets over the budget are split while counting
+
+
+def count_kmers_external(sequences, out_dir: str = None, kmer_len: int = MAX_KMER_LEN, canonical: bool = False,
+                         memory_budget: int = DEFAULT_MEMORY_BUDGET, num_buckets: int = None) -> 'KmerRuns':
+    """
+    Count the kmers with bounded memory, spilling to bucket files in out_dir
+    @param sequences: A DNA str/bytes, a list of them, or the path of a FASTA file (plain or gzip) that is streamed
+    @param out_dir: Directory for the bucket files and the sorted runs, created if needed
+    @param kmer_len: Int of the kmer size
+    @param canonical: Count canonical kmers
+    @param memory_budget: About how many bytes of kmers to hold in memory at once
+    @param num_buckets: Number of bucket files, default is estimated from the input size and the budget.  An
+                        iterator is not read ahead to size it: it starts with UNSIZED_NUM_BUCKETS and the buckets
+                        that come out too big are split again
+    @return: KmerRuns of the result
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    num_buckets = num_buckets or _estimate_num_buckets(sequences, memory_budget)
+    chunk_len = max(1, memory_budget // (BYTES_PER_KMER * SORT_OVERHEAD))
+
+    bucket_files = [os.path.join(out_dir, f'bucket_{bucket:05d}.bin') for bucket in range(num_buckets)]
+    handles = [open(file, 'wb') for file in bucket_files]
+    try:
+        for dna in iter_sequences(sequences):
+            for codes in _iter_code_windows(dna, kmer_len=kmer_len, window_len=chunk_len + kmer_len - 1):
+                for values in iter_kmer_codes(codes, kmer_len=kmer_len, chunk_len=chunk_len, canonical=canonical):
+                    _spill(values, handles, seed=0)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    runs = []
+    for bucket, file in enumerate(bucket_files):
+        runs.extend(_count_bucket(file, out_dir, name=f'{bucket:05d}', bucket=bucket,
+                                  memory_budget=memory_budget, depth=0))
+    manifest = {'kmer_len': kmer_len, 'canonical': canonical, 'num_buckets': num_buckets, 'runs': runs}
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as out_fh:
+        json.dump(manifest, out_fh, indent=2)
+    return KmerRuns(out_dir)
+
+
+class KmerRuns:
+    """The sorted (kmer, count) runs written by count_kmers_external"""
+
+    def __init__(self, out_dir: str = None):
+        """
+        @param out_dir: Directory with manifest.json and the runs
+        """
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'r') as in_fh:
+            manifest = json.load(in_fh)
+        self.kmer_len = manifest['kmer_len']
+        self.canonical = manifest['canonical']
+        self.num_buckets = manifest['num_buckets']
+        self.runs = manifest['runs']
+
+    def __len__(self) -> int:
+        """Number of distinct kmers"""
+        return sum(run['size'] for run in self.runs)
+
+    def load_run(self, run: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        @param run: One entry of self.runs
+        @return: memory-mapped sorted uint64 keys and int64 counts of the run
+        """
+        return (np.load(os.path.join(self.out_dir, run['keys']), mmap_mode='r'),
+                np.load(os.path.join(self.out_dir, run['counts']), mmap_mode='r'))
+
+    def iter_sorted(self) -> Iterator[Tuple[int, int]]:
+        """
+        Merge the runs into one stream of (packed kmer, count) in kmer order, reading each run block by block
+        @return: Iterator of (packed kmer, count)
+        """
+        return heapq.merge(*(self._iter_run(run) for run in self.runs if run['size']))
+
+    def query(self, kmer) -> int:
+        """
+        Count of one kmer, only the runs of its bucket are searched
+        @param kmer: kmer string or packed kmer
+        @return: count, 0 if the kmer was not seen
+        """
+        if isinstance(kmer, str):
+            if len(kmer) != self.kmer_len:
+                raise ValueError(f"{kmer} is not a kmer of length {self.kmer_len}")
+            values = [chunk for chunk in iter_kmer_codes(encode_dna(kmer), kmer_len=self.kmer_len,
+                                                         canonical=self.canonical) if len(chunk)]
+            if not values:  # has a base other than ACGT, never counted
+                return 0
+            value = values[0][0]
+        else:
+            value = np.uint64(kmer)
+        bucket = int(_bucket_of(np.array([value], dtype=np.uint64), self.num_buckets, seed=0)[0])
+        for run in self.runs:
+            if run['bucket'] != bucket or not run['size']:
+                continue
+            keys, counts = self.load_run(run)
+            position = int(np.searchsorted(keys, value))
+            if position < len(keys) and keys[position] == value:
+                return int(counts[position])
+        return 0
+
+    def to_dict(self) -> dict:
+        """
+        Decode every kmer into the Dict of kmer strings used by count_kmers2.count_kmer, only for small results
+        @return: Dict of kmers with their counts
+        """
+        counts = {}
+        for run in self.runs:
+            keys, run_counts = self.load_run(run)
+            counts.update(zip(decode_kmers(keys, kmer_len=self.kmer_len), run_counts.tolist()))
+        return counts
+
+    def _iter_run(self, run: dict) -> Iterator[Tuple[int, int]]:
+        """
+        @param run: One entry of self.runs
+        @return: Iterator of (packed kmer, count) of the run
+        """
+        keys, counts = self.load_run(run)
+        for start in range(0, len(keys), MERGE_BLOCK):
+            yield from zip(keys[start:start + MERGE_BLOCK].tolist(), counts[start:start + MERGE_BLOCK].tolist())
+
+
+def _count_bucket(file: str, out_dir: str, name: str = None, bucket: int = 0,
+                  memory_budget: int = DEFAULT_MEMORY_BUDGET, depth: int = 0) -> list:
+    """
+    Count one bucket file into a sorted run, splitting it first if it is over the memory budget.
+    The bucket file is removed afterwards
+    @param file: Bucket file of uint64 kmers
+    @param out_dir: Directory for the runs
+    @param name: Name of the bucket, used for the run file names
+    @param bucket: Top level bucket number, kept in the manifest for queries
+    @param memory_budget: About how many bytes of kmers to hold in memory at once
+    @param depth: How many times this bucket was split already
+    @return: list of run entries for the manifest
+    """
+    size = os.path.getsize(file)
+    if size * SORT_OVERHEAD > memory_budget and depth < MAX_SPLIT_DEPTH:
+        num_parts = math.ceil(size * SORT_OVERHEAD / memory_budget) + 1
+        part_files = [f'{file}.{part}' for part in range(num_parts)]
+        handles = [open(part_file, 'wb') for part_file in part_files]
+        try:
+            block_len = max(1, memory_budget // (BYTES_PER_KMER * SORT_OVERHEAD))
+            values = np.memmap(file, dtype=np.uint64, mode='r')
+            for start in range(0, len(values), block_len):
+                _spill(np.array(values[start:start + block_len]), handles, seed=depth + 1)
+            del values
+        finally:
+            for handle in handles:
+                handle.close()
+        os.remove(file)
+        runs = []
+        for part, part_file in enumerate(part_files):
+            runs.extend(_count_bucket(part_file, out_dir, name=f'{name}.{part}', bucket=bucket,
+                                      memory_budget=memory_budget, depth=depth + 1))
+        return runs
+
+    keys, counts = np.unique(np.fromfile(file, dtype=np.uint64), return_counts=True)
+    os.remove(file)
+    run = {'bucket': bucket, 'size': len(keys), 'keys': f'run_{name}.keys.npy', 'counts': f'run_{name}.counts.npy'}
+    np.save(os.path.join(out_dir, run['keys']), keys)
+    np.save(os.path.join(out_dir, run['counts']), counts.astype(np.int64))
+    return [run]
+
+
+def _iter_code_windows(dna, kmer_len: int = MAX_KMER_LEN, window_len: int = None) -> Iterator[np.ndarray]:
+    """
+    Encode a sequence a window at a time, instead of the whole sequence at once.  Consecutive windows overlap by
+    kmer_len - 1 bases, so every kmer start is in exactly one window
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_len: Int of the kmer size
+    @param window_len: Bases per window, at least kmer_len
+    @return: Iterator of uint8 arrays from encode_dna
+    """
+    step = window_len - kmer_len + 1
+    for start in range(0, max(1, len(dna) - kmer_len + 1), step):
+        yield encode_dna(dna[start:start + window_len])
+
+
+def _spill(values: np.ndarray, handles: list, seed: int = 0) -> None:
+    """
+    Append each value to the file of its bucket
+    @param values: uint64 array of packed kmers
+    @param handles: open binary filehandles, one per bucket
+    @param seed: Hash seed, different for every level of splitting
+    @return: None
+    """
+    buckets = _bucket_of(values, len(handles), seed=seed)
+    order = np.argsort(buckets, kind='stable')
+    values, buckets = values[order], buckets[order]
+    bounds = np.searchsorted(buckets, np.arange(len(handles) + 1))
+    for bucket, handle in enumerate(handles):
+        if bounds[bucket] < bounds[bucket + 1]:
+            values[bounds[bucket]:bounds[bucket + 1]].tofile(handle)
+
+
+def _bucket_of(values: np.ndarray, num_buckets: int, seed: int = 0) -> np.ndarray:
+    """
+    @param values: uint64 array of packed kmers
+    @param num_buckets: Number of buckets
+    @param seed: Hash seed
+    @return: bucket number of every value
+    """
+    return (hash_kmers(values, seed=seed) % np.uint64(num_buckets)).astype(np.intp)
+
+
+def _estimate_num_buckets(sequences, memory_budget: int) -> int:
+    """
+    Guess the number of buckets from the input size, one kmer per base at most, without reading the input
+    @param sequences: Same as for count_kmers_external
+    @param memory_budget: About how many bytes of kmers to hold in memory at once
+    @return: Number of buckets
+    """
+    if isinstance(sequences, (str, os.PathLike)) and os.path.isfile(sequences):
+        num_bases = os.path.getsize(sequences)
+        if str(sequences).endswith('.gz'):
+            num_bases *= 4  # rough gzip ratio for DNA
+    elif isinstance(sequences, (str, bytes, bytearray)):
+        num_bases = len(sequences)
+    elif isinstance(sequences, (list, tuple)):
+        num_bases = sum(len(seq) for seq in sequences)
+    else:  # summing the lengths would use up an iterator before it is counted
+        return UNSIZED_NUM_BUCKETS
+    return max(1, math.ceil(num_bases * BYTES_PER_KMER * SORT_OVERHEAD / memory_budget))
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    dna = generate_random_dna(20_000, seed=5) * 2  # every kmer is seen at least twice
+    expected = {}
+    for i in range(len(dna) - 15 + 1):
+        kmer = dna[i:i + 15].decode('ascii')
+        expected[kmer] = expected.get(kmer, 0) + 1
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        # a tiny budget forces several buckets and splitting of the buckets
+        runs = count_kmers_external(dna, out_dir, kmer_len=15, memory_budget=64 * 1024, num_buckets=2)
+        assert len(runs.runs) > 2
+        assert runs.to_dict() == expected
+        merged = list(runs.iter_sorted())
+        assert [key for key, _ in merged] == sorted(key for key, _ in merged)
+        assert len(merged) == len(expected)
+        kmer = dna[100:115].decode('ascii')
+        assert runs.query(kmer) == expected[kmer]
+        assert runs.query('A' * 15) == expected.get('A' * 15, 0)
+        assert not [file for file in os.listdir(out_dir) if file.startswith('bucket_')]
+        assert runs.query('ACGTNACGTACGTAC') == 0
+
+    # a record much longer than the budget is encoded a window at a time
+    dna = generate_random_dna(1_000_000, seed=6, alphabet='ACGTN')
+    memory_budget = 256 * 1024
+    with tempfile.TemporaryDirectory() as out_dir:
+        tracemalloc.start()
+        runs = count_kmers_external(dna, out_dir, kmer_len=21, canonical=True, memory_budget=memory_budget)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < 4 * memory_budget, peak
+        keys, counts = count_kmers_packed(dna, kmer_len=21, canonical=True)
+        assert len(runs) == len(keys) and sum(run_counts.sum() for _, run_counts in map(runs.load_run, runs.runs)) \
+            == counts.sum()
+
+    # a generator is counted, not used up sizing the buckets
+    sequences = [dna[:20_000], dna[20_000:]]
+    with tempfile.TemporaryDirectory() as out_dir:
+        from_list = count_kmers_external(sequences, out_dir, kmer_len=15, memory_budget=64 * 1024).to_dict()
+    with tempfile.TemporaryDirectory() as out_dir:
+        runs = count_kmers_external((seq for seq in sequences), out_dir, kmer_len=15, memory_budget=64 * 1024)
+        assert runs.num_buckets == UNSIZED_NUM_BUCKETS and runs.to_dict() == from_list and from_list
+        # a mistyped path is an error, not an empty count
+        try:
+            count_kmers_external('missing_file.fa', out_dir, kmer_len=15)
+            assert False, "missing file was taken as DNA"
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,160 @@
+"""
+Streaming FASTA reader
+Records are yielded one at a time, so only the current record is held in memory.  Gzipped files are detected by
+their magic number, so .gz input does not need a different call.
+"""
+import gzip
+import io
+import os
+import re
+import sys
+import tempfile
+from typing import Iterable, Iterator, TextIO, Tuple
+
+GZIP_MAGIC = b'\x1f\x8b'
+DNA_RE = re.compile(r'[ACGTNacgtn]*')
+
+
+def open_fasta(file: str = None) -> TextIO:
+    """
+    Open a FASTA file for reading, plain text or gzip
+    @param file: Path to the FASTA file
+    @return: filehandle in text mode
+    """
+    try:
+        with open(file, 'rb') as fh_in:
+            is_gzip = fh_in.read(2) == GZIP_MAGIC
+        if is_gzip:
+            return gzip.open(file, 'rt')
+        return open(file, 'r')
+    except OSError:
+        print(f"IOError: Could not open the fh_in: {file} for type 'r'", file=sys.stderr)
+        raise
+
+
+def read_fasta(fasta=None, strict: bool = True) -> Iterator[Tuple[str, str]]:
+    """
+    Generator of (header, sequence) tuples, one per FASTA record
+    @param fasta: Path to a FASTA file (plain or gzip), or an already open filehandle
+    @param strict: Raise a ValueError on a malformed record, otherwise print a warning and skip it
+    @return: Iterator of (header, sequence)
+    """
+    if isinstance(fasta, (str, os.PathLike)):
+        with open_fasta(fasta) as fh_in:
+            yield from _parse_fasta(fh_in, strict=strict)
+    else:
+        yield from _parse_fasta(fasta, strict=strict)
+
+
+def iter_sequences(sequences=None) -> Iterable:
+    """
+    The DNA sequences of an input that can be a sequence, a list of them, or a FASTA file
+    @param sequences: A DNA str/bytes, an iterable of them, or the path of a FASTA file (plain or gzip) that is
+                      streamed.  A str is a path if the file exists, otherwise it has to be DNA (ACGTN, any case)
+    @return: Iterable of DNA sequences, a file path gives a new generator on every call so it can be read again
+    """
+    if isinstance(sequences, (bytes, bytearray)):
+        return [sequences]
+    if isinstance(sequences, str) and not os.path.isfile(sequences):
+        if not DNA_RE.fullmatch(sequences):
+            raise FileNotFoundError(f"{sequences[:100]!r} is neither an existing FASTA file nor a DNA sequence")
+        return [sequences]
+    if isinstance(sequences, (str, os.PathLike)):
+        return (seq for _, seq in read_fasta(sequences))
+    return sequences
+
+
+def _parse_fasta(fh_in: TextIO = None, strict: bool = True) -> Iterator[Tuple[str, str]]:
+    """
+    Parse the records out of an open FASTA filehandle
+    @param fh_in: A open filehandle for reading
+    @param strict: Raise a ValueError on a malformed record, otherwise print a warning and skip it
+    @return: Iterator of (header, sequence)
+    """
+    header = None
+    header_line_num = 0
+    seq_lines = []  # joined once when the record is done, never build the sequence with +=
+
+    for line_num, line in enumerate(fh_in, start=1):
+        if line.startswith('>'):
+            if header is not None:
+                yield from _finish_record(header, seq_lines, header_line_num, strict=strict)
+            header = line[1:].rstrip()
+            header_line_num = line_num
+            seq_lines = []
+        else:
+            line = line.strip()
+            if not line:
+                continue
+            if header is None:
+                _report(f"Sequence data before the first header at line {line_num}", strict=strict)
+                continue
+            seq_lines.append(line)
+
+    if header is not None:
+        yield from _finish_record(header, seq_lines, header_line_num, strict=strict)
+
+
+def _finish_record(header: str, seq_lines: list, line_num: int, strict: bool = True) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the record if it has sequence data, otherwise report it as malformed
+    @param header: Header of the record, without the >
+    @param seq_lines: List of the sequence lines of the record
+    @param line_num: Line number of the header, for the error message
+    @param strict: Raise a ValueError on a malformed record, otherwise print a warning and skip it
+    @return: Iterator with zero or one (header, sequence)
+    """
+    if seq_lines:
+        yield header, ''.join(seq_lines)
+    else:
+        _report(f"Record '{header}' at line {line_num} has no sequence.  Did you provide a FASTA formatted file?",
+                strict=strict)
+
+
+def _report(message: str, strict: bool = True) -> None:
+    """
+    Report a malformed record
+    @param message: What was wrong
+    @param strict: Raise a ValueError, otherwise just print a warning to stderr
+    @return: None
+    """
+    if strict:
+        raise ValueError(message)
+    print(f"Warning: {message}", file=sys.stderr)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    fasta = ">seq1 first\nGATT\nACA\n\n>seq2\nTTT\n"
+    assert list(read_fasta(io.StringIO(fasta))) == [('seq1 first', 'GATTACA'), ('seq2', 'TTT')]
+
+    # gzip is found from the content, not the file name
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, 'test.fasta')
+        with gzip.open(file, 'wt') as fh_out:
+            fh_out.write(fasta)
+        assert list(read_fasta(file)) == [('seq1 first', 'GATTACA'), ('seq2', 'TTT')]
+
+    # a header with no sequence is malformed
+    malformed = ">seq1\n>seq2\nACGT\n"
+    try:
+        list(read_fasta(io.StringIO(malformed)))
+        assert False, "malformed record was not reported"
+    except ValueError:
+        pass
+    assert list(read_fasta(io.StringIO(malformed), strict=False)) == [('seq2', 'ACGT')]
+
+    # a str is DNA only if it is not a file, and a mistyped path is an error, not an empty sequence
+    assert iter_sequences('acgtN') == ['acgtN'] and iter_sequences(b'ACGT') == [b'ACGT']
+    try:
+        iter_sequences('missing_file.fa')
+        assert False, "missing file was taken as DNA"
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,273 @@
+"""
+All-vs-all genome comparison with a reusable on-disk index of kmer sketches
+Index directory layout:
+    index.json          sketch settings and the list of genomes (name, FASTA path, size, mtime, sketch file)
+    sketches/*.npz      one kmer_sketch.KmerSketch per genome
+    jaccard.npy         float32 N x N jaccard index matrix, rows and columns in index.json order
+    containment.npy     float32 N x N containment matrix, row genome contained in column genome
+    jaccard.tsv, containment.tsv   the same matrices with genome names, for reading by eye or in a spreadsheet
+"""
+import glob
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from kmer_sketch import (DEFAULT_SEED, containment_estimate, jaccard_index_estimate, load_sketch, save_sketch,
+                         sketch_fasta)
+
+INDEX_FILE = 'index.json'
+SKETCH_DIR = 'sketches'
+FASTA_EXTENSIONS = ('.fasta', '.fa', '.fna', '.fasta.gz', '.fa.gz', '.fna.gz')
+
+_WORKER_SKETCHES = []  # sketches loaded once per worker process by _load_worker_sketches
+
+
+def get_fasta_files(genome_dir: str = None, manifest: str = None) -> list:
+    """
+    Get the FASTA files to index, either every FASTA file in a directory or the paths listed in a manifest
+    @param genome_dir: Directory to look for FASTA files in
+    @param manifest: Text file with one FASTA path per line, relative paths are relative to the manifest
+    @return: list of paths
+    """
+    if manifest:
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r') as in_fh:
+            return [os.path.join(base_dir, line.strip()) for line in in_fh
+                    if line.strip() and not line.startswith('#')]
+    return sorted(file for file in glob.glob(os.path.join(genome_dir, '*'))
+                  if file.lower().endswith(FASTA_EXTENSIONS))
+
+
+def build_index(fasta_files: list = None, index_dir: str = None, kmer_len: int = 21, num_hashes: int = 1000,
+                scaled: int = 0, canonical: bool = True, seed: int = DEFAULT_SEED, workers: int = None) -> dict:
+    """
+    Sketch every FASTA file into the index directory.  Genomes already in the index with the same settings, file
+    size and mtime are not sketched again
+    @param fasta_files: list of FASTA paths
+    @param index_dir: Directory of the index, created if needed
+    @param kmer_len: Int of the kmer size
+    @param num_hashes: bottom-s MinHash size, ignored when scaled is set
+    @param scaled: FracMinHash scale factor
+    @param canonical: Sketch canonical kmers
+    @param seed: Seed for the hash function
+    @param workers: Number of worker processes, default is every core
+    @return: Dictionary of the index, as written to index.json
+    """
+    settings = {'kmer_len': kmer_len, 'num_hashes': 0 if scaled else num_hashes, 'scaled': scaled,
+                'canonical': canonical, 'seed': seed}
+    os.makedirs(os.path.join(index_dir, SKETCH_DIR), exist_ok=True)
+    old_index = load_index(index_dir) if os.path.exists(os.path.join(index_dir, INDEX_FILE)) else None
+    old_genomes = {}
+    if old_index and old_index['settings'] == settings:
+        old_genomes = {genome['path']: genome for genome in old_index['genomes']}
+
+    # the reused genomes keep their names and sketch files, so they are taken before any new genome is named
+    reused = {}
+    for file in fasta_files:
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        old = old_genomes.get(path)
+        if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            reused[path] = old
+    used_names = {genome['name'] for genome in reused.values()}
+
+    genomes, tasks = [], []
+    for file in fasta_files:
+        path = os.path.abspath(file)
+        if path in reused:
+            genomes.append(reused[path])
+            continue
+        stat = os.stat(path)
+        name = _unique_name(_genome_name(path), used_names)
+        genome = {'name': name, 'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                  'sketch': os.path.join(SKETCH_DIR, f'{name}.npz')}
+        genomes.append(genome)
+        tasks.append((path, os.path.join(index_dir, genome['sketch']), settings))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_sketch_task, tasks))
+
+    index = {'settings': settings, 'genomes': genomes}
+    _write_json(index, os.path.join(index_dir, INDEX_FILE))
+    return index
+
+
+def load_index(index_dir: str = None) -> dict:
+    """
+    @param index_dir: Directory of the index
+    @return: Dictionary of the index
+    """
+    with open(os.path.join(index_dir, INDEX_FILE), 'r') as in_fh:
+        return json.load(in_fh)
+
+
+def compare_all(index_dir: str = None, workers: int = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Compute the full pairwise jaccard index and containment matrices of the index in a process pool, and write
+    them to the index directory as .npy and .tsv
+    @param index_dir: Directory of the index
+    @param workers: Number of worker processes, default is every core
+    @return: Tuple of the jaccard index and containment DataFrames
+    """
+    index = load_index(index_dir)
+    names = [genome['name'] for genome in index['genomes']]
+    sketch_files = [os.path.join(index_dir, genome['sketch']) for genome in index['genomes']]
+
+    jaccard = np.zeros((len(names), len(names)), dtype=np.float32)
+    containment = np.zeros((len(names), len(names)), dtype=np.float32)
+    # every worker loads the sketches once, then only row numbers and result rows go between the processes
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker_sketches,
+                             initargs=(sketch_files,)) as executor:
+        for row, (jaccard_row, containment_row) in enumerate(executor.map(_compare_row, range(len(names)))):
+            jaccard[row, row:] = jaccard_row
+            jaccard[row:, row] = jaccard_row
+            containment[row] = containment_row
+
+    np.save(os.path.join(index_dir, 'jaccard.npy'), jaccard)
+    np.save(os.path.join(index_dir, 'containment.npy'), containment)
+    jaccard_df = pd.DataFrame(jaccard, index=names, columns=names)
+    containment_df = pd.DataFrame(containment, index=names, columns=names)
+    jaccard_df.to_csv(os.path.join(index_dir, 'jaccard.tsv'), sep='\t', float_format='%.4f')
+    containment_df.to_csv(os.path.join(index_dir, 'containment.tsv'), sep='\t', float_format='%.4f')
+    return jaccard_df, containment_df
+
+
+def query_index(index_dir: str = None, fasta_file: str = None) -> pd.DataFrame:
+    """
+    Compare one new genome against every genome in the index, without changing the index
+    @param index_dir: Directory of the index
+    @param fasta_file: FASTA file of the query genome
+    @return: DataFrame with one row per indexed genome, best jaccard index first
+    """
+    index = load_index(index_dir)
+    settings = index['settings']
+    query = sketch_fasta(fasta_file, kmer_len=settings['kmer_len'], num_hashes=settings['num_hashes'],
+                         scaled=settings['scaled'], canonical=settings['canonical'], seed=settings['seed'])
+    rows = []
+    for genome in index['genomes']:
+        sketch = load_sketch(os.path.join(index_dir, genome['sketch']))
+        jaccard = jaccard_index_estimate(query, sketch)
+        rows.append({'name': genome['name'],
+                     'jaccard_index': jaccard.value,
+                     'jaccard_index_std_error': jaccard.std_error,
+                     'query_containment': containment_estimate(query, sketch).value,
+                     'reference_containment': containment_estimate(sketch, query).value})
+    return pd.DataFrame(rows).sort_values('jaccard_index', ascending=False, ignore_index=True)
+
+
+def _sketch_task(task: tuple) -> None:
+    """
+    Worker: sketch one FASTA file and save the sketch
+    @param task: (FASTA path, sketch path, settings dictionary)
+    @return: None
+    """
+    path, sketch_file, settings = task
+    sketch = sketch_fasta(path, kmer_len=settings['kmer_len'], num_hashes=settings['num_hashes'],
+                          scaled=settings['scaled'], canonical=settings['canonical'], seed=settings['seed'])
+    # write to a temporary name and rename, so an interrupted build never leaves half a sketch behind
+    tmp_file = f'{sketch_file}.{os.getpid()}.tmp'
+    save_sketch(sketch, tmp_file)
+    os.replace(tmp_file, sketch_file)
+
+
+def _load_worker_sketches(sketch_files: list) -> None:
+    """
+    Worker initializer: load every sketch of the index once
+    @param sketch_files: list of sketch paths
+    @return: None
+    """
+    _WORKER_SKETCHES[:] = [load_sketch(file) for file in sketch_files]
+
+
+def _compare_row(row: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Worker: compare one genome against the others
+    @param row: Index of the genome
+    @return: jaccard index against genomes row..N-1 (the matrix is symmetric), containment against all genomes
+    """
+    sketch = _WORKER_SKETCHES[row]
+    jaccard = np.array([jaccard_index_estimate(sketch, other).value for other in _WORKER_SKETCHES[row:]])
+    containment = np.array([containment_estimate(sketch, other).value for other in _WORKER_SKETCHES])
+    return jaccard, containment
+
+
+def _genome_name(path: str) -> str:
+    """
+    @param path: FASTA path
+    @return: File name without the FASTA extension
+    """
+    name = os.path.basename(path)
+    for extension in sorted(FASTA_EXTENSIONS, key=len, reverse=True):
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def _unique_name(name: str, used_names: set) -> str:
+    """
+    Make a genome name unique by adding a number, and remember it
+    @param name: Name wanted
+    @param used_names: Names already taken, updated in place
+    @return: Unique name
+    """
+    unique, number = name, 1
+    while unique in used_names:
+        number += 1
+        unique = f'{name}_{number}'
+    used_names.add(unique)
+    return unique
+
+
+def _write_json(data: dict, file: str = None) -> None:
+    """
+    Write JSON to a temporary file and rename it into place
+    @param data: Dictionary to write
+    @param file: Path to write
+    @return: None
+    """
+    tmp_file = f'{file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as out_fh:
+        json.dump(data, out_fh, indent=2)
+    os.replace(tmp_file, file)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    kmer_dir = os.path.dirname(os.path.abspath(__file__))
+    files = [os.path.join(kmer_dir, name) for name in ('influenza1.fasta', 'influenza2.fasta')]
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = build_index(files, index_dir, kmer_len=11, num_hashes=200, workers=2)
+        assert [genome['name'] for genome in index['genomes']] == ['influenza1', 'influenza2']
+        jaccard, containment = compare_all(index_dir, workers=2)
+        assert jaccard.loc['influenza1', 'influenza1'] == 1.0
+        assert jaccard.loc['influenza1', 'influenza2'] == jaccard.loc['influenza2', 'influenza1']
+        assert np.array_equal(np.load(os.path.join(index_dir, 'containment.npy')), containment.to_numpy())
+
+        # the index is reused, nothing is sketched again
+        mtime = os.path.getmtime(os.path.join(index_dir, index['genomes'][0]['sketch']))
+        build_index(files, index_dir, kmer_len=11, num_hashes=200, workers=2)
+        assert os.path.getmtime(os.path.join(index_dir, index['genomes'][0]['sketch'])) == mtime
+
+        hits = query_index(index_dir, files[1])
+        assert hits.loc[0, 'name'] == 'influenza2' and hits.loc[0, 'jaccard_index'] == 1.0
+
+        # a new file with the name of a reused genome later in the list gets a name of its own
+        copy = os.path.join(index_dir, 'influenza1.fasta')
+        with open(files[0], 'rb') as in_fh, open(copy, 'wb') as out_fh:
+            out_fh.write(in_fh.read())
+        index = build_index([copy] + files, index_dir, kmer_len=11, num_hashes=200, workers=2)
+        assert [genome['name'] for genome in index['genomes']] == ['influenza1_2', 'influenza1', 'influenza2']
+        assert os.path.getmtime(os.path.join(index_dir, index['genomes'][1]['sketch'])) == mtime
+
+
+if __name__ == '__main__':
+    test_code()
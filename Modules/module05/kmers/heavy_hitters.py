@@ -0,0 +1,201 @@
+"""
+Find the abundant kmers (repeats, adapters, ...) with a fixed memory ceiling
+    1. One streaming pass counts every kmer approximately in a Count-Min sketch (Cormode and Muthukrishnan, 2005)
+       and keeps a bounded set of candidate heavy hitters
+    2. A second pass counts only the candidates exactly
+Memory is the sketch (depth x width counters) plus the candidates, no matter how many distinct kmers there are.
+The candidates are capped: top_n * CANDIDATES_PER_HITTER of them, and with a threshold at most max_candidates, past
+which the threshold is too low for this method and a ValueError is raised.
+"""
+import collections.abc
+import heapq
+import math
+from typing import Iterator
+
+import numpy as np
+
+from fasta_reader import iter_sequences
+from kmer_sketch import hash_kmers
+from packed_kmers import decode_counts, encode_dna, iter_kmer_codes, sort_unique
+from utils import generate_random_dna
+
+CANDIDATES_PER_HITTER = 4  # keep this many candidates per top_n kmer wanted, some will not survive the exact count
+MAX_CANDIDATES = 1 << 20  # kmers over a threshold kept at once, about 100 MB as a dict
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch of packed kmers.  A count is never under estimated, and with probability 1 - delta it is over
+    estimated by at most epsilon * (total number of kmers added)
+    """
+
+    def __init__(self, epsilon: float = 1e-6, delta: float = 0.01, seed: int = 0):
+        """
+        @param epsilon: Error as a fraction of the total count, sets the width to e / epsilon
+        @param delta: Probability of the error being larger, sets the depth to ln(1 / delta)
+        @param seed: Seed of the first row's hash, each row uses the next seed
+        """
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.seeds = [seed + row for row in range(self.depth)]
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def add(self, values: np.ndarray) -> None:
+        """
+        Add one to the count of each value
+        @param values: uint64 array of packed kmers
+        @return: None
+        """
+        for row, seed in enumerate(self.seeds):
+            self.table[row] += np.bincount(self._columns(values, seed), minlength=self.width)
+        self.total += len(values)
+
+    def query(self, values: np.ndarray, mean_correction: bool = False) -> np.ndarray:
+        """
+        Estimate the counts of the values
+        @param values: uint64 array of packed kmers
+        @param mean_correction: Count-Min-Mean: take off the expected noise of each counter and use the median of
+                                the rows, less biased for low counts (Deng and Rafiei, 2007)
+        @return: int64 array of estimated counts
+        """
+        counts = np.stack([self.table[row, self._columns(values, seed)] for row, seed in enumerate(self.seeds)])
+        estimate = counts.min(axis=0)
+        if mean_correction:
+            noise = (self.total - counts) / (self.width - 1)
+            estimate = np.minimum(estimate, np.maximum(0, np.median(counts - noise, axis=0))).astype(np.int64)
+        return estimate
+
+    def _columns(self, values: np.ndarray, seed: int) -> np.ndarray:
+        """
+        @param values: uint64 array of packed kmers
+        @param seed: Seed of the row
+        @return: column of each value in the row
+        """
+        return (hash_kmers(values, seed=seed) % np.uint64(self.width)).astype(np.intp)
+
+
+def find_heavy_hitters(sequences, kmer_len: int = 21, top_n: int = None, threshold: int = None,
+                       epsilon: float = 1e-6, delta: float = 0.01, canonical: bool = False,
+                       exact: bool = True, max_candidates: int = MAX_CANDIDATES) -> dict:
+    """
+    Find the top_n most frequent kmers, or every kmer seen at least threshold times
+    @param sequences: A DNA str/bytes, a list of them, or the path of a FASTA file (plain or gzip) that is streamed.
+                      With exact the input is read twice, so it can not be a one-shot iterator like a generator
+    @param kmer_len: Int of the kmer size
+    @param top_n: Number of most frequent kmers to report
+    @param threshold: Report every kmer with at least this count
+    @param epsilon: Count-Min error as a fraction of the total number of kmers
+    @param delta: Count-Min probability of a larger error
+    @param canonical: Count canonical kmers
+    @param exact: Count the candidates exactly in a second pass, otherwise report the sketch estimates
+    @param max_candidates: Most kmers whose estimate reaches the threshold that are kept, a ValueError is raised
+                           when more than this pass it.  Not used with top_n
+    @return: Dict of kmers with their counts, most frequent first
+    """
+    if (top_n is None) == (threshold is None):
+        raise ValueError("Give one of top_n or threshold")
+    if exact and isinstance(sequences, collections.abc.Iterator):
+        # the exact pass would find the iterator used up and count nothing
+        raise TypeError("exact=True reads the sequences twice, give a list or a FASTA path instead of an iterator")
+    sketch = CountMinSketch(epsilon=epsilon, delta=delta)
+    capacity = top_n * CANDIDATES_PER_HITTER if top_n else None
+    candidates = {}  # packed kmer -> latest estimate
+
+    for values in _iter_values(sequences, kmer_len=kmer_len, canonical=canonical):
+        sketch.add(values)
+        kmers = sort_unique(values)
+        estimates = sketch.query(kmers)
+        if threshold is not None:
+            keep = estimates >= threshold
+            candidates.update(zip(kmers[keep].tolist(), estimates[keep].tolist()))
+            if len(candidates) > max_candidates:
+                # the estimates only grow, dropping some candidates could lose kmers over the threshold
+                raise ValueError(f"More than {max_candidates} kmers reach the threshold of {threshold}, raise the "
+                                 f"threshold or max_candidates, or lower epsilon")
+        else:
+            if len(kmers) > capacity:
+                best = np.argpartition(estimates, -capacity)[-capacity:]
+                kmers, estimates = kmers[best], estimates[best]
+            candidates.update(zip(kmers.tolist(), estimates.tolist()))
+            if len(candidates) > capacity:
+                candidates = dict(heapq.nlargest(capacity, candidates.items(), key=lambda item: item[1]))
+
+    if exact:
+        candidates = _count_candidates(sequences, candidates, kmer_len=kmer_len, canonical=canonical)
+    hitters = sorted(candidates.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    if threshold is not None:
+        hitters = [(kmer, count) for kmer, count in hitters if count >= threshold]
+    else:
+        hitters = hitters[:top_n]
+    keys = np.array([kmer for kmer, _ in hitters], dtype=np.uint64)
+    return decode_counts(keys, [count for _, count in hitters], kmer_len=kmer_len)
+
+
+def _count_candidates(sequences, candidates: dict, kmer_len: int = 21, canonical: bool = False) -> dict:
+    """
+    Count the candidate kmers exactly, every other kmer is skipped
+    @param sequences: Same as for find_heavy_hitters
+    @param candidates: Dict with the candidate packed kmers as keys
+    @param kmer_len: Int of the kmer size
+    @param canonical: Count canonical kmers
+    @return: Dict of packed kmer -> exact count
+    """
+    keys = np.array(sorted(candidates), dtype=np.uint64)
+    counts = np.zeros(len(keys), dtype=np.int64)
+    for values in _iter_values(sequences, kmer_len=kmer_len, canonical=canonical):
+        values = values[np.isin(values, keys)]
+        counts += np.bincount(np.searchsorted(keys, values), minlength=len(keys))
+    return dict(zip(keys.tolist(), counts.tolist()))
+
+
+def _iter_values(sequences, kmer_len: int = 21, canonical: bool = False) -> Iterator[np.ndarray]:
+    """
+    Generator of the packed kmers of every sequence, chunk by chunk
+    @param sequences: A DNA str/bytes, a list of them, or the path of a FASTA file
+    @param kmer_len: Int of the kmer size
+    @param canonical: Use canonical kmers
+    @return: Iterator of uint64 arrays
+    """
+    for dna in iter_sequences(sequences):
+        yield from iter_kmer_codes(encode_dna(dna), kmer_len=kmer_len, canonical=canonical)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    adapter = b'AGATCGGAAGAGCACACGTCT'
+    # 30 copies of the adapter between random sequence
+    dna = adapter.join(generate_random_dna(3_000, seed=seed) for seed in range(31))
+
+    hitters_top = find_heavy_hitters(dna, kmer_len=21, top_n=1, epsilon=1e-3)
+    assert hitters_top == {adapter.decode('ascii'): 30}
+    hitters = find_heavy_hitters([dna, adapter * 5], kmer_len=21, threshold=30, epsilon=1e-3)
+    assert hitters[adapter.decode('ascii')] == 35
+    # the sketch estimates need only one pass, a generator is fine, and they are never under the exact count
+    estimates = find_heavy_hitters((seq for seq in [dna]), kmer_len=21, top_n=1, epsilon=1e-3, exact=False)
+    assert list(estimates) == list(hitters_top) and estimates[adapter.decode('ascii')] >= 30
+    try:
+        find_heavy_hitters((seq for seq in [dna]), kmer_len=21, top_n=1)
+        assert False, "a generator can not be read twice"
+    except TypeError:
+        pass
+
+    # every kmer passes a threshold of 1, far more than the candidates allowed
+    try:
+        find_heavy_hitters(dna, kmer_len=21, threshold=1, epsilon=1e-3, max_candidates=1000)
+        assert False, "the candidates grew past max_candidates"
+    except ValueError:
+        pass
+
+    sketch = CountMinSketch(epsilon=1e-3, delta=0.01)
+    values = np.array([1, 1, 1, 2], dtype=np.uint64)
+    sketch.add(values)
+    assert sketch.query(np.array([1], dtype=np.uint64))[0] >= 3
+    assert sketch.query(np.array([1], dtype=np.uint64), mean_correction=True)[0] <= 3
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,243 @@
+"""
+Persistent on-disk cache of kmer count tables, so a genome compared many times is only counted once
+Cache directory layout:
+    <sha256 of the sequence>_k<kmer_len>_<c|f>.npy   2 x N uint64 array, row 0 the sorted packed kmers and row 1
+                                                     the int64 counts stored bit for bit.  Loaded memory-mapped
+    .lock                                            lock file for the writers
+Entries are keyed by the content of the sequence, so the same genome hits the cache whatever file it is read from.
+The cache is kept under max_bytes by removing the least recently used entries; a hit updates the file mtime.
+Every entry is written to a temporary file and renamed into place, so readers never see half an entry, and writers
+hold an exclusive lock on .lock while writing and evicting, so several processes can share one cache.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from dir_lock import DirLock, remove_file
+from multi_k import iter_kmer_counts
+from packed_kmers import count_kmers_packed
+
+CACHE_DIR_ENV = 'KMER_CACHE_DIR'
+CACHE_MAX_BYTES_ENV = 'KMER_CACHE_MAX_BYTES'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kmer_counts')
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+MIN_CACHE_LEN = 1 << 20  # shorter sequences are counted faster than an entry is read back, do not cache them
+LOCK_FILE = '.lock'
+
+_DEFAULT_CACHE = []  # the cache made by get_default_cache, once per process
+
+
+class KmerCountCache:
+    """Size bounded LRU cache of kmer count tables, shared between processes through a directory"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 min_seq_len: int = MIN_CACHE_LEN):
+        """
+        @param cache_dir: Directory of the cache, created with the first entry
+        @param max_bytes: Largest total size of the entries
+        @param min_seq_len: Sequences shorter than this are counted without the cache
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_seq_len = min_seq_len
+
+    def get(self, digest: str, kmer_len: int = 3,
+            canonical: bool = False) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        @param digest: sequence_digest of the sequence
+        @param kmer_len: Int of the kmer size
+        @param canonical: Canonical kmers or not
+        @return: memory-mapped sorted uint64 keys and int64 counts, or None when not cached
+        """
+        file = self._entry_file(digest, kmer_len, canonical)
+        try:
+            table = np.load(file, mmap_mode='r')
+        except (FileNotFoundError, ValueError):  # not cached, or evicted by another process
+            return None
+        try:
+            os.utime(file)  # mark as recently used
+        except OSError:
+            pass
+        # the counts row holds int64 bits, viewed back without a copy so a hit has the dtype of a miss
+        return table[0], table[1].view(np.int64)
+
+    def put(self, digest: str, kmer_len: int, canonical: bool, keys: np.ndarray, counts: np.ndarray) -> None:
+        """
+        Add a count table, then evict the least recently used entries if the cache is too big
+        @param digest: sequence_digest of the sequence
+        @param kmer_len: Int of the kmer size
+        @param canonical: Canonical kmers or not
+        @param keys: sorted uint64 packed kmers
+        @param counts: count of each kmer
+        @return: None
+        """
+        file = self._entry_file(digest, kmer_len, canonical)
+        with self._lock():
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.tmp', delete=False) as out_fh:
+                np.save(out_fh, np.stack((keys.astype(np.uint64), counts.astype(np.int64).view(np.uint64))))
+            os.replace(out_fh.name, file)
+            self._evict()
+
+    def count_kmers(self, dna, kmer_len: int = 3, canonical: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same as packed_kmers.count_kmers_packed, taking the table from the cache when it is there
+        @param dna: DNA str, bytes or bytearray
+        @param kmer_len: Int of the kmer size
+        @param canonical: Count canonical kmers
+        @return: Tuple of sorted uint64 keys and int64 counts, the same dtypes whether cached or not
+        """
+        if len(dna) < self.min_seq_len:
+            return count_kmers_packed(dna, kmer_len=kmer_len, canonical=canonical)
+        digest = sequence_digest(dna)
+        table = self.get(digest, kmer_len, canonical)
+        if table is None:
+            table = count_kmers_packed(dna, kmer_len=kmer_len, canonical=canonical)
+            self.put(digest, kmer_len, canonical, *table)
+        return table
+
+    def count_kmer_range(self, dna, kmer_lens: Iterable[int] = range(2, 31),
+                         canonical: bool = False) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Count tables for a range of kmer lengths.  The lengths missing from the cache are counted together with
+        multi_k.iter_kmer_counts in one scan of the sequence
+        @param dna: DNA str, bytes or bytearray
+        @param kmer_lens: kmer lengths to count
+        @param canonical: Count canonical kmers
+        @return: Dict of kmer_len -> (sorted uint64 keys, counts), in increasing kmer_len order
+        """
+        kmer_lens = sorted(set(kmer_lens))
+        if len(dna) < self.min_seq_len:
+            return {kmer_len: (keys, counts) for kmer_len, keys, counts
+                    in iter_kmer_counts(dna, kmer_lens=kmer_lens, canonical=canonical)}
+        digest = sequence_digest(dna)
+        tables = {kmer_len: self.get(digest, kmer_len, canonical) for kmer_len in kmer_lens}
+        missing = [kmer_len for kmer_len, table in tables.items() if table is None]
+        if missing:
+            for kmer_len, keys, counts in iter_kmer_counts(dna, kmer_lens=missing, canonical=canonical):
+                self.put(digest, kmer_len, canonical, keys, counts)
+                tables[kmer_len] = (keys, counts)
+        return tables
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        @return: None
+        """
+        with self._lock():
+            self._evict()
+
+    def clear(self) -> None:
+        """
+        Remove every entry
+        @return: None
+        """
+        with self._lock():
+            for file in self._entry_files():
+                remove_file(file)
+
+    def _evict(self) -> None:
+        """
+        evict without taking the lock, for callers that hold it
+        @return: None
+        """
+        entries = []
+        for file in self._entry_files():
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            remove_file(file)  # open memory maps of the file stay valid
+            total -= size
+
+    def _entry_files(self) -> list:
+        """
+        @return: paths of every entry
+        """
+        return glob.glob(os.path.join(self.cache_dir, '*_k*_[cf].npy'))
+
+    def _entry_file(self, digest: str, kmer_len: int, canonical: bool) -> str:
+        """
+        @param digest: sequence_digest of the sequence
+        @param kmer_len: Int of the kmer size
+        @param canonical: Canonical kmers or not
+        @return: path of the entry
+        """
+        return os.path.join(self.cache_dir, f"{digest}_k{kmer_len}_{'c' if canonical else 'f'}.npy")
+
+    def _lock(self) -> DirLock:
+        """
+        @return: context manager holding the exclusive writer lock of the cache
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return DirLock(os.path.join(self.cache_dir, LOCK_FILE))
+
+
+def get_default_cache() -> KmerCountCache:
+    """
+    The cache used by count_kmers2.count_kmer and compare_fasta_kmers.compare_genomes.
+    Set the directory and size with the KMER_CACHE_DIR and KMER_CACHE_MAX_BYTES environment variables
+    @return: KmerCountCache
+    """
+    if not _DEFAULT_CACHE:
+        _DEFAULT_CACHE.append(KmerCountCache(cache_dir=os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR),
+                                             max_bytes=int(os.environ.get(CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES))))
+    return _DEFAULT_CACHE[0]
+
+
+def sequence_digest(dna) -> str:
+    """
+    @param dna: DNA str, bytes or bytearray
+    @return: sha256 hex digest of the sequence
+    """
+    if isinstance(dna, str):
+        dna = dna.encode('ascii')
+    return hashlib.sha256(dna).hexdigest()
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    dna = 'GATTACATTGCANNACGTTGCA' * 50
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = KmerCountCache(cache_dir, min_seq_len=0)
+        keys, counts = cache.count_kmers(dna, kmer_len=5)
+        assert len(cache._entry_files()) == 1
+        cached_keys, cached_counts = cache.count_kmers(dna, kmer_len=5)
+        assert isinstance(cached_keys, np.memmap)
+        assert cached_keys.dtype == keys.dtype == np.uint64 and cached_counts.dtype == counts.dtype == np.int64
+        assert np.array_equal(keys, cached_keys) and np.array_equal(counts, cached_counts)
+        assert cache.get(sequence_digest(dna), kmer_len=5, canonical=True) is None
+
+        tables = cache.count_kmer_range(dna, kmer_lens=[4, 5, 6])
+        assert list(tables) == [4, 5, 6]
+        assert np.array_equal(tables[5][0], keys) and np.array_equal(tables[5][1], counts)
+        assert np.array_equal(tables[6][1], count_kmers_packed(dna, kmer_len=6)[1])
+        assert len(cache._entry_files()) == 3
+
+        # keep only the most recently used entry
+        for age, kmer_len in enumerate((4, 6, 5)):
+            os.utime(cache._entry_file(sequence_digest(dna), kmer_len, False), (1000 + age, 1000 + age))
+        cache.max_bytes = os.path.getsize(cache._entry_file(sequence_digest(dna), 5, False))
+        cache.evict()
+        assert cache._entry_files() == [cache._entry_file(sequence_digest(dna), 5, False)]
+        cache.clear()
+        assert not cache._entry_files()
+
+        # short sequences are not cached
+        assert KmerCountCache(cache_dir).count_kmers('GATTACA', kmer_len=3)[1].sum() == 5
+        assert not cache._entry_files()
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,232 @@
+"""
+MinHash and FracMinHash sketches of DNA kmers
+Instead of keeping every kmer, a sketch keeps a small sample of hashed kmers:
+    bottom-s MinHash:  the s smallest hash values
+    FracMinHash:       every hash value below 2^64 / scaled, so about 1/scaled of the kmers
+Jaccard index and containment are then estimated from the sketches (Broder, 1997; Irber et al., 2022)
+"""
+import os
+import tempfile
+from collections import namedtuple
+from dataclasses import dataclass
+
+import numpy as np
+
+from fasta_reader import read_fasta
+from packed_kmers import encode_dna, iter_kmer_codes, sort_unique
+from utils import generate_random_dna
+
+DEFAULT_SEED = 42
+HASH_MAX = 2 ** 64 - 1
+Z_95 = 1.96  # normal quantile for the 95% bounds
+
+# value is the estimate, low and high are the 95% bounds from the standard error
+Estimate = namedtuple('Estimate', ['value', 'std_error', 'low', 'high'])
+
+
+@dataclass
+class KmerSketch:
+    """Sorted unique kmer hashes plus the settings that are needed to compare two sketches"""
+    hashes: np.ndarray
+    kmer_len: int
+    canonical: bool = True
+    num_hashes: int = 0  # bottom-s MinHash size, 0 when this is a FracMinHash sketch
+    scaled: int = 0  # FracMinHash scale factor, 0 when this is a bottom-s sketch
+    seed: int = DEFAULT_SEED
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+
+def hash_kmers(values: np.ndarray, seed: int = DEFAULT_SEED) -> np.ndarray:
+    """
+    Hash packed kmers with the 64-bit MurmurHash3 finalizer, all values at once
+    @param values: uint64 array of packed kmers
+    @param seed: Seed mixed into the hash, sketches can only be compared when they use the same seed
+    @return: uint64 array of hash values
+    """
+    hashes = np.asarray(values, dtype=np.uint64) ^ np.uint64(seed)
+    with np.errstate(over='ignore'):
+        hashes ^= hashes >> np.uint64(33)
+        hashes *= np.uint64(0xff51afd7ed558ccd)
+        hashes ^= hashes >> np.uint64(33)
+        hashes *= np.uint64(0xc4ceb9fe1a85ec53)
+        hashes ^= hashes >> np.uint64(33)
+    return hashes
+
+
+def sketch_sequence(dna, kmer_len: int = 21, num_hashes: int = 1000, scaled: int = 0,
+                    canonical: bool = True, seed: int = DEFAULT_SEED) -> KmerSketch:
+    """
+    Build a sketch of the kmers of a DNA sequence
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_len: Int of the kmer size
+    @param num_hashes: Keep the num_hashes smallest hashes (bottom-s MinHash), ignored when scaled is set
+    @param scaled: Keep the hashes below 2^64 / scaled (FracMinHash)
+    @param canonical: Sketch canonical kmers so the strand does not matter
+    @param seed: Seed for the hash function
+    @return: KmerSketch
+    """
+    max_hash = np.uint64(min(HASH_MAX, 2 ** 64 // scaled)) if scaled else None
+    hashes = np.empty(0, dtype=np.uint64)
+    for values in iter_kmer_codes(encode_dna(dna), kmer_len=kmer_len, canonical=canonical):
+        chunk = hash_kmers(values, seed=seed)
+        if scaled:
+            hashes = sort_unique(np.concatenate((hashes, chunk[chunk <= max_hash])))
+        else:
+            # only the num_hashes smallest of the chunk can make it into the sketch
+            chunk = sort_unique(chunk)[:num_hashes]
+            hashes = np.union1d(hashes, chunk)[:num_hashes]
+    return KmerSketch(hashes=hashes, kmer_len=kmer_len, canonical=canonical,
+                      num_hashes=0 if scaled else num_hashes, scaled=scaled, seed=seed)
+
+
+def sketch_fasta(file: str = None, kmer_len: int = 21, num_hashes: int = 1000, scaled: int = 0,
+                 canonical: bool = True, seed: int = DEFAULT_SEED) -> KmerSketch:
+    """
+    Build one sketch for all the records of a FASTA file (plain or gzip), kmers do not span two records
+    @param file: Path to the FASTA file
+    @param kmer_len: Int of the kmer size
+    @param num_hashes: Keep the num_hashes smallest hashes (bottom-s MinHash), ignored when scaled is set
+    @param scaled: Keep the hashes below 2^64 / scaled (FracMinHash)
+    @param canonical: Sketch canonical kmers so the strand does not matter
+    @param seed: Seed for the hash function
+    @return: KmerSketch
+    """
+    hashes = np.empty(0, dtype=np.uint64)
+    for _, seq in read_fasta(file):
+        record_sketch = sketch_sequence(seq, kmer_len=kmer_len, num_hashes=num_hashes, scaled=scaled,
+                                        canonical=canonical, seed=seed)
+        hashes = np.union1d(hashes, record_sketch.hashes)
+        if not scaled:
+            hashes = hashes[:num_hashes]
+    return KmerSketch(hashes=hashes, kmer_len=kmer_len, canonical=canonical,
+                      num_hashes=0 if scaled else num_hashes, scaled=scaled, seed=seed)
+
+
+def jaccard_index_estimate(sketch1: KmerSketch, sketch2: KmerSketch) -> Estimate:
+    """
+    Estimate the Jaccard index J(A,B) = |A∩B| / |A∪B| from two sketches.
+    The hashes of the union sketch are a uniform sample of A∪B, J is the fraction of the sample found in both
+    @param sketch1: sketch of A
+    @param sketch2: sketch of B
+    @return: Estimate
+    """
+    sample, in_both, _ = _sample_union(sketch1, sketch2)
+    return _proportion_estimate(int(in_both.sum()), len(sample))
+
+
+def containment_estimate(sketch1: KmerSketch, sketch2: KmerSketch) -> Estimate:
+    """
+    Estimate the containment C(A,B) = |A∩B| / |A| from two sketches.
+    C is the fraction of the sampled kmers of A that are also in B
+    @param sketch1: sketch of A
+    @param sketch2: sketch of B
+    @return: Estimate
+    """
+    _, in_both, in_first = _sample_union(sketch1, sketch2)
+    return _proportion_estimate(int(in_both.sum()), int(in_first.sum()))
+
+
+def _sample_union(sketch1: KmerSketch, sketch2: KmerSketch) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Get the union sample of two compatible sketches and which of the sampled hashes are in A and in B
+    @param sketch1: sketch of A
+    @param sketch2: sketch of B
+    @return: sampled hashes, bool array in both, bool array in A
+    """
+    _check_compatible(sketch1, sketch2)
+    sample = np.union1d(sketch1.hashes, sketch2.hashes)
+    if sketch1.num_hashes:
+        # the bottom-s of the union is the bottom-s of the union of the two bottom-s sketches
+        sample = sample[:min(sketch1.num_hashes, sketch2.num_hashes)]
+    in_first = np.isin(sample, sketch1.hashes, assume_unique=True)
+    in_second = np.isin(sample, sketch2.hashes, assume_unique=True)
+    return sample, in_first & in_second, in_first
+
+
+def _proportion_estimate(hits: int, total: int) -> Estimate:
+    """
+    Estimate a proportion from a sample, with its binomial standard error
+    @param hits: Number of sampled kmers that matched
+    @param total: Number of sampled kmers
+    @return: Estimate
+    """
+    if total == 0:
+        return Estimate(value=0.0, std_error=0.0, low=0.0, high=0.0)
+    value = hits / total
+    std_error = (value * (1 - value) / total) ** 0.5
+    return Estimate(value=value, std_error=std_error,
+                    low=max(0.0, value - Z_95 * std_error), high=min(1.0, value + Z_95 * std_error))
+
+
+def _check_compatible(sketch1: KmerSketch, sketch2: KmerSketch) -> None:
+    """
+    Sketches can only be compared when they were built the same way
+    @param sketch1: first sketch
+    @param sketch2: second sketch
+    @return: None
+    """
+    for attribute in ('kmer_len', 'canonical', 'scaled', 'seed'):
+        if getattr(sketch1, attribute) != getattr(sketch2, attribute):
+            raise ValueError(f"Sketches differ in {attribute}: "
+                             f"{getattr(sketch1, attribute)} != {getattr(sketch2, attribute)}")
+    if bool(sketch1.num_hashes) != bool(sketch2.num_hashes):
+        raise ValueError("Can not compare a bottom-s MinHash sketch with a FracMinHash sketch")
+
+
+def save_sketch(sketch: KmerSketch, file: str = None) -> None:
+    """
+    Save a sketch to disk in NumPy .npz format
+    @param sketch: KmerSketch to save
+    @param file: Path to write
+    @return: None
+    """
+    with open(file, 'wb') as fh_out:
+        np.savez(fh_out, hashes=sketch.hashes,
+                 settings=np.array([sketch.kmer_len, int(sketch.canonical), sketch.num_hashes, sketch.scaled,
+                                    sketch.seed], dtype=np.int64))
+
+
+def load_sketch(file: str = None) -> KmerSketch:
+    """
+    Load a sketch saved with save_sketch
+    @param file: Path to read
+    @return: KmerSketch
+    """
+    with np.load(file) as data:
+        kmer_len, canonical, num_hashes, scaled, seed = data['settings'].tolist()
+        return KmerSketch(hashes=data['hashes'], kmer_len=kmer_len, canonical=bool(canonical),
+                          num_hashes=num_hashes, scaled=scaled, seed=seed)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    dna = generate_random_dna(20_000, seed=0)
+
+    # a sequence compared with itself
+    for sketch in (sketch_sequence(dna, kmer_len=15, num_hashes=500),
+                   sketch_sequence(dna, kmer_len=15, scaled=10)):
+        assert jaccard_index_estimate(sketch, sketch).value == 1.0
+        assert containment_estimate(sketch, sketch).value == 1.0
+
+    # the first half is fully contained in the whole sequence, and is about half of its kmers
+    half = sketch_sequence(dna[:10_000], kmer_len=15, scaled=10)
+    whole = sketch_sequence(dna, kmer_len=15, scaled=10)
+    assert containment_estimate(half, whole).value == 1.0
+    estimate = jaccard_index_estimate(half, whole)
+    assert estimate.low <= 0.5 <= estimate.high
+
+    # sketches survive a round trip to disk
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, 'sketch.npz')
+        save_sketch(whole, file)
+        loaded = load_sketch(file)
+        assert np.array_equal(loaded.hashes, whole.hashes) and loaded.scaled == whole.scaled
+
+
+if __name__ == '__main__':
+    test_code()
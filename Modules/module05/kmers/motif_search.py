@@ -0,0 +1,235 @@
+"""
+Count or find many motifs in one pass over a sequence, instead of one pass per motif like count_kmers1.count_kmer
+The motifs are compiled into an Aho-Corasick automaton (Aho and Corasick, 1975): a trie of the motifs where every
+state also knows where to go when the next base does not match, so the sequence is read exactly once no matter how
+many motifs there are.  The failure links are folded into a full transition table over A, C, G, T and "other"
+(anything else, e.g. N, which no motif can match), so every base is one table lookup.
+Motifs can have different lengths and use the IUPAC ambiguity codes, e.g. GANTC or RGATCY.
+"""
+import itertools
+from collections import deque
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+from fasta_reader import read_fasta
+from packed_kmers import INVALID_CODE, encode_dna
+from utils import generate_random_dna_str
+
+IUPAC_CODES = {'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+               'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+               'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT'}
+IUPAC_COMPLEMENT = str.maketrans('ACGTURYSWKMBDHVN', 'TGCAAYRSWMKVHDBN')
+NUM_CODES = INVALID_CODE + 1  # A, C, G, T and other
+MAX_EXPANSIONS = 1 << 16  # most concrete sequences one ambiguous motif may stand for
+SCAN_CHUNK_LEN = 1 << 22  # bases scanned at once, bounds the memory of the state array
+
+
+class MotifAutomaton:
+    """Aho-Corasick automaton of a set of DNA motifs"""
+
+    def __init__(self, motifs: Iterable[str], reverse_strand: bool = False):
+        """
+        @param motifs: DNA motifs, upper or lower case, with IUPAC codes
+        @param reverse_strand: Also find the motifs on the reverse strand, i.e. their reverse complements on the
+                               forward strand.  A motif that is its own reverse complement (e.g. GAATTC) is only
+                               reported once, on the + strand
+        """
+        self.motifs = list(dict.fromkeys(motif.upper() for motif in motifs))
+        if not self.motifs:
+            raise ValueError("Give at least one motif")
+        # a target is one (motif, strand) to look for
+        self.targets = [(motif, '+') for motif in self.motifs]
+        if reverse_strand:
+            self.targets.extend((motif, '-') for motif in self.motifs if reverse_complement_motif(motif) != motif)
+
+        children = [{}]  # trie, state -> {code: state}
+        outputs = [[]]  # state -> targets ending there
+        for target, (motif, strand) in enumerate(self.targets):
+            pattern = reverse_complement_motif(motif) if strand == '-' else motif
+            for codes in _expand_motif(pattern):
+                state = 0
+                for code in codes:
+                    if code not in children[state]:
+                        children[state][code] = len(children)
+                        children.append({})
+                        outputs.append([])
+                    state = children[state][code]
+                if target not in outputs[state]:
+                    outputs[state].append(target)
+        self.num_states = len(children)
+        self.outputs = outputs
+        self.transitions = self._build_transitions(children)
+
+    def _build_transitions(self, children: list) -> list:
+        """
+        Breadth first over the trie: set the failure link of every state and fill in the missing transitions from it.
+        The outputs of the failure state are added to each state, so a state knows every target ending at it
+        @param children: trie, state -> {code: state}
+        @return: flat transition list, transitions[state * NUM_CODES + code] = next state * NUM_CODES
+        """
+        transitions = [0] * (len(children) * NUM_CODES)
+        fail = [0] * len(children)
+        queue = deque()
+        for code in range(INVALID_CODE):
+            child = children[0].get(code)
+            if child is not None:
+                transitions[code] = child * NUM_CODES
+                queue.append(child)
+        while queue:
+            state = queue.popleft()
+            self.outputs[state].extend(target for target in self.outputs[fail[state]]
+                                       if target not in self.outputs[state])
+            for code in range(INVALID_CODE):
+                child = children[state].get(code)
+                if child is None:
+                    transitions[state * NUM_CODES + code] = transitions[fail[state] * NUM_CODES + code]
+                else:
+                    fail[child] = transitions[fail[state] * NUM_CODES + code] // NUM_CODES
+                    transitions[state * NUM_CODES + code] = child * NUM_CODES
+                    queue.append(child)
+            # an invalid base goes back to the root, the default of 0
+        return transitions
+
+    def scan(self, dna, state: int = 0) -> Tuple[np.ndarray, int]:
+        """
+        Run the automaton over a sequence
+        @param dna: DNA str, bytes or bytearray
+        @param state: State to start in, the last state of the previous piece to continue a sequence
+        @return: Tuple of the state after each base and the last state
+        """
+        transitions = self.transitions
+        codes = encode_dna(dna).tolist()
+        # still one Python call per base (the lambda), but only a list lookup in it, and np.fromiter fills the array
+        # without building a list of the states first
+        states = np.fromiter(itertools.accumulate(codes, lambda current, code: transitions[current + code],
+                                                  initial=state * NUM_CODES),
+                             dtype=np.int64, count=len(codes) + 1)[1:] // NUM_CODES
+        return states, int(states[-1]) if len(states) else state
+
+    def count(self, dna, chunk_len: int = SCAN_CHUNK_LEN) -> dict:
+        """
+        Count every motif in a sequence, overlapping occurrences included
+        @param dna: DNA str, bytes or bytearray
+        @param chunk_len: Bases scanned at once
+        @return: Dict of motif -> count, reverse strand hits are added to the motif's count
+        """
+        visits = np.zeros(self.num_states, dtype=np.int64)
+        state = 0
+        for start in range(0, len(dna), chunk_len):
+            states, state = self.scan(dna[start:start + chunk_len], state=state)
+            visits += np.bincount(states, minlength=self.num_states)
+        return self._counts_from_visits(visits)
+
+    def find(self, dna, chunk_len: int = SCAN_CHUNK_LEN) -> Iterator[Tuple[str, int, str]]:
+        """
+        Generator of every motif hit in a sequence
+        @param dna: DNA str, bytes or bytearray
+        @param chunk_len: Bases scanned at once
+        @return: Iterator of (motif, 0-based start on the forward strand, strand), in order of the end position
+        """
+        has_output = np.array([bool(outputs) for outputs in self.outputs])
+        state = 0
+        for start in range(0, len(dna), chunk_len):
+            states, state = self.scan(dna[start:start + chunk_len], state=state)
+            for end in np.flatnonzero(has_output[states]).tolist():
+                for target in self.outputs[states[end]]:
+                    motif, strand = self.targets[target]
+                    yield motif, start + end - len(motif) + 1, strand
+
+    def count_fasta(self, file: str = None) -> dict:
+        """
+        Count every motif over all the records of a FASTA file (plain or gzip), reading one record at a time
+        @param file: Path to the FASTA file
+        @return: Dict of motif -> count
+        """
+        totals = dict.fromkeys(self.motifs, 0)
+        for _, seq in read_fasta(file):
+            for motif, count in self.count(seq).items():
+                totals[motif] += count
+        return totals
+
+    def find_fasta(self, file: str = None) -> Iterator[Tuple[str, str, int, str]]:
+        """
+        Generator of every motif hit in a FASTA file (plain or gzip), reading one record at a time
+        @param file: Path to the FASTA file
+        @return: Iterator of (header, motif, 0-based start, strand)
+        """
+        for header, seq in read_fasta(file):
+            for motif, start, strand in self.find(seq):
+                yield header, motif, start, strand
+
+    def _counts_from_visits(self, visits: np.ndarray) -> dict:
+        """
+        @param visits: Number of times each state was entered
+        @return: Dict of motif -> count
+        """
+        counts = dict.fromkeys(self.motifs, 0)
+        for state in np.flatnonzero(visits).tolist():
+            for target in self.outputs[state]:
+                counts[self.targets[target][0]] += int(visits[state])
+        return counts
+
+
+def count_motifs(motifs: Iterable[str], dna, reverse_strand: bool = False) -> dict:
+    """
+    Count many motifs in one pass, the multi-motif version of count_kmers1.count_kmer
+    sample use: count_motifs(["GGG", "GNG"], "AGGGCGGG") => {'GGG': 2, 'GNG': 3}
+    @param motifs: DNA motifs, with IUPAC codes
+    @param dna: The sequence to explore for the motifs
+    @param reverse_strand: Also count the hits on the reverse strand
+    @return: Dict of motif -> count
+    """
+    return MotifAutomaton(motifs, reverse_strand=reverse_strand).count(dna)
+
+
+def reverse_complement_motif(motif: str) -> str:
+    """
+    @param motif: DNA motif with IUPAC codes
+    @return: reverse complement of the motif, ambiguity codes complemented too (R <-> Y, ...)
+    """
+    return motif.upper().translate(IUPAC_COMPLEMENT)[::-1]
+
+
+def _expand_motif(motif: str) -> Iterator[Tuple[int, ...]]:
+    """
+    Generator of every concrete sequence an ambiguous motif stands for, as tuples of 2-bit codes
+    @param motif: DNA motif with IUPAC codes
+    @return: Iterator of code tuples
+    """
+    try:
+        choices = [encode_dna(IUPAC_CODES[base]).tolist() for base in motif]
+    except KeyError as err:
+        raise ValueError(f"Motif {motif} has a letter that is not an IUPAC code: {err}") from None
+    if np.prod([len(choice) for choice in choices], dtype=np.float64) > MAX_EXPANSIONS:
+        raise ValueError(f"Motif {motif} stands for more than {MAX_EXPANSIONS} sequences")
+    return itertools.product(*choices)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    assert count_motifs(['GGG'], 'AGGGCGGG') == {'GGG': 2}
+    assert count_motifs(['GGG', 'GNG', 'CG'], 'AGGGCGGG') == {'GGG': 2, 'GNG': 3, 'CG': 1}
+
+    # same as count_kmers1.count_kmer for every trinucleotide, across chunk boundaries
+    dna = generate_random_dna_str(5_000)
+    trinucleotides = [''.join(bases) for bases in itertools.product('ACGT', repeat=3)]
+    counts = MotifAutomaton(trinucleotides).count(dna, chunk_len=1000)
+    assert counts == {kmer: sum(dna[i:i + 3] == kmer for i in range(len(dna) - 2)) for kmer in trinucleotides}
+
+    # N in the sequence breaks a match, lower case matches
+    assert count_motifs(['ACGT'], 'ACNGTacgt') == {'ACGT': 1}
+
+    # GTCT at 6 is AGAC on the reverse strand, GAATTC is its own reverse complement
+    automaton = MotifAutomaton(['AGAC', 'GAATTC'], reverse_strand=True)
+    hits = list(automaton.find('AGACTTGTCTGAATTC'))
+    assert hits == [('AGAC', 0, '+'), ('AGAC', 6, '-'), ('GAATTC', 10, '+')]
+    assert automaton.count('AGACTTGTCTGAATTC') == {'AGAC': 2, 'GAATTC': 1}
+    assert reverse_complement_motif('RGATCY') == 'RGATCY'
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,162 @@
+"""
+Compare the distinct kmers of two sequences for a whole range of kmer lengths in one pass.
+The packed value of a k-mer is the packed value of the (k-1)-mer at the same position extended by one base:
+    value_k[i] = (value_k-1[i] << 2) | base[i + k - 1]
+so every kmer length is built from the previous one with one vectorized operation instead of rescanning the sequence.
+"""
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from packed_kmers import (CHUNK_LEN, INVALID_CODE, MAX_KMER_LEN, encode_dna, merge_count_tables,
+                          sort_unique)
+
+
+def iter_distinct_kmers(dna, kmer_lens: Iterable[int] = range(2, 31), canonical: bool = False,
+                        chunk_len: int = CHUNK_LEN) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Get the distinct packed kmers of a sequence for every kmer length, sharing the work between the lengths.
+    Each kmer length is finished and yielded before the next one is built, so besides the packed (k-1)-mers of the
+    whole sequence (8 bytes per base, 16 with canonical) only the distinct kmers of one length are held
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_lens: kmer lengths to report, each from 1 to MAX_KMER_LEN
+    @param canonical: Use min(kmer, reverse complement of kmer)
+    @param chunk_len: How many kmer start positions to work on at once, bounds the working memory
+    @return: Iterator of (kmer_len, sorted unique uint64 kmers), in increasing kmer_len order
+    """
+    for kmer_len, group in groupby(_iter_kmer_chunks(dna, sorted(set(kmer_lens)), canonical=canonical,
+                                                     chunk_len=chunk_len), key=itemgetter(0)):
+        parts = [sort_unique(kmers) for _, kmers in group]
+        yield kmer_len, parts[0] if len(parts) == 1 else sort_unique(np.concatenate(parts))
+
+
+def iter_kmer_counts(dna, kmer_lens: Iterable[int] = range(2, 31), canonical: bool = False,
+                     chunk_len: int = CHUNK_LEN) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Same as iter_distinct_kmers, but also count every kmer
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_lens: kmer lengths to report, each from 1 to MAX_KMER_LEN
+    @param canonical: Use min(kmer, reverse complement of kmer)
+    @param chunk_len: How many kmer start positions to work on at once, bounds the working memory
+    @return: Iterator of (kmer_len, sorted unique uint64 kmers, int64 counts), in increasing kmer_len order
+    """
+    for kmer_len, group in groupby(_iter_kmer_chunks(dna, sorted(set(kmer_lens)), canonical=canonical,
+                                                     chunk_len=chunk_len), key=itemgetter(0)):
+        keys, counts = merge_count_tables([np.unique(kmers, return_counts=True) for _, kmers in group])
+        yield kmer_len, keys, counts
+
+
+def _iter_kmer_chunks(dna, kmer_lens: list, canonical: bool = False,
+                      chunk_len: int = CHUNK_LEN) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Generator of the valid packed kmers of each chunk of the sequence, every chunk of one kmer length before the
+    next length.  The packed values of all positions are extended in place from k-1 to k, so only the current
+    length is kept
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_lens: sorted kmer lengths to report, each from 1 to MAX_KMER_LEN
+    @param canonical: Use min(kmer, reverse complement of kmer)
+    @param chunk_len: How many kmer start positions to work on at once
+    @return: Iterator of (kmer_len, uint64 kmers of one chunk), at least one (maybe empty) array per kmer length
+    """
+    if kmer_lens[0] < 1 or kmer_lens[-1] > MAX_KMER_LEN:
+        raise ValueError(f"kmer lengths must be between 1 and {MAX_KMER_LEN}, got {kmer_lens}")
+    codes = encode_dna(dna)
+    # running count of invalid bases, so a window has an invalid base if the count changes across it
+    invalid = np.concatenate(([0], np.cumsum(codes == INVALID_CODE, dtype=np.int64)))
+    bases = (codes & 3).astype(np.uint64)  # invalid bases are dropped with the mask, keep them from spilling bits
+    complements = np.uint64(3) - bases
+    values = np.zeros(len(codes), dtype=np.uint64)
+    rev_values = np.zeros(len(codes) if canonical else 0, dtype=np.uint64)
+    report = set(kmer_lens)
+
+    for kmer_len in range(1, kmer_lens[-1] + 1):
+        num_kmers = len(codes) - kmer_len + 1
+        if num_kmers <= 0:
+            break
+        for start in range(0, num_kmers, chunk_len):
+            stop = min(start + chunk_len, num_kmers)
+            chunk = values[start:stop]  # a view, extended in place
+            chunk <<= np.uint64(2)
+            chunk |= bases[start + kmer_len - 1:stop + kmer_len - 1]
+            if canonical:
+                # the reverse complement grows at the front, the new base goes in the highest bits
+                rev_values[start:stop] |= complements[start + kmer_len - 1:stop + kmer_len - 1] << \
+                    np.uint64(2 * (kmer_len - 1))
+            if kmer_len in report:
+                valid = invalid[start + kmer_len:stop + kmer_len] == invalid[start:stop]
+                kmers = np.minimum(chunk, rev_values[start:stop]) if canonical else chunk
+                yield kmer_len, kmers[valid]  # a copy, the view changes with the next length
+        report.discard(kmer_len)
+    # lengths longer than the sequence have no kmers
+    for kmer_len in sorted(report):
+        yield kmer_len, np.empty(0, dtype=np.uint64)
+
+
+def compare_kmer_range(seq1: str, seq2: str, kmer_lens: Iterable[int] = range(2, 31),
+                       canonical: bool = False, cache=None) -> pd.DataFrame:
+    """
+    Jaccard index and jaccard containment of two sequences for every kmer length
+    @param seq1: DNA seq1
+    @param seq2: DNA seq2
+    @param kmer_lens: kmer lengths to compare
+    @param canonical: Compare canonical kmers, so a genome and its reverse complement are the same
+    @param cache: kmer_cache.KmerCountCache to take the kmers of each sequence from, counted when missing
+    @return: DataFrame with one row per kmer length
+    """
+    if cache is None:
+        kmers_range1 = iter_distinct_kmers(seq1, kmer_lens=kmer_lens, canonical=canonical)
+        kmers_range2 = iter_distinct_kmers(seq2, kmer_lens=kmer_lens, canonical=canonical)
+    else:
+        # the keys of a count table are the distinct kmers
+        kmers_range1 = ((kmer_len, keys) for kmer_len, (keys, _)
+                        in cache.count_kmer_range(seq1, kmer_lens=kmer_lens, canonical=canonical).items())
+        kmers_range2 = ((kmer_len, keys) for kmer_len, (keys, _)
+                        in cache.count_kmer_range(seq2, kmer_lens=kmer_lens, canonical=canonical).items())
+    rows = []
+    for (kmer_len, kmers1), (_, kmers2) in zip(kmers_range1, kmers_range2):
+        intersection = len(np.intersect1d(kmers1, kmers2, assume_unique=True))
+        union = len(kmers1) + len(kmers2) - intersection
+        rows.append({'kmer_len': kmer_len,
+                     'distinct1': len(kmers1),
+                     'distinct2': len(kmers2),
+                     'intersection': intersection,
+                     'union': union,
+                     'jaccard_index': intersection / union if union else 0.0,
+                     'jaccard_containment': intersection / len(kmers1) if len(kmers1) else 0.0})
+    return pd.DataFrame(rows)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    table = compare_kmer_range('GATTACATT', 'GATTACA', kmer_lens=[3, 4])
+    # 3-mers: {GAT, ATT, TTA, TAC, ACA, CAT} vs {GAT, ATT, TTA, TAC, ACA}
+    assert table['intersection'].tolist() == [5, 4]
+    assert table['union'].tolist() == [6, 6]
+    assert table['jaccard_containment'].tolist() == [5 / 6, 4 / 6]
+
+    # same answer as counting each kmer length on its own, across chunk boundaries and an N
+    dna = 'ACGTTGCANNACGGTACCATGGATTACA' * 5
+    for kmer_len, kmers in iter_distinct_kmers(dna, kmer_lens=range(1, 8), chunk_len=7):
+        expected = {dna[i:i + kmer_len] for i in range(len(dna) - kmer_len + 1) if 'N' not in dna[i:i + kmer_len]}
+        assert len(kmers) == len(expected)
+
+    for kmer_len, keys, counts in iter_kmer_counts(dna, kmer_lens=[3, 10], chunk_len=7):
+        assert counts.sum() == sum('N' not in dna[i:i + kmer_len] for i in range(len(dna) - kmer_len + 1))
+        assert np.array_equal(keys, dict(iter_distinct_kmers(dna, kmer_lens=[kmer_len]))[kmer_len])
+
+    # lengths longer than the sequence are still reported, empty
+    assert [(kmer_len, len(kmers)) for kmer_len, kmers in iter_distinct_kmers('ACGTA', kmer_lens=[2, 5, 6, 9])] == \
+        [(2, 4), (5, 1), (6, 0), (9, 0)]
+
+    table = compare_kmer_range('GATTACATTGCA', 'TGCAATGTAATC', kmer_lens=[5, 9], canonical=True)
+    assert table['jaccard_index'].tolist() == [1.0, 1.0]
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,274 @@
+"""
+Count DNA kmers as 2-bit packed integers instead of Python strings
+Each base is encoded as A=0, C=1, G=2, T=3, so a kmer of up to 31 bases fits in one uint64.  Small kmers are
+counted into a dense NumPy array of size 4^k, larger kmers are counted with sorted uint64 arrays.
+With this encoding the complement of a base is 3 - code (A<->T, C<->G), so a reverse complement is just
+flipping all the bits and reversing the order of the 2-bit groups.
+"""
+from typing import Iterator, Tuple
+
+import numpy as np
+
+MAX_KMER_LEN = 31  # 2 bits per base, 31 bases fit in an uint64 with room to spare
+DENSE_MAX_KMER_LEN = 10  # 4^10 counters is 8 MB of int64, above this use sorted arrays
+CHUNK_LEN = 1 << 24  # number of kmer start positions to pack at once, bounds the uint64 working memory
+INVALID_CODE = 4  # anything that is not A, C, G or T (e.g. N)
+
+# byte -> 2-bit code lookup table, upper and lower case are the same base
+_BASE_TO_CODE = np.full(256, INVALID_CODE, dtype=np.uint8)
+for _code, _bases in enumerate(('Aa', 'Cc', 'Gg', 'Tt')):
+    for _base in _bases:
+        _BASE_TO_CODE[ord(_base)] = _code
+# 2-bit code -> byte lookup table used when decoding
+_CODE_TO_BASE = np.frombuffer(b'ACGT', dtype=np.uint8)
+# (shift, mask) pairs that reverse the order of the 2-bit groups in an uint64
+_REVERSE_STEPS = tuple((np.uint64(shift), np.uint64(mask)) for shift, mask in (
+    (2, 0x3333333333333333),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (8, 0x00FF00FF00FF00FF),
+    (16, 0x0000FFFF0000FFFF),
+    (32, 0x00000000FFFFFFFF),
+))
+
+
+def encode_dna(dna) -> np.ndarray:
+    """
+    Encode a DNA sequence into an array of 2-bit codes, one uint8 per base
+    @param dna: DNA str, bytes or bytearray
+    @return: uint8 array of codes, bases that are not ACGT get INVALID_CODE
+    """
+    if isinstance(dna, str):
+        dna = dna.encode('ascii')
+    return _BASE_TO_CODE[np.frombuffer(dna, dtype=np.uint8)]
+
+
+def reverse_complement_kmers(values: np.ndarray, kmer_len: int = 3) -> np.ndarray:
+    """
+    Reverse complement packed kmers with bit operations, all values at once
+    @param values: uint64 array of packed kmers
+    @param kmer_len: Int of the kmer size
+    @return: uint64 array of the packed reverse complements
+    """
+    values = ~np.asarray(values, dtype=np.uint64)  # complement every base
+    for shift, mask in _REVERSE_STEPS:
+        values = ((values >> shift) & mask) | ((values & mask) << shift)
+    # the kmer now sits in the high bits, move it back down
+    return values >> np.uint64(64 - 2 * kmer_len)
+
+
+def iter_kmer_codes(codes: np.ndarray, kmer_len: int = 3, chunk_len: int = CHUNK_LEN,
+                    canonical: bool = False) -> Iterator[np.ndarray]:
+    """
+    Generator of the packed kmer values for every valid kmer position, chunk by chunk.
+    A rolling value is built for all positions of a chunk at once: value = (value << 2) | next_base
+    Kmers that overlap an invalid base are dropped.
+    @param codes: uint8 array from encode_dna
+    @param kmer_len: Int of the kmer size
+    @param chunk_len: How many kmer start positions to pack at once
+    @param canonical: Yield min(kmer, reverse complement of kmer) so both strands give the same value
+    @return: Iterator of uint64 arrays
+    """
+    _check_kmer_len(kmer_len)
+    num_kmers = len(codes) - kmer_len + 1
+    if num_kmers <= 0:
+        return
+    for start in range(0, num_kmers, chunk_len):
+        stop = min(start + chunk_len, num_kmers)
+        values = np.zeros(stop - start, dtype=np.uint64)
+        for offset in range(kmer_len):
+            values <<= np.uint64(2)
+            values |= codes[start + offset:stop + offset]
+        # running count of invalid bases over the bases of the chunk only, so the working memory stays per chunk.
+        # A kmer has an invalid base if the count changes across it
+        invalid = np.concatenate(([0], np.cumsum(codes[start:stop + kmer_len - 1] == INVALID_CODE, dtype=np.int64)))
+        valid = invalid[kmer_len:] == invalid[:stop - start]
+        values = values[valid]
+        if canonical:
+            values = np.minimum(values, reverse_complement_kmers(values, kmer_len=kmer_len))
+        yield values
+
+
+def count_kmers_dense(codes: np.ndarray, kmer_len: int = 3, canonical: bool = False) -> np.ndarray:
+    """
+    Count the kmers into a dense array where the index is the packed kmer
+    @param codes: uint8 array from encode_dna
+    @param kmer_len: Int of the kmer size, should be small since the array has 4^kmer_len entries
+    @param canonical: Count the canonical kmers
+    @return: int64 array of size 4^kmer_len
+    """
+    counts = np.zeros(4 ** kmer_len, dtype=np.int64)
+    for values in iter_kmer_codes(codes, kmer_len=kmer_len, canonical=canonical):
+        counts += np.bincount(values.astype(np.intp), minlength=len(counts))
+    return counts
+
+
+def count_kmers_sorted(codes: np.ndarray, kmer_len: int = 3,
+                       canonical: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the kmers as sorted unique uint64 keys with a matching counts array
+    @param codes: uint8 array from encode_dna
+    @param kmer_len: Int of the kmer size, up to MAX_KMER_LEN
+    @param canonical: Count the canonical kmers
+    @return: Tuple of sorted uint64 keys and int64 counts
+    """
+    # each chunk is made unique on its own, then one final sort merges them all
+    return merge_count_tables([np.unique(values, return_counts=True)
+                               for values in iter_kmer_codes(codes, kmer_len=kmer_len, canonical=canonical)])
+
+
+def merge_counts(keys1: np.ndarray, counts1: np.ndarray,
+                 keys2: np.ndarray, counts2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge two sorted key/count tables, adding the counts of keys found in both
+    @param keys1: sorted uint64 keys
+    @param counts1: counts for keys1
+    @param keys2: sorted uint64 keys
+    @param counts2: counts for keys2
+    @return: Tuple of sorted uint64 keys and int64 counts
+    """
+    return merge_count_tables([(keys1, counts1), (keys2, counts2)])
+
+
+def merge_count_tables(tables: list) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge any number of sorted key/count tables, adding the counts of keys found in more than one
+    @param tables: list of (sorted uint64 keys, counts) tuples
+    @return: Tuple of sorted uint64 keys and int64 counts
+    """
+    tables = [(keys, counts) for keys, counts in tables if len(keys)]
+    if not tables:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    if len(tables) == 1:
+        return tables[0][0], tables[0][1].astype(np.int64)
+    return _sum_equal_keys(np.concatenate([keys for keys, _ in tables]),
+                           np.concatenate([counts for _, counts in tables]))
+
+
+def count_kmers_packed(dna, kmer_len: int = 3, canonical: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the kmers in a DNA sequence using the packed engine, picking the dense or the sorted counter by kmer_len
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_len: Int of the kmer size, up to MAX_KMER_LEN
+    @param canonical: Count min(kmer, reverse complement) so the result does not depend on the strand
+    @return: Tuple of sorted uint64 keys and int64 counts, only kmers that were found
+    """
+    return count_kmer_codes(encode_dna(dna), kmer_len=kmer_len, canonical=canonical)
+
+
+def count_kmer_codes(codes: np.ndarray, kmer_len: int = 3, canonical: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the kmers of already encoded DNA, picking the dense or the sorted counter by kmer_len
+    @param codes: uint8 array from encode_dna
+    @param kmer_len: Int of the kmer size, up to MAX_KMER_LEN
+    @param canonical: Count the canonical kmers
+    @return: Tuple of sorted uint64 keys and int64 counts, only kmers that were found
+    """
+    if kmer_len <= DENSE_MAX_KMER_LEN:
+        dense = count_kmers_dense(codes, kmer_len=kmer_len, canonical=canonical)
+        keys = np.flatnonzero(dense).astype(np.uint64)
+        return keys, dense[keys.astype(np.intp)]
+    return count_kmers_sorted(codes, kmer_len=kmer_len, canonical=canonical)
+
+
+def decode_kmers(keys: np.ndarray, kmer_len: int = 3) -> list:
+    """
+    Decode packed kmers back into strings
+    @param keys: uint64 array of packed kmers
+    @param kmer_len: Int of the kmer size
+    @return: list of kmer strings
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    letters = np.empty((len(keys), kmer_len), dtype=np.uint8)
+    for position in range(kmer_len):
+        shift = np.uint64(2 * (kmer_len - 1 - position))
+        letters[:, position] = _CODE_TO_BASE[((keys >> shift) & np.uint64(3)).astype(np.intp)]
+    text = letters.tobytes().decode('ascii')
+    return [text[i:i + kmer_len] for i in range(0, len(text), kmer_len)]
+
+
+def decode_counts(keys: np.ndarray, counts: np.ndarray, kmer_len: int = 3) -> dict:
+    """
+    Convert the packed key/count arrays into the Dict of kmer strings used by count_kmers2.count_kmer
+    @param keys: uint64 array of packed kmers
+    @param counts: counts for the keys
+    @param kmer_len: Int of the kmer size
+    @return: Dict of kmers with the value being the number of times it was found
+    """
+    return dict(zip(decode_kmers(keys, kmer_len=kmer_len), np.asarray(counts).tolist()))
+
+
+def sort_unique(values: np.ndarray) -> np.ndarray:
+    """
+    Same as np.unique(values) for uint64 kmers or hashes.  NumPy 2.x answers a plain np.unique from a hash table,
+    which is many times slower than sorting for large uint64 arrays
+    @param values: uint64 array, may contain repeats
+    @return: sorted unique uint64 array
+    """
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+
+def _sum_equal_keys(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sort the keys and add up the counts of keys that are the same
+    @param keys: uint64 keys, may contain repeats
+    @param counts: counts for the keys
+    @return: Tuple of sorted unique uint64 keys and int64 counts
+    """
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order].astype(np.int64)
+    # start of each run of equal keys
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def _check_kmer_len(kmer_len: int) -> None:
+    """
+    Make sure the kmer length can be packed into an uint64
+    @param kmer_len: Int of the kmer size
+    @return: None
+    """
+    if not 1 <= kmer_len <= MAX_KMER_LEN:
+        raise ValueError(f"kmer_len must be between 1 and {MAX_KMER_LEN}, got {kmer_len}")
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    keys, counts = count_kmers_packed('GATTACATT', kmer_len=3)
+    expected = {'ACA': 1, 'ATT': 2, 'GAT': 1, 'CAT': 1, 'TAC': 1, 'TTA': 1}
+    assert decode_counts(keys, counts, kmer_len=3) == expected
+
+    # the sorted path has to agree with the dense path
+    codes = encode_dna('GATTACATTNGATtaca')
+    dense = count_kmers_dense(codes, kmer_len=4)
+    keys, counts = count_kmers_sorted(codes, kmer_len=4)
+    assert np.array_equal(np.flatnonzero(dense), keys)
+    assert np.array_equal(dense[keys.astype(np.intp)], counts)
+    # kmers across the N are skipped, lower case is the same base
+    expected = {'GATT': 2, 'ATTA': 2, 'TTAC': 2, 'TACA': 2, 'ACAT': 1, 'CATT': 1}
+    assert decode_counts(keys, counts, kmer_len=4) == expected
+
+    keys, _ = count_kmers_packed('A' * 40, kmer_len=MAX_KMER_LEN)
+    assert decode_kmers(keys, kmer_len=MAX_KMER_LEN) == ['A' * MAX_KMER_LEN]
+
+    # reverse complement on the 2-bit codes
+    keys, _ = count_kmers_packed('ATGCAGCTGTGTTACGCGAT', kmer_len=20)
+    assert decode_kmers(reverse_complement_kmers(keys, kmer_len=20), kmer_len=20) == ['ATCGCGTAACACAGCTGCAT']
+
+    # a sequence and its reverse complement have the same canonical counts
+    forward = count_kmers_packed('GATTACATTGCA', kmer_len=5, canonical=True)
+    reverse = count_kmers_packed('TGCAATGTAATC', kmer_len=5, canonical=True)
+    assert np.array_equal(forward[0], reverse[0]) and np.array_equal(forward[1], reverse[1])
+    assert decode_counts(*count_kmers_packed('AAAATTTT', kmer_len=3, canonical=True), kmer_len=3) == \
+        {'AAA': 4, 'AAT': 2}
+
+    values = np.array([5, 1, 5, 3, 1], dtype=np.uint64)
+    assert np.array_equal(sort_unique(values), np.unique(values))
+    assert len(sort_unique(np.empty(0, dtype=np.uint64))) == 0
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,241 @@
+"""
+Count kmers on several cores
+The sequence is cut into chunks that overlap by kmer_len - 1 bases, so every kmer start belongs to exactly one chunk
+and the merged counts are the same as counting the whole sequence at once.  The workers never get the sequence
+pickled to them:
+    count_kmers_parallel:  the encoded sequence is put in shared memory once and each worker counts a slice of it
+    count_fasta_parallel:  each worker memory-maps the FASTA file and reads its own byte range
+The tests run by default, the scaling with the number of workers is timed on request:
+    python parallel_kmers.py --benchmark --length 20000000 --workers 1 2 4 8
+"""
+import argparse
+import mmap
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+from fasta_reader import GZIP_MAGIC, read_fasta
+from packed_kmers import count_kmer_codes, count_kmers_packed, encode_dna, merge_count_tables
+from utils import generate_random_dna
+
+CHUNKS_PER_WORKER = 4  # a few chunks per worker so a slow chunk does not hold up the whole pool
+MIN_CHUNK_LEN = 1 << 16  # not worth starting a task for less than this
+
+
+def main() -> None:
+    """Business Logic"""
+    args = get_cli_args()
+    if args.benchmark:
+        benchmark_workers(length=args.length, kmer_len=args.kmer_len, worker_counts=tuple(args.workers))
+    else:
+        test_code()
+
+
+def count_kmers_parallel(dna, kmer_len: int = 3, canonical: bool = False,
+                         workers: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the kmers of a sequence in a process pool
+    @param dna: DNA str, bytes or bytearray
+    @param kmer_len: Int of the kmer size, up to MAX_KMER_LEN
+    @param canonical: Count the canonical kmers
+    @param workers: Number of worker processes, default is every core
+    @return: Tuple of sorted uint64 keys and int64 counts, the same as packed_kmers.count_kmers_packed
+    """
+    workers = workers or os.cpu_count()
+    codes = encode_dna(dna)
+    ranges = split_ranges(len(codes) - kmer_len + 1, workers=workers)
+    if workers == 1 or len(ranges) <= 1:
+        return count_kmer_codes(codes, kmer_len=kmer_len, canonical=canonical)
+
+    shm = shared_memory.SharedMemory(create=True, size=len(codes))
+    try:
+        np.ndarray(len(codes), dtype=np.uint8, buffer=shm.buf)[:] = codes
+        del codes  # the shared copy is the only one needed now
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(_count_shared_chunk,
+                                       [(shm.name, shm.size, start, stop, kmer_len, canonical)
+                                        for start, stop in ranges]))
+    finally:
+        shm.close()
+        shm.unlink()
+    return merge_count_tables(tables)
+
+
+def count_fasta_parallel(file: str = None, kmer_len: int = 3, canonical: bool = False,
+                         workers: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the kmers of every record of a FASTA file in a process pool, splitting the records by byte ranges.
+    Kmers do not span two records.  Gzipped files can not be split by byte ranges, so they are read record by
+    record and each record is counted with count_kmers_parallel instead
+    @param file: Path to the FASTA file
+    @param kmer_len: Int of the kmer size, up to MAX_KMER_LEN
+    @param canonical: Count the canonical kmers
+    @param workers: Number of worker processes, default is every core
+    @return: Tuple of sorted uint64 keys and int64 counts
+    """
+    workers = workers or os.cpu_count()
+    with open(file, 'rb') as fh_in:
+        is_gzip = fh_in.read(2) == GZIP_MAGIC
+    if is_gzip:
+        return merge_count_tables([count_kmers_parallel(seq, kmer_len=kmer_len, canonical=canonical,
+                                                        workers=workers)
+                                   for _, seq in read_fasta(file)])
+
+    tasks = []
+    for span_start, span_end in get_fasta_sequence_spans(file):
+        for start, stop in split_ranges(span_end - span_start, workers=workers):
+            tasks.append((file, span_start + start, span_start + stop, span_end, kmer_len, canonical))
+    if not tasks:
+        return merge_count_tables([])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return merge_count_tables(list(executor.map(_count_fasta_chunk, tasks)))
+
+
+def split_ranges(length: int, workers: int = 1) -> list:
+    """
+    Split range(length) into about CHUNKS_PER_WORKER ranges per worker
+    @param length: Number of positions to split
+    @param workers: Number of workers
+    @return: list of (start, stop) tuples
+    """
+    if length <= 0:
+        return []
+    chunk_len = max(MIN_CHUNK_LEN, -(-length // (workers * CHUNKS_PER_WORKER)))
+    return [(start, min(start + chunk_len, length)) for start in range(0, length, chunk_len)]
+
+
+def get_fasta_sequence_spans(file: str = None) -> list:
+    """
+    Find the byte ranges of the sequence lines of every record, without reading the file into memory
+    @param file: Path to an uncompressed FASTA file
+    @return: list of (start, end) byte offsets, one per record
+    """
+    spans = []
+    with open(file, 'rb') as fh_in:
+        if os.fstat(fh_in.fileno()).st_size == 0:
+            return spans
+        with mmap.mmap(fh_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header = 0 if data[:1] == b'>' else data.find(b'\n>') + 1
+            if header == 0 and data[:1] != b'>':
+                return spans  # no records
+            while True:
+                seq_start = data.find(b'\n', header)
+                if seq_start == -1:
+                    break
+                next_header = data.find(b'\n>', seq_start)
+                seq_end = len(data) if next_header == -1 else next_header + 1
+                spans.append((seq_start + 1, seq_end))
+                if next_header == -1:
+                    break
+                header = next_header + 1
+    return spans
+
+
+def _count_shared_chunk(task: tuple) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Worker: count the kmers that start in [start, stop) of the encoded sequence in shared memory
+    @param task: (shared memory name, size, start, stop, kmer_len, canonical)
+    @return: Tuple of sorted uint64 keys and int64 counts
+    """
+    name, size, start, stop, kmer_len, canonical = task
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        codes = np.ndarray(size, dtype=np.uint8, buffer=shm.buf)
+        # copy the chunk out so no view of the shared buffer is alive when it is closed
+        return count_kmer_codes(codes[start:stop + kmer_len - 1].copy(), kmer_len=kmer_len, canonical=canonical)
+    finally:
+        shm.close()
+
+
+def _count_fasta_chunk(task: tuple) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Worker: count the kmers that start in the byte range [start, stop) of a FASTA record.
+    The next kmer_len - 1 bases after stop (up to the end of the record) are read as the overlap
+    @param task: (file, start, stop, record end, kmer_len, canonical)
+    @return: Tuple of sorted uint64 keys and int64 counts
+    """
+    file, start, stop, span_end, kmer_len, canonical = task
+    with open(file, 'rb') as fh_in, mmap.mmap(fh_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        chunk = _strip_line_ends(data[start:stop])
+        overlap = b''
+        read_to = stop
+        while len(overlap) < kmer_len - 1 and read_to < span_end:
+            read_to = min(span_end, read_to + 2 * kmer_len + 2)
+            overlap = _strip_line_ends(data[stop:read_to])
+    return count_kmer_codes(encode_dna(chunk + overlap[:kmer_len - 1]), kmer_len=kmer_len, canonical=canonical)
+
+
+def _strip_line_ends(data: bytes) -> bytes:
+    """
+    Remove the line endings from a piece of FASTA sequence
+    @param data: bytes of sequence lines
+    @return: bytes of bases
+    """
+    return data.translate(None, b'\r\n')
+
+
+def benchmark_workers(length: int = 20_000_000, kmer_len: int = 21, worker_counts: tuple = (1, 2, 4, 8)) -> None:
+    """
+    Print how the counting time scales with the number of workers
+    @param length: Length of the random DNA sequence
+    @param kmer_len: Int of the kmer size
+    @param worker_counts: Numbers of workers to time
+    @return: None
+    """
+    dna = generate_random_dna(length, seed=0)
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        count_kmers_parallel(dna, kmer_len=kmer_len, workers=workers)
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        print(f"workers: {workers:<3d} seconds: {seconds:8.3f} speedup: {baseline / seconds:5.2f}")
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Test the parallel kmer counting, or time it')
+    parser.add_argument('--benchmark', dest='benchmark', action='store_true',
+                        help='Time the counting for every number of workers instead of running the tests')
+    parser.add_argument('--length', dest='length', type=int, default=20_000_000,
+                        help='Length of the random DNA sequence of the benchmark')
+    parser.add_argument('--kmer_len', dest='kmer_len', type=int, default=21, help='Kmer size of the benchmark')
+    parser.add_argument('--workers', dest='workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Numbers of workers to time')
+    return parser.parse_args()
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    dna = generate_random_dna(3 * MIN_CHUNK_LEN, seed=1, alphabet='ACGTN')
+    for kmer_len, canonical in ((3, False), (15, True)):
+        expected = count_kmers_packed(dna, kmer_len=kmer_len, canonical=canonical)
+        got = count_kmers_parallel(dna, kmer_len=kmer_len, canonical=canonical, workers=2)
+        assert np.array_equal(expected[0], got[0]) and np.array_equal(expected[1], got[1])
+
+    # two records, wrapped at 60 bases, split into byte ranges
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, 'test.fasta')
+        with open(file, 'wb') as fh_out:
+            for name, seq in ((b'seq1', dna[:2 * MIN_CHUNK_LEN]), (b'seq2', dna[2 * MIN_CHUNK_LEN:])):
+                fh_out.write(b'>' + name + b'\n')
+                fh_out.write(b'\n'.join(seq[i:i + 60] for i in range(0, len(seq), 60)) + b'\n')
+        expected = merge_count_tables([count_kmers_packed(dna[:2 * MIN_CHUNK_LEN], kmer_len=11),
+                                       count_kmers_packed(dna[2 * MIN_CHUNK_LEN:], kmer_len=11)])
+        got = count_fasta_parallel(file, kmer_len=11, workers=2)
+        assert np.array_equal(expected[0], got[0]) and np.array_equal(expected[1], got[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 """Utility module for counting kmers"""
-import random
+import io
 from operator import itemgetter
+from typing import Iterator
+
+import numpy as np
+
+RANDOM_CHUNK_LEN = 1 << 22  # bases drawn at once when streaming random DNA
 
 
 def generate_random_dna_str(num, alphabet='AGCT'):
@@ -10,7 +15,101 @@ def generate_random_dna_str(num, alphabet='AGCT'):
     @param alphabet: Alphabet to use
     @return: string
     """
-    return ''.join([random.choice(alphabet) for i in range(num)])
+    return generate_random_dna(num, alphabet=alphabet).decode('ascii')
+
+
+def generate_random_dna(num: int, seed: int = None, alphabet: str = 'ACGT', probabilities: list = None,
+                        gc_content: float = None) -> bytes:
+    """
+    Return a random DNA sequence as bytes, drawn with NumPy instead of one random.choice per base
+    @param num: Length of the DNA sequence
+    @param seed: Seed for the random numbers, the same seed gives the same sequence
+    @param alphabet: Alphabet to use
+    @param probabilities: Probability of each letter of the alphabet, default is uniform
+    @param gc_content: Fraction of G and C, instead of probabilities
+    @return: bytes
+    """
+    return b''.join(iter_random_dna_chunks(num, seed=seed, alphabet=alphabet, probabilities=probabilities,
+                                           gc_content=gc_content))
+
+
+def iter_random_dna_chunks(num: int, seed: int = None, alphabet: str = 'ACGT', probabilities: list = None,
+                           gc_content: float = None, chunk_len: int = RANDOM_CHUNK_LEN) -> Iterator[bytes]:
+    """
+    Generator of a random DNA sequence in chunks, so the whole sequence never has to be in memory
+    @param num: Length of the DNA sequence
+    @param seed: Seed for the random numbers, the same seed gives the same sequence
+    @param alphabet: Alphabet to use
+    @param probabilities: Probability of each letter of the alphabet, default is uniform
+    @param gc_content: Fraction of G and C, instead of probabilities
+    @param chunk_len: Number of bases per chunk
+    @return: Iterator of bytes
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)
+    base_probabilities = _get_base_probabilities(alphabet, probabilities=probabilities, gc_content=gc_content)
+    uniform = np.allclose(base_probabilities, base_probabilities[0])
+    cumulative = np.cumsum(base_probabilities)
+    for start in range(0, num, chunk_len):
+        size = min(chunk_len, num - start)
+        if uniform:
+            indexes = rng.integers(0, len(letters), size=size, dtype=np.uint8)
+        else:
+            # map uniform random numbers onto the letters through the cumulative probabilities
+            indexes = np.minimum(np.searchsorted(cumulative, rng.random(size), side='right'), len(letters) - 1)
+        yield letters[indexes].tobytes()  # byte lookup table, no Python string per base
+
+
+def write_random_fasta(fh_out: io.IOBase, num: int, header: str = 'random', line_len: int = 60, seed: int = None,
+                       alphabet: str = 'ACGT', probabilities: list = None, gc_content: float = None) -> None:
+    """
+    Stream a random DNA sequence straight into a FASTA file (or any binary buffer), wrapped at line_len
+    @param fh_out: filehandle or buffer opened for writing bytes
+    @param num: Length of the DNA sequence
+    @param header: Header of the record, without the >
+    @param line_len: Number of bases per line
+    @param seed: Seed for the random numbers
+    @param alphabet: Alphabet to use
+    @param probabilities: Probability of each letter of the alphabet, default is uniform
+    @param gc_content: Fraction of G and C, instead of probabilities
+    @return: None
+    """
+    fh_out.write(f">{header}\n".encode('ascii'))
+    # whole lines per chunk, so only the last line of the sequence can be short
+    chunk_len = max(1, RANDOM_CHUNK_LEN // line_len) * line_len
+    for chunk in iter_random_dna_chunks(num, seed=seed, alphabet=alphabet, probabilities=probabilities,
+                                        gc_content=gc_content, chunk_len=chunk_len):
+        full_lines = len(chunk) // line_len * line_len
+        lines = np.frombuffer(chunk[:full_lines], dtype=np.uint8).reshape(-1, line_len)
+        newlines = np.full((len(lines), 1), ord('\n'), dtype=np.uint8)
+        fh_out.write(np.hstack((lines, newlines)).tobytes())
+        if full_lines < len(chunk):
+            fh_out.write(chunk[full_lines:] + b'\n')
+
+
+def _get_base_probabilities(alphabet: str, probabilities: list = None, gc_content: float = None) -> np.ndarray:
+    """
+    Get the probability of each letter of the alphabet
+    @param alphabet: Alphabet to use
+    @param probabilities: Probability of each letter of the alphabet
+    @param gc_content: Fraction of G and C, split evenly between the G/C letters and the other letters
+    @return: array of probabilities that sums to 1
+    """
+    if probabilities is not None and gc_content is not None:
+        raise ValueError("Give either probabilities or gc_content, not both")
+    if gc_content is not None:
+        if not 0 <= gc_content <= 1:
+            raise ValueError(f"gc_content must be between 0 and 1, got {gc_content}")
+        is_gc = np.array([base in 'GCgc' for base in alphabet])
+        if is_gc.all() or not is_gc.any():
+            raise ValueError(f"gc_content needs both G/C and other letters in the alphabet, got {alphabet}")
+        probabilities = np.where(is_gc, gc_content / is_gc.sum(), (1 - gc_content) / (~is_gc).sum())
+    elif probabilities is None:
+        probabilities = np.full(len(alphabet), 1 / len(alphabet))
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if len(probabilities) != len(alphabet) or (probabilities < 0).any() or not np.isclose(probabilities.sum(), 1):
+        raise ValueError("probabilities must have one value per letter of the alphabet and sum to 1")
+    return probabilities
 
 
 def print_trinucleotides(counts, threshold=1):
@@ -20,7 +119,34 @@ def print_trinucleotides(counts, threshold=1):
     @param threshold: Use this threshold to ignore values smaller when printing
     @return: None
     """
+    # drop the values under the threshold first, so only what gets printed is sorted.
+    # For large kmers use heavy_hitters.find_heavy_hitters instead of building the full counts dictionary
     # use itemgetter to sorty by the key and then the value
-    for key, value in sorted(counts.items(), key=itemgetter(1, 0), reverse=True):
-        if value >= threshold:
-            print(key, value)
+    above_threshold = [item for item in counts.items() if item[1] >= threshold]
+    for key, value in sorted(above_threshold, key=itemgetter(1, 0), reverse=True):
+        print(key, value)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    assert generate_random_dna(1000, seed=7) == generate_random_dna(1000, seed=7)
+    assert set(generate_random_dna(1000, seed=7)) <= set(b'ACGT')
+    # chunking does not change the sequence
+    assert b''.join(iter_random_dna_chunks(1000, seed=7, chunk_len=64)) == generate_random_dna(1000, seed=7)
+
+    dna = generate_random_dna(100_000, seed=7, gc_content=0.7)
+    assert abs((dna.count(b'G') + dna.count(b'C')) / len(dna) - 0.7) < 0.01
+
+    buffer = io.BytesIO()
+    write_random_fasta(buffer, 130, header='test', line_len=60, seed=7)
+    lines = buffer.getvalue().decode('ascii').split('\n')
+    assert lines[0] == '>test' and [len(line) for line in lines[1:]] == [60, 60, 10, 0]
+    assert ''.join(lines[1:]).encode('ascii') == generate_random_dna(130, seed=7, alphabet='ACGT')
+    assert len(generate_random_dna_str(50)) == 50
+
+
+if __name__ == '__main__':
+    test_code()
@@ -1,13 +1,20 @@
-import pandas as pd
-df = pd.read_json('human_EGFR_variants.json')
+from variant_json import read_variant_json
+
+# pd.read_json builds the whole JSON object tree first, fine for small files:
+# df = pd.read_json('human_EGFR_variants.json')
+# read_variant_json reads the array a batch of records at a time into categorical columns, and collects the unique
+# values and the stop_lost rows in the same pass
+variants = read_variant_json('human_EGFR_variants.json', unique_columns=['source', 'consequence_type'],
+                             filters={'stop_lost': ('consequence_type', ['stop_lost'])})
+df = variants.data_frame
 print(f"Size of the df, {len(df)}")
 print(df.head())
 
 # print out all unique values
-print(df['source'].unique())
+print(variants.uniques['source'])
 
 # print out all unique values
-print(df['consequence_type'].unique())
+print(variants.uniques['consequence_type'])
 
 # print out examples from the df where consequence_type == stop_lost
-print(df[df['consequence_type'] == 'stop_lost'])
\ No newline at end of file
+print(variants.matches['stop_lost'])
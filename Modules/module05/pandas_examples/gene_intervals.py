@@ -0,0 +1,240 @@
+"""
+Genomic interval index for overlap queries between CNV segments and genes
+Intervals are kept per chromosome in sorted NumPy arrays, split into classes of similar length (powers of 2).
+For a query [start, end] and a class whose longest interval is max_len, only the intervals starting in
+[start - max_len, end] can overlap, which is two binary searches.  Within a class the lengths differ by at most 2x,
+so almost every interval in that window is a real hit: a query costs O(classes * log n + hits) instead of comparing
+against every gene.  Whole VCFs are queried at once with vectorized searchsorted calls.
+Coordinates are 1-based and inclusive at both ends, like VCF POS/END and Ensembl Start/End.
+"""
+import os
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+ENSEMBL_GENE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+                                 'assignment5_seq_attributes', 'ensembl_gene_data.tsv.gz')
+
+
+class GenomicIntervalIndex:
+    """Named intervals on chromosomes, indexed for overlap queries"""
+
+    def __init__(self, chroms=None, starts=None, ends=None, names=None):
+        """
+        @param chroms: chromosome of each interval, 'chr' prefixes are ignored
+        @param starts: 1-based start of each interval
+        @param ends: 1-based inclusive end of each interval
+        @param names: name of each interval, default is its position
+        """
+        self.chroms = np.array([normalize_chrom(chrom) for chrom in chroms], dtype=object)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.names = np.asarray(names if names is not None else np.arange(len(self.starts)))
+        if (self.ends < self.starts).any():
+            raise ValueError("Every interval needs end >= start")
+        lengths = self.ends - self.starts + 1
+        length_classes = np.floor(np.log2(lengths)).astype(np.int64)
+
+        # chrom -> list of (interval ids sorted by start, their starts, longest interval of the class)
+        self._bins = {}
+        for chrom in np.unique(self.chroms):
+            on_chrom = np.flatnonzero(self.chroms == chrom)
+            bins = []
+            for length_class in np.unique(length_classes[on_chrom]):
+                ids = on_chrom[length_classes[on_chrom] == length_class]
+                ids = ids[np.argsort(self.starts[ids], kind='stable')]
+                bins.append((ids, self.starts[ids], int(lengths[ids].max())))
+            self._bins[chrom] = bins
+
+    def __len__(self) -> int:
+        """Number of intervals"""
+        return len(self.starts)
+
+    @classmethod
+    def from_ensembl_tsv(cls, file: str = ENSEMBL_GENE_FILE) -> 'GenomicIntervalIndex':
+        """
+        Index the genes of an Ensembl gene table (Gene, Seq Region Name, Start, End columns), plain or gzip
+        @param file: Ensembl gene TSV
+        @return: GenomicIntervalIndex of the genes, named by Gene
+        """
+        genes = pd.read_csv(file, sep='\t', usecols=['Gene', 'Seq Region Name', 'Start', 'End'],
+                            dtype={'Gene': str, 'Seq Region Name': str, 'Start': np.int64, 'End': np.int64})
+        return cls(chroms=genes['Seq Region Name'], starts=genes['Start'], ends=genes['End'], names=genes['Gene'])
+
+    @classmethod
+    def from_vcf_df(cls, data_frame: pd.DataFrame = None) -> 'GenomicIntervalIndex':
+        """
+        Index the segments of a VCF DataFrame (#CHROM, POS and END columns), named by their row position
+        @param data_frame: DataFrame from vcf_to_pandas.get_facets_vcf_df
+        @return: GenomicIntervalIndex of the segments
+        """
+        return cls(chroms=data_frame['#CHROM'], starts=data_frame['POS'], ends=data_frame['END'])
+
+    def query(self, chrom: str = None, start: int = None, end: int = None) -> pd.DataFrame:
+        """
+        Every interval overlapping one region
+        @param chrom: Chromosome
+        @param start: 1-based start
+        @param end: 1-based inclusive end
+        @return: DataFrame as from query_bulk
+        """
+        return self.query_bulk([chrom], [start], [end]).drop(columns='query')
+
+    def query_bulk(self, chroms=None, starts=None, ends=None) -> pd.DataFrame:
+        """
+        Every overlapping (query region, interval) pair, for many query regions at once
+        @param chroms: chromosome of each query region
+        @param starts: 1-based start of each query region
+        @param ends: 1-based inclusive end of each query region
+        @return: DataFrame with the columns query (position of the query region), name, start, end, overlap_bp,
+                 interval_fraction (of the interval covered) and query_fraction (of the query region covered)
+        """
+        chroms = np.array([normalize_chrom(chrom) for chrom in chroms], dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        query_parts, id_parts = [], []
+        for chrom, bins in self._bins.items():
+            on_chrom = np.flatnonzero(chroms == chrom)
+            if not len(on_chrom):
+                continue
+            for ids, bin_starts, max_len in bins:
+                # candidates start in [query start - max_len + 1, query end]
+                low = np.searchsorted(bin_starts, starts[on_chrom] - max_len + 1, side='left')
+                high = np.searchsorted(bin_starts, ends[on_chrom], side='right')
+                queries, positions = _expand_ranges(on_chrom, low, high)
+                hit_ids = ids[positions]
+                overlapping = self.ends[hit_ids] >= starts[queries]
+                query_parts.append(queries[overlapping])
+                id_parts.append(hit_ids[overlapping])
+
+        queries = np.concatenate(query_parts) if query_parts else np.empty(0, dtype=np.int64)
+        hit_ids = np.concatenate(id_parts) if id_parts else np.empty(0, dtype=np.int64)
+        order = np.lexsort((self.starts[hit_ids], queries))
+        queries, hit_ids = queries[order], hit_ids[order]
+        overlap = np.minimum(ends[queries], self.ends[hit_ids]) - np.maximum(starts[queries], self.starts[hit_ids]) + 1
+        return pd.DataFrame({'query': queries,
+                             'name': self.names[hit_ids],
+                             'start': self.starts[hit_ids],
+                             'end': self.ends[hit_ids],
+                             'overlap_bp': overlap,
+                             'interval_fraction': overlap / (self.ends[hit_ids] - self.starts[hit_ids] + 1),
+                             'query_fraction': overlap / (ends[queries] - starts[queries] + 1)})
+
+
+def segment_gene_overlaps(data_frame: pd.DataFrame = None, gene_index: GenomicIntervalIndex = None) -> pd.DataFrame:
+    """
+    Genes overlapping every segment of a VCF, in one bulk query
+    @param data_frame: DataFrame with the #CHROM, POS and END columns
+    @param gene_index: GenomicIntervalIndex of the genes
+    @return: DataFrame with the columns row (position of the segment), gene, gene_start, gene_end, overlap_bp,
+             gene_fraction and segment_fraction
+    """
+    hits = gene_index.query_bulk(data_frame['#CHROM'], data_frame['POS'], data_frame['END'])
+    return hits.rename(columns={'query': 'row', 'name': 'gene', 'start': 'gene_start', 'end': 'gene_end',
+                                'interval_fraction': 'gene_fraction', 'query_fraction': 'segment_fraction'})
+
+
+def gene_segment_overlaps(data_frame: pd.DataFrame = None, gene_index: GenomicIntervalIndex = None,
+                          genes: list = None) -> pd.DataFrame:
+    """
+    Segments of a VCF overlapping each of some genes
+    @param data_frame: DataFrame with the #CHROM, POS and END columns
+    @param gene_index: GenomicIntervalIndex of the genes
+    @param genes: Genes to look up
+    @return: DataFrame with the columns gene, row (position of the segment), overlap_bp, gene_fraction and
+             segment_fraction
+    """
+    wanted = np.flatnonzero(np.isin(gene_index.names, genes))
+    segment_index = GenomicIntervalIndex.from_vcf_df(data_frame)
+    hits = segment_index.query_bulk(gene_index.chroms[wanted], gene_index.starts[wanted], gene_index.ends[wanted])
+    return pd.DataFrame({'gene': gene_index.names[wanted][hits['query'].to_numpy()],
+                         'row': hits['name'].to_numpy(),
+                         'overlap_bp': hits['overlap_bp'].to_numpy(),
+                         'gene_fraction': hits['query_fraction'].to_numpy(),
+                         'segment_fraction': hits['interval_fraction'].to_numpy()})
+
+
+def normalize_chrom(chrom) -> str:
+    """
+    @param chrom: Chromosome name like chr1, 1, chrM or MT
+    @return: Name without the chr prefix, M as MT
+    """
+    chrom = str(chrom)
+    if chrom.lower().startswith('chr'):
+        chrom = chrom[3:]
+    return 'MT' if chrom == 'M' else chrom
+
+
+def _expand_ranges(queries: np.ndarray, low: np.ndarray, high: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turn one [low, high) range per query into flat (query, position) pairs without a Python loop
+    @param queries: query of each range
+    @param low: first position of each range
+    @param high: end of each range
+    @return: Tuple of the query and the position of every pair
+    """
+    sizes = np.maximum(high - low, 0)
+    repeated = np.repeat(np.arange(len(sizes)), sizes)
+    # position within each range = running index - start of the range in the flat array
+    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return queries[repeated], low[repeated] + offsets
+
+
+def test_code() -> None:
+    """
+    Simple test of the code, against comparing every segment with every gene
+    @return: None
+    """
+    from vcf_to_pandas import get_gene_overlap_table  # vcf_to_pandas imports this module
+
+    rng = np.random.default_rng(18)
+    # small coordinates so many intervals touch or share an end, lengths from 1 bp to most of the range
+    num_genes, num_segments = 300, 200
+    gene_starts = rng.integers(1, 2_000, size=num_genes)
+    gene_ends = gene_starts + np.minimum(rng.geometric(0.01, size=num_genes) - 1, 1_500)
+    gene_chroms = rng.choice(['1', 'chr1', '2', 'X'], size=num_genes)
+    genes = pd.DataFrame({'chrom': gene_chroms, 'start': gene_starts, 'end': gene_ends,
+                          'name': [f'GENE{num}' for num in range(num_genes)]})
+    seg_starts = rng.integers(1, 2_000, size=num_segments)
+    data_frame = pd.DataFrame({'#CHROM': rng.choice(['chr1', '2', 'chrX', 'Y'], size=num_segments),
+                               'POS': seg_starts, 'END': seg_starts + rng.integers(0, 800, size=num_segments),
+                               'SVTYPE': rng.choice(['DEL', 'DUP'], size=num_segments)})
+    # segments ending exactly where a gene starts, and starting exactly where it ends
+    data_frame.loc[0, ['#CHROM', 'POS', 'END']] = ['chr' + normalize_chrom(gene_chroms[0]), 1, gene_starts[0]]
+    data_frame.loc[1, ['#CHROM', 'POS', 'END']] = [normalize_chrom(gene_chroms[0]), gene_ends[0], gene_ends[0] + 5]
+    gene_index = GenomicIntervalIndex(genes['chrom'], genes['start'], genes['end'], names=genes['name'])
+
+    expected = []
+    for row, segment in enumerate(data_frame.itertuples(index=False)):
+        for gene in genes.itertuples(index=False):
+            overlap = min(segment.END, gene.end) - max(segment.POS, gene.start) + 1
+            if normalize_chrom(segment[0]) == normalize_chrom(gene.chrom) and overlap > 0:
+                expected.append((row, gene.name, overlap, overlap / (gene.end - gene.start + 1),
+                                 overlap / (segment.END - segment.POS + 1)))
+    assert (0, 'GENE0', 1, 1 / (gene_ends[0] - gene_starts[0] + 1), 1 / gene_starts[0]) in expected
+    assert any(hit[:3] == (1, 'GENE0', 1) for hit in expected)
+
+    hits = segment_gene_overlaps(data_frame, gene_index)
+    found = sorted(zip(hits['row'], hits['gene'], hits['overlap_bp'], hits['gene_fraction'],
+                       hits['segment_fraction']))
+    assert found == sorted(expected)
+    assert hits['row'].is_monotonic_increasing
+
+    by_gene = gene_segment_overlaps(data_frame, gene_index, genes=['GENE0', 'GENE7', 'GENE42'])
+    assert sorted(zip(by_gene['row'], by_gene['gene'], by_gene['overlap_bp'], by_gene['gene_fraction'],
+                      by_gene['segment_fraction'])) == \
+        sorted(hit for hit in expected if hit[1] in ('GENE0', 'GENE7', 'GENE42'))
+
+    for min_gene_fraction in (0.0, 0.5, 1.0):
+        table = get_gene_overlap_table(data_frame, gene_index, min_gene_fraction=min_gene_fraction)
+        assert sorted(zip(table['row'], table['gene'])) == \
+            sorted((row, gene) for row, gene, _, fraction, _ in expected if fraction >= min_gene_fraction)
+        assert (table['SVTYPE'].to_numpy() == data_frame['SVTYPE'].to_numpy()[table['row'].to_numpy()]).all()
+
+    assert gene_index.query('chrY', 1, 10_000).empty
+    assert len(gene_index.query('X', 1, 10_000)) == (gene_chroms == 'X').sum()
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,294 @@
+"""
+Streaming columnar reader for Ensembl variant JSON arrays, e.g. the overlap/id/<gene>?feature=variation dumps
+pd.read_json first builds the whole tree of Python objects and then the DataFrame, several times the file size in
+memory.  Here the array is decoded incrementally with json.JSONDecoder.raw_decode, a batch of records at a time, and
+each batch goes straight into the output columns: numbers as NumPy arrays, everything else dictionary encoded into
+one categorical per column.  The unique values of a column are its categories, and the filters are applied to each
+batch as it is read, so the DataFrame, the uniques and the filtered rows come out of one pass over the file, with
+only one batch of decoded records in memory.
+"""
+import io
+import json
+import os
+import re
+import tempfile
+from collections import namedtuple
+from typing import Iterator, TextIO
+
+import numpy as np
+import pandas as pd
+
+BLOCK_LEN = 1 << 20  # characters read at once
+BATCH_SIZE = 10_000  # records decoded before they go into the columns
+WHITESPACE = ' \t\r\n'
+WHITESPACE_RE = re.compile(r'[ \t\r\n]*')
+
+VariantJson = namedtuple('VariantJson', ['data_frame', 'uniques', 'matches'])
+
+
+def read_variant_json(file: str = None, columns: list = None, unique_columns: list = (), filters: dict = None,
+                      batch_size: int = BATCH_SIZE, block_len: int = BLOCK_LEN) -> VariantJson:
+    """
+    Read an Ensembl variant JSON array in one pass
+    sample use: read_variant_json('human_EGFR_variants.json', unique_columns=['source', 'consequence_type'],
+                                  filters={'stop_lost': ('consequence_type', ['stop_lost'])})
+    @param file: JSON file with an array of flat records
+    @param columns: Keys to keep, default is every key seen
+    @param unique_columns: Columns to return the unique values of, in the order they are first seen
+    @param filters: Dict of name -> (column, values), the rows where the column has one of the values
+    @param batch_size: Records decoded before they go into the columns, bounds the memory of the decoded objects
+    @param block_len: Characters read at once
+    @return: VariantJson of the DataFrame, dict of column -> unique values, dict of filter name -> DataFrame
+    """
+    filters = filters or {}
+    builders = {column: _ColumnBuilder() for column in columns} if columns is not None else {}
+    filter_rows = {name: [] for name in filters}
+    num_rows = 0
+    with open(file, 'r') as in_fh:
+        for batch in _iter_batches(iter_json_array(in_fh, block_len=block_len), batch_size):
+            frame = pd.DataFrame.from_records(batch, columns=columns)
+            for column in frame.columns:
+                if column not in builders:
+                    builders[column] = _ColumnBuilder(num_missing=num_rows)
+                values = builders[column].add(frame[column])
+                for name, (filter_column, wanted) in filters.items():
+                    if filter_column == column:
+                        filter_rows[name].append(num_rows + np.flatnonzero(pd.Series(values).isin(wanted)))
+            num_rows += len(batch)
+            # columns the batch did not have are missing
+            for builder in builders.values():
+                builder.pad(num_rows)
+
+    data_frame = pd.DataFrame({column: builder.to_series() for column, builder in builders.items()},
+                              index=pd.RangeIndex(num_rows))
+    uniques = {column: builders[column].uniques() if column in builders else [] for column in unique_columns}
+    matches = {name: data_frame.iloc[np.concatenate(rows) if rows else []] for name, rows in filter_rows.items()}
+    return VariantJson(data_frame, uniques, matches)
+
+
+def iter_json_array(in_fh: TextIO = None, block_len: int = BLOCK_LEN) -> Iterator:
+    """
+    Generator of the elements of a top level JSON array, decoding one element at a time from blocks of the file
+    @param in_fh: filehandle open for reading text
+    @param block_len: Characters read at once
+    @return: Iterator of the decoded elements
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while not buffer:
+        block = in_fh.read(block_len)
+        buffer = block.lstrip(WHITESPACE)
+        if not block:
+            break
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array")
+    position, at_eof, after_element = 1, False, False
+    while True:
+        position = WHITESPACE_RE.match(buffer, position).end()
+        while position == len(buffer) and not at_eof:
+            buffer = in_fh.read(block_len)
+            at_eof = not buffer
+            position = WHITESPACE_RE.match(buffer, 0).end()
+        if position >= len(buffer):
+            raise ValueError("The JSON array is not closed")
+        if buffer[position] == ']':
+            return
+        if after_element:
+            if buffer[position] != ',':
+                raise ValueError(f"Expected ',' between the elements of the JSON array, found {buffer[position]!r}")
+            position += 1
+            after_element = False
+            continue
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+            # a number at the end of the buffer may go on in the next block
+            complete = end < len(buffer) or at_eof
+        except json.JSONDecodeError:
+            if at_eof:
+                raise
+            complete = False
+        if complete:
+            yield element
+            position, after_element = end, True
+        else:
+            # at least double the unparsed text, so a long element is not parsed again block by block
+            more = in_fh.read(max(block_len, len(buffer) - position))
+            at_eof = not more
+            buffer, position = buffer[position:] + more, 0
+
+
+class _ColumnBuilder:
+    """One output column, filled a batch at a time: numeric chunks, or codes into categories shared by all batches"""
+
+    def __init__(self, num_missing: int = 0):
+        """
+        @param num_missing: Rows before the column was first seen, missing
+        """
+        self.chunks = []  # numeric values (float64/int64/bool arrays) or int64 category codes, -1 for missing
+        self.is_codes = []  # True when the chunk at the same position holds category codes
+        self.categories = {}  # category -> code, in the order first seen
+        self.num_rows = 0
+        self.pad(num_missing)
+
+    def add(self, series: pd.Series) -> np.ndarray:
+        """
+        Add the values of one batch
+        @param series: column of the batch from DataFrame.from_records
+        @return: values the filters compare against, lists (e.g. alleles) joined by commas
+        """
+        self.num_rows += len(series)
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            values = series.to_numpy()
+            self.chunks.append(values)
+            self.is_codes.append(False)
+            return values
+        values = series.to_numpy(dtype=object)
+        if series.dtype == object:  # only object columns can hold lists
+            values = series.map(_scalar, na_action='ignore').to_numpy(dtype=object)
+        self._add_codes(values)
+        return values
+
+    def pad(self, num_rows: int) -> None:
+        """
+        Add missing values up to num_rows
+        @param num_rows: Rows the column should have
+        @return: None
+        """
+        if num_rows > self.num_rows:
+            self.chunks.append(np.full(num_rows - self.num_rows, -1, dtype=np.int64))
+            self.is_codes.append(True)
+            self.num_rows = num_rows
+
+    def uniques(self) -> list:
+        """
+        @return: distinct values in the order first seen, like pd.Series.unique without the missing value
+        """
+        if self.categories:
+            return list(self.categories)
+        return list(self.to_series().dropna().unique())
+
+    def to_series(self) -> pd.Series:
+        """
+        @return: Series of the column, categorical unless every value is a number
+        """
+        numeric = [chunk for chunk, is_codes in zip(self.chunks, self.is_codes) if not is_codes]
+        if self.categories or not numeric:
+            # a column with text anywhere is all categorical, numbers included
+            codes = [chunk if is_codes else self._encode(np.asarray(chunk, dtype=object))
+                     for chunk, is_codes in zip(self.chunks, self.is_codes)]
+            return pd.Series(pd.Categorical.from_codes(np.concatenate(codes) if codes else np.zeros(0, np.int64),
+                                                       categories=list(self.categories)))
+        # missing numbers are NaN, like pd.read_json
+        chunks = [chunk if not is_codes else np.full(len(chunk), np.nan)
+                  for chunk, is_codes in zip(self.chunks, self.is_codes)]
+        return pd.Series(np.concatenate(chunks))
+
+    def _add_codes(self, values: np.ndarray) -> None:
+        """
+        @param values: object array of one batch, None or NaN for missing
+        @return: None
+        """
+        self.chunks.append(self._encode(values))
+        self.is_codes.append(True)
+
+    def _encode(self, values: np.ndarray) -> np.ndarray:
+        """
+        @param values: object array
+        @return: int64 codes into self.categories, -1 for missing.  Numbers are added as their text
+        """
+        codes, batch_uniques = pd.factorize(values)
+        global_codes = np.array([self.categories.setdefault(value if isinstance(value, str) else _number_text(value),
+                                                            len(self.categories)) for value in batch_uniques],
+                                dtype=np.int64)
+        return np.where(codes < 0, -1, global_codes[codes]) if len(global_codes) else codes.astype(np.int64)
+
+
+def _iter_batches(items: Iterator, batch_size: int) -> Iterator[list]:
+    """
+    @param items: Iterator
+    @param batch_size: Items per batch
+    @return: Iterator of lists of batch_size items, the last one shorter
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _scalar(value):
+    """
+    @param value: JSON value
+    @return: the value, lists joined by commas and objects as JSON text so they can be compared and encoded
+    """
+    if isinstance(value, list):
+        return ','.join(map(str, value))
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def _number_text(value) -> str:
+    """
+    @param value: number (or bool) in a column that also has text
+    @return: the number as JSON text, 3 and not 3.0 for integral floats from a column with missing values
+    """
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return json.dumps(value.item() if isinstance(value, np.generic) else value)
+
+
+def test_code() -> None:
+    """
+    Simple test of the code, against json.load and pd.DataFrame with every block boundary
+    @return: None
+    """
+    records = [{'id': 'rs1', 'start': 12345, 'alleles': ['A', 'G'], 'consequence_type': 'stop_lost'},
+               {'id': 'rs2 "quoted" ]', 'start': -7.25e-3, 'clinical_significance': [],
+                'consequence_type': 'missense_variant'},
+               {'id': 'rs3', 'start': 1000000, 'consequence_type': 'stop_lost', 'minor_allele': None},
+               {'id': 'rs4', 'start': 4, 'consequence_type': 'intron_variant', 'strand': 1, 'source': 'dbSNP'},
+               {'id': 'rs5', 'start': 55, 'consequence_type': 'intron_variant', 'strand': -1, 'source': 'COSMIC'}]
+    # whitespace and commas in every position a block can end on, numbers that a block boundary can split
+    text = ' \n[ ' + ' ,\n  '.join(json.dumps(record) for record in records) + ' \n ]\n'
+    for block_len in (1, 2, 3, 5, 7, 11, len(text)):
+        assert list(iter_json_array(io.StringIO(text), block_len=block_len)) == records
+    assert list(iter_json_array(io.StringIO('[12,3]'), block_len=2)) == [12, 3]
+    assert list(iter_json_array(io.StringIO('  [ ]  '), block_len=1)) == []
+    for bad in ('[1 2]', '[1,', '{"a": 1}', '[1,,2]', ''):
+        try:
+            list(iter_json_array(io.StringIO(bad), block_len=2))
+            assert False, f"{bad!r} was accepted"
+        except ValueError:  # json.JSONDecodeError is a ValueError
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, 'variants.json')
+        with open(file, 'w') as out_fh:
+            out_fh.write(text)
+        expected = pd.DataFrame(json.loads(text))
+        # strand and source first show up in the second batch, padded as missing for the first
+        for batch_size, block_len in ((2, 3), (1, 1), (100, BLOCK_LEN)):
+            variants = read_variant_json(file, unique_columns=['source', 'consequence_type'],
+                                         filters={'stop_lost': ('consequence_type', ['stop_lost']),
+                                                  'lists': ('alleles', ['A,G'])},
+                                         batch_size=batch_size, block_len=block_len)
+            data_frame = variants.data_frame
+            assert list(data_frame.columns) == list(expected.columns) and len(data_frame) == len(records)
+            for column in ('id', 'consequence_type', 'source'):
+                assert [None if pd.isna(value) else value for value in data_frame[column]] == \
+                    [None if pd.isna(value) else value for value in expected[column]]
+            assert np.allclose(data_frame['start'].astype(float), expected['start'])
+            assert data_frame['strand'].isna().tolist() == [True, True, True, False, False]
+            assert data_frame['alleles'].tolist()[0] == 'A,G'
+            assert variants.uniques == {'source': ['dbSNP', 'COSMIC'],
+                                        'consequence_type': ['stop_lost', 'missense_variant', 'intron_variant']}
+            assert variants.matches['stop_lost']['id'].tolist() == ['rs1', 'rs3']
+            assert variants.matches['lists']['id'].tolist() == ['rs1']
+
+
+if __name__ == '__main__':
+    test_code()
@@ -0,0 +1,191 @@
+"""
+Columnar binary cache and fast output formats for parsed VCF DataFrames
+A cache entry is keyed by the sha256 of the source file and the parser version, so a changed file or a changed
+parser never reuses an old entry.  Entries are Feather files when pyarrow is installed, otherwise a directory with
+one .npy file per column (no pickling, loaded memory-mapped):
+    <cache_dir>/<sha256>_v<parser version>/meta.json      column names, kinds and pandas dtypes
+    <cache_dir>/<sha256>_v<parser version>/col<i>.npy     values of column i
+    <cache_dir>/<sha256>_v<parser version>/col<i>.mask.npy  missing values of column i, for strings and nullable ints
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  pylint: disable=unused-import
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+OUTPUT_FORMATS = ('tsv', 'parquet', 'feather', 'npz')
+OUTPUT_EXTENSIONS = {'tsv': '.tsv', 'parquet': '.parquet', 'feather': '.feather', 'npz': '.npz'}
+META_FILE = 'meta.json'
+DIGEST_BLOCK_LEN = 1 << 20
+
+
+def load_or_parse(source_file: str = None, parse: Callable = None, parser_version: int = 1,
+                  cache_dir: str = None) -> pd.DataFrame:
+    """
+    Get the parsed DataFrame of a file from the cache, or parse it and add it to the cache
+    @param source_file: File to parse
+    @param parse: Function of source_file returning the DataFrame
+    @param parser_version: Version of the parser, bump it when the parse changes its output
+    @param cache_dir: Directory of the cache, created if needed
+    @return: DataFrame
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, f'{file_digest(source_file)}_v{parser_version}')
+    if HAVE_PYARROW and os.path.exists(f'{entry}.feather'):
+        return pd.read_feather(f'{entry}.feather')
+    if os.path.exists(os.path.join(entry, META_FILE)):
+        return load_columns(entry)
+
+    data_frame = parse(source_file)
+    # write to a temporary name and rename, so a reader never sees half an entry
+    if HAVE_PYARROW:
+        tmp_file = f'{entry}.{os.getpid()}.tmp'
+        data_frame.to_feather(tmp_file)
+        os.replace(tmp_file, f'{entry}.feather')
+    else:
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir, suffix='.tmp')
+        save_columns(data_frame, tmp_dir)
+        try:
+            os.rename(tmp_dir, entry)
+        except OSError:  # another process added the same entry first
+            shutil.rmtree(tmp_dir)
+    return data_frame
+
+
+def file_digest(file: str = None) -> str:
+    """
+    @param file: Path of the file
+    @return: sha256 hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as in_fh:
+        for block in iter(lambda: in_fh.read(DIGEST_BLOCK_LEN), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_columns(data_frame: pd.DataFrame = None, out_dir: str = None) -> None:
+    """
+    Save every column as a NumPy array, strings as fixed width unicode so nothing is pickled
+    @param data_frame: DataFrame to save
+    @param out_dir: Directory to write the .npy files and meta.json to
+    @return: None
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    meta = []
+    for i, (name, arrays) in enumerate(_to_numpy_columns(data_frame).items()):
+        for suffix, array in arrays.items():
+            np.save(os.path.join(out_dir, f'col{i}{suffix}.npy'), array)
+        meta.append({'name': name, 'kind': _column_kind(data_frame[name]), 'dtype': str(data_frame[name].dtype),
+                     'mask': '.mask' in arrays})
+    with open(os.path.join(out_dir, META_FILE), 'w') as out_fh:
+        json.dump(meta, out_fh, indent=2)
+
+
+def load_columns(in_dir: str = None) -> pd.DataFrame:
+    """
+    Load a DataFrame saved by save_columns
+    @param in_dir: Directory with the .npy files and meta.json
+    @return: DataFrame
+    """
+    with open(os.path.join(in_dir, META_FILE), 'r') as in_fh:
+        meta = json.load(in_fh)
+    columns = {}
+    for i, column in enumerate(meta):
+        values = np.load(os.path.join(in_dir, f'col{i}.npy'), mmap_mode='r')
+        mask = np.load(os.path.join(in_dir, f'col{i}.mask.npy')) if column['mask'] else None
+        columns[column['name']] = _from_numpy_column(values, mask, kind=column['kind'], dtype=column['dtype'])
+    return pd.DataFrame(columns)
+
+
+def write_output(data_frame: pd.DataFrame = None, out_file: str = None, output_format: str = 'tsv') -> str:
+    """
+    Write the DataFrame in one of OUTPUT_FORMATS.  Parquet and Feather need pyarrow, without it the NumPy .npz
+    format is written instead, with a warning
+    @param data_frame: DataFrame to write
+    @param out_file: File to write, the extension is changed to match the format actually written
+    @param output_format: One of OUTPUT_FORMATS
+    @return: path of the file written
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format}, use one of {', '.join(OUTPUT_FORMATS)}")
+    if output_format in ('parquet', 'feather') and not HAVE_PYARROW:
+        print(f"{output_format} output needs pyarrow, writing npz instead", file=sys.stderr)
+        output_format = 'npz'
+    out_file = os.path.splitext(out_file)[0] + OUTPUT_EXTENSIONS[output_format]
+
+    if output_format == 'tsv':
+        data_frame.to_csv(out_file, sep='\t', index=False)
+    elif output_format == 'parquet':
+        data_frame.to_parquet(out_file, index=False)
+    elif output_format == 'feather':
+        data_frame.reset_index(drop=True).to_feather(out_file)
+    else:
+        # one array per column, plus <column>.mask for the missing values, readable with np.load alone
+        arrays = {}
+        for name, column_arrays in _to_numpy_columns(data_frame).items():
+            arrays.update({f'{name}{suffix}': array for suffix, array in column_arrays.items()})
+        np.savez(out_file, **arrays)
+    return out_file
+
+
+def _column_kind(series: pd.Series) -> str:
+    """
+    @param series: column
+    @return: 'string', 'masked' (nullable Int64/boolean) or 'numpy'
+    """
+    if pd.api.types.is_string_dtype(series) or series.dtype == object:
+        return 'string'
+    if pd.api.types.is_extension_array_dtype(series):
+        return 'masked'
+    return 'numpy'
+
+
+def _to_numpy_columns(data_frame: pd.DataFrame = None) -> dict:
+    """
+    @param data_frame: DataFrame
+    @return: Dict of column name -> {'': values, '.mask': missing values (only when needed)}
+    """
+    columns = {}
+    for name in data_frame.columns:
+        series = data_frame[name]
+        kind = _column_kind(series)
+        if kind == 'string':
+            mask = series.isna().to_numpy()
+            columns[name] = {'': series.fillna('').astype(str).to_numpy(dtype=str), '.mask': mask}
+        elif kind == 'masked':
+            mask = series.isna().to_numpy()
+            values = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+            columns[name] = {'': values, '.mask': mask}
+        else:
+            columns[name] = {'': series.to_numpy()}
+    return columns
+
+
+def _from_numpy_column(values: np.ndarray, mask: np.ndarray = None, kind: str = 'numpy',
+                       dtype: str = None) -> pd.Series:
+    """
+    @param values: values of the column
+    @param mask: missing values of the column
+    @param kind: kind from _column_kind
+    @param dtype: pandas dtype of the column
+    @return: Series
+    """
+    if kind == 'string':
+        series = pd.Series(values.astype(object))
+        series[mask] = None
+        return series.astype(dtype)
+    if kind == 'masked':
+        return pd.Series(pd.array(np.array(values), dtype=dtype)).mask(mask)
+    return pd.Series(values)
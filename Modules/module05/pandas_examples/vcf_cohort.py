@@ -0,0 +1,329 @@
+"""
+Batch version of vcf_to_pandas for a whole cohort of FACETS VCFs
+The VCFs are parsed and flagged for the LOH and deletion gene events in a pool of worker processes, so pandas is
+imported once per worker instead of once per file.  Each finished sample is written to its own files, and the
+cohort tables are then put together one sample at a time:
+    <out_dir>/samples/<sample>.events.tsv   the segments behind every gene event of the sample
+    <out_dir>/samples/<sample>.json         source file (path, size, mtime), settings and flags, written last
+    <out_dir>/cohort_matrix.tsv             sample x gene event matrix of 0/1, columns like BRCA1_loss_positive
+    <out_dir>/cohort_events.tsv             long table of every sample's events
+    <out_dir>/failed.tsv                    samples that raised an error, with the error
+A sample whose .json exists for an unchanged VCF and the same settings is not processed again, so a failed or
+interrupted run is resumed by running the same command again.
+    python vcf_cohort.py --vcf_dir vcfs/ --out_dir cohort/
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from gene_intervals import GenomicIntervalIndex
+from vcf_cache import load_or_parse
+from vcf_to_pandas import (DEFAULT_CACHE_DIR, VCF_PARSER_VERSION, get_facets_vcf_df, get_gene_events,
+                           get_gene_overlap_table, get_gene_segment_table, update_gene_cols)
+
+VCF_EXTENSIONS = ('.vcf', '.vcf.gz')
+SAMPLE_DIR = 'samples'
+EVENT_COLUMNS = ['sample', 'event', 'gene', '#CHROM', 'POS', 'END', 'SVTYPE']
+
+_WORKER_GENE_INDEX = None  # gene coordinates loaded once per worker process by _init_worker
+
+
+def main() -> None:
+    """Business Logic"""
+    args = get_cli_args()
+    vcf_files = get_vcf_files(vcf_dir=args.vcf_dir, manifest=args.manifest)
+    summary = run_cohort(vcf_files, args.out_dir, workers=args.workers,
+                         cache_dir=None if args.no_cache else args.cache_dir,
+                         gene_coordinates=args.gene_coordinates, min_gene_fraction=args.min_gene_fraction)
+    print(f"{summary['done']} samples done ({summary['skipped']} from an earlier run), "
+          f"{summary['failed']} failed, cohort tables in {args.out_dir}")
+
+
+def get_vcf_files(vcf_dir: str = None, manifest: str = None) -> list:
+    """
+    Get the VCF files of the cohort, either every VCF file in a directory or the paths listed in a manifest
+    @param vcf_dir: Directory to look for .vcf and .vcf.gz files in
+    @param manifest: Text file with one VCF path per line, relative paths are relative to the manifest
+    @return: list of paths
+    """
+    if manifest:
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r') as in_fh:
+            return [os.path.join(base_dir, line.strip()) for line in in_fh
+                    if line.strip() and not line.startswith('#')]
+    return sorted(file for file in glob.glob(os.path.join(vcf_dir, '*'))
+                  if file.lower().endswith(VCF_EXTENSIONS))
+
+
+def run_cohort(vcf_files: list = None, out_dir: str = None, workers: int = None, cache_dir: str = None,
+               gene_coordinates: str = None, min_gene_fraction: float = 0.0) -> dict:
+    """
+    Flag the gene events of every VCF in a process pool and write the cohort tables
+    @param vcf_files: list of VCF paths
+    @param out_dir: Directory of the results, created if needed
+    @param workers: Number of worker processes, default is every core
+    @param cache_dir: Directory of the parsed VCF cache (see vcf_cache), None to always parse
+    @param gene_coordinates: Ensembl gene table to find the genes from POS and END instead of CNV_ANN
+    @param min_gene_fraction: With gene_coordinates, the fraction of a gene a segment has to cover
+    @return: Dict with the number of samples done, skipped (done by an earlier run) and failed
+    """
+    os.makedirs(os.path.join(out_dir, SAMPLE_DIR), exist_ok=True)
+    settings = {'parser_version': VCF_PARSER_VERSION, 'gene_events': get_gene_events(),
+                'gene_coordinates': os.path.abspath(gene_coordinates) if gene_coordinates else None,
+                'min_gene_fraction': min_gene_fraction if gene_coordinates else None}
+    # through JSON once, so tuples compare equal to the lists read back from a sample's .json
+    settings = json.loads(json.dumps(settings))
+    samples = _sample_names(vcf_files)
+    tasks = []
+    for sample, vcf_file in samples.items():
+        if not _is_done(out_dir, sample, vcf_file, settings):
+            tasks.append((sample, os.path.abspath(vcf_file), out_dir, cache_dir, settings))
+
+    failed = {}
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(gene_coordinates, min_gene_fraction)) as executor:
+            futures = {executor.submit(_process_sample, task): task[0] for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err:  # pylint: disable=broad-except
+                    # one bad VCF must not stop the cohort, it is retried by the next run
+                    failed[futures[future]] = f'{type(err).__name__}: {err}'
+
+    pd.DataFrame({'sample': list(failed), 'vcf_file': [samples[sample] for sample in failed],
+                  'error': list(failed.values())}).to_csv(os.path.join(out_dir, 'failed.tsv'), sep='\t', index=False)
+    write_cohort_tables(out_dir, [sample for sample in samples if sample not in failed])
+    return {'done': len(samples) - len(failed), 'skipped': len(samples) - len(tasks), 'failed': len(failed)}
+
+
+def write_cohort_tables(out_dir: str = None, samples: list = None) -> None:
+    """
+    Put the per sample results together into cohort_matrix.tsv and cohort_events.tsv, reading one sample at a time
+    @param out_dir: Directory of the results
+    @param samples: Samples to include, in order
+    @return: None
+    """
+    columns = [f'{gene}_{column_name}' for column_name, (_, genes) in get_gene_events().items() for gene in genes]
+    with open(os.path.join(out_dir, 'cohort_matrix.tsv'), 'w') as matrix_fh, \
+            open(os.path.join(out_dir, 'cohort_events.tsv'), 'w') as events_fh:
+        matrix_fh.write('\t'.join(['sample'] + columns) + '\n')
+        events_fh.write('\t'.join(EVENT_COLUMNS) + '\n')
+        for sample in samples:
+            with open(os.path.join(out_dir, SAMPLE_DIR, f'{sample}.json'), 'r') as in_fh:
+                flags = json.load(in_fh)['flags']
+            matrix_fh.write('\t'.join([sample] + [str(int(flags.get(column, False))) for column in columns]) + '\n')
+            with open(os.path.join(out_dir, SAMPLE_DIR, f'{sample}.events.tsv'), 'r') as in_fh:
+                next(in_fh)  # header
+                events_fh.writelines(in_fh)
+
+
+def get_sample_events(sample: str = None, data_frame: pd.DataFrame = None,
+                      gene_table: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    The segments behind every gene event of one sample, the long format of vcf_to_pandas.update_gene_cols
+    @param sample: Name of the sample
+    @param data_frame: DataFrame of the VCF
+    @param gene_table: get_gene_segment_table or get_gene_overlap_table of data_frame
+    @return: DataFrame with the EVENT_COLUMNS
+    """
+    events = []
+    for column_name, (svtype_list, genes) in get_gene_events().items():
+        hits = gene_table[gene_table['gene'].isin(genes) & gene_table['SVTYPE'].isin(svtype_list)]
+        rows = hits['row'].to_numpy()
+        events.append(pd.DataFrame({'sample': sample, 'event': column_name, 'gene': hits['gene'].to_numpy(),
+                                    '#CHROM': data_frame['#CHROM'].to_numpy()[rows],
+                                    'POS': data_frame['POS'].to_numpy()[rows],
+                                    'END': data_frame['END'].to_numpy()[rows],
+                                    'SVTYPE': hits['SVTYPE'].to_numpy()}))
+    return pd.concat(events, ignore_index=True)
+
+
+def _init_worker(gene_coordinates: str = None, min_gene_fraction: float = 0.0) -> None:
+    """
+    Load the gene coordinates once per worker process
+    @param gene_coordinates: Ensembl gene table, or None to use CNV_ANN
+    @param min_gene_fraction: fraction of a gene a segment has to cover
+    @return: None
+    """
+    global _WORKER_GENE_INDEX  # pylint: disable=global-statement
+    if gene_coordinates:
+        _WORKER_GENE_INDEX = (GenomicIntervalIndex.from_ensembl_tsv(gene_coordinates), min_gene_fraction)
+
+
+def _process_sample(task: tuple) -> None:
+    """
+    Parse one VCF, flag its gene events and write the sample's files.  The .json goes last, so a sample only counts
+    as done once both files are complete
+    @param task: Tuple of the sample name, VCF path, output directory, cache directory and settings
+    @return: None
+    """
+    sample, vcf_file, out_dir, cache_dir, settings = task
+    if cache_dir:
+        data_frame = load_or_parse(source_file=vcf_file, parse=get_facets_vcf_df, parser_version=VCF_PARSER_VERSION,
+                                   cache_dir=cache_dir)
+    else:
+        data_frame = get_facets_vcf_df(facets_vcf_file=vcf_file)
+    if _WORKER_GENE_INDEX:
+        gene_index, min_gene_fraction = _WORKER_GENE_INDEX
+        gene_table = get_gene_overlap_table(data_frame=data_frame, gene_index=gene_index,
+                                            min_gene_fraction=min_gene_fraction)
+    else:
+        gene_table = get_gene_segment_table(data_frame=data_frame)
+
+    events = get_sample_events(sample=sample, data_frame=data_frame, gene_table=gene_table)
+    flags = {f'{gene}_{event}': True for event, gene in zip(events['event'], events['gene'])}
+    sample_prefix = os.path.join(out_dir, SAMPLE_DIR, sample)
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(sample_prefix), suffix='.tmp', delete=False) as out_fh:
+        events.to_csv(out_fh, sep='\t', index=False)
+    os.replace(out_fh.name, f'{sample_prefix}.events.tsv')
+    stat = os.stat(vcf_file)
+    _write_json({'vcf_file': vcf_file, 'size': stat.st_size, 'mtime': stat.st_mtime, 'settings': settings,
+                 'num_segments': len(data_frame), 'flags': flags}, f'{sample_prefix}.json')
+
+
+def _is_done(out_dir: str = None, sample: str = None, vcf_file: str = None, settings: dict = None) -> bool:
+    """
+    @param out_dir: Directory of the results
+    @param sample: Name of the sample
+    @param vcf_file: VCF of the sample
+    @param settings: Settings of this run
+    @return: True when an earlier run with the same settings finished this sample and the VCF has not changed
+    """
+    try:
+        with open(os.path.join(out_dir, SAMPLE_DIR, f'{sample}.json'), 'r') as in_fh:
+            done = json.load(in_fh)
+    except (OSError, ValueError):
+        return False
+    stat = os.stat(vcf_file)
+    return (done['vcf_file'] == os.path.abspath(vcf_file) and done['size'] == stat.st_size
+            and done['mtime'] == stat.st_mtime and done.get('settings') == settings)
+
+
+def _sample_names(vcf_files: list = None) -> dict:
+    """
+    Name every sample after its file, adding _2, _3, ... when two files have the same name
+    @param vcf_files: list of VCF paths
+    @return: Dict of sample name -> VCF path, in the order of vcf_files
+    """
+    samples = {}
+    for vcf_file in vcf_files:
+        base_name = os.path.basename(vcf_file)
+        for extension in VCF_EXTENSIONS[::-1]:  # .vcf.gz before .vcf
+            if base_name.lower().endswith(extension):
+                base_name = base_name[:-len(extension)]
+                break
+        name, number = base_name, 1
+        while name in samples:
+            number += 1
+            name = f'{base_name}_{number}'
+        samples[name] = vcf_file
+    return samples
+
+
+def _write_json(data: dict = None, file: str = None) -> None:
+    """
+    Write JSON to a temporary file and rename it, so the file is never seen half written
+    @param data: Dictionary to write
+    @param file: Path to write to
+    @return: None
+    """
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(file), suffix='.tmp', delete=False) as out_fh:
+        json.dump(data, out_fh, indent=2)
+    os.replace(out_fh.name, file)
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description="Flag the LOH and deletion gene events of a cohort of FACETS VCFs")
+    parser.add_argument('--vcf_dir', dest='vcf_dir', type=str, help='Process every .vcf and .vcf.gz in this directory')
+    parser.add_argument('--manifest', dest='manifest', type=str,
+                        help='Process the VCF files listed in this file, one path per line')
+    parser.add_argument('--out_dir', dest='out_dir', type=str, required=True,
+                        help='Directory of the per sample results and the cohort tables')
+    parser.add_argument('--workers', dest='workers', type=int, default=None,
+                        help='Number of worker processes, default is every core')
+    parser.add_argument('--cache_dir', dest='cache_dir', type=str,
+                        default=os.environ.get('VCF_CACHE_DIR', DEFAULT_CACHE_DIR),
+                        help='Directory of the parsed VCF cache, default $VCF_CACHE_DIR or ~/.cache/vcf_to_pandas')
+    parser.add_argument('--no_cache', dest='no_cache', action='store_true',
+                        help='Always parse the VCFs, without the cache')
+    parser.add_argument('--gene_coordinates', dest='gene_coordinates', type=str,
+                        help='Ensembl gene table to find the genes of each segment from POS and END instead of '
+                             'CNV_ANN, it has to be on the same assembly as the VCFs')
+    parser.add_argument('--min_gene_fraction', dest='min_gene_fraction', type=float, default=0.0,
+                        help='With --gene_coordinates, the fraction of a gene a segment has to cover to flag it')
+    args = parser.parse_args()
+    if not (args.vcf_dir or args.manifest):
+        parser.error("--vcf_dir or --manifest is required")
+    return args
+
+
+def test_code(facets_vcf_file: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'facets.vcf')) -> None:
+    """
+    Simple test of the code: a cohort of copies of facets.vcf and one corrupt VCF, run twice
+    @param facets_vcf_file: FACETS VCF to copy
+    @return: None
+    """
+    def expected_flags(vcf_file: str, columns: list) -> pd.Series:
+        """the gene event flags of one VCF the way vcf_to_pandas.main finds them"""
+        data_frame = get_facets_vcf_df(facets_vcf_file=vcf_file)
+        gene_table = get_gene_segment_table(data_frame=data_frame)
+        for column_name, (svtype_list, genes) in get_gene_events().items():
+            update_gene_cols(data_frame=data_frame, svtype_list=svtype_list, column_name=column_name, genes=genes,
+                             gene_table=gene_table)
+        return data_frame[columns].any().astype(int)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_dir, out_dir = os.path.join(tmp_dir, 'vcfs'), os.path.join(tmp_dir, 'cohort')
+        os.makedirs(vcf_dir)
+        shutil.copy(facets_vcf_file, os.path.join(vcf_dir, 'sample1.vcf'))
+        # facets.vcf flags no gene, give sample2 a BRCA1 LOH on one of its HEMIZYG segments
+        with open(facets_vcf_file, 'r') as in_fh, open(os.path.join(vcf_dir, 'sample2.vcf'), 'w') as out_fh:
+            out_fh.write(in_fh.read().replace('CNV_ANN=NOTCH1', 'CNV_ANN=NOTCH1,BRCA1'))
+        with open(facets_vcf_file, 'rb') as in_fh, gzip.open(os.path.join(vcf_dir, 'sample3.vcf.gz'), 'wb') as out_fh:
+            shutil.copyfileobj(in_fh, out_fh)
+        with open(os.path.join(vcf_dir, 'corrupt.vcf'), 'w') as out_fh:
+            out_fh.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\n1\tnot_a_position\t.\n')
+        vcf_files = get_vcf_files(vcf_dir=vcf_dir)
+        assert len(vcf_files) == 4
+
+        summary = run_cohort(vcf_files, out_dir, workers=2)
+        assert summary == {'done': 3, 'skipped': 0, 'failed': 1}
+        failed = pd.read_csv(os.path.join(out_dir, 'failed.tsv'), sep='\t')
+        assert failed['sample'].tolist() == ['corrupt'] and failed['error'][0].startswith('ValueError')
+
+        matrix = pd.read_csv(os.path.join(out_dir, 'cohort_matrix.tsv'), sep='\t', index_col='sample')
+        assert matrix.index.tolist() == ['sample1', 'sample2', 'sample3']
+        for sample, vcf_file in zip(matrix.index, vcf_files[1:]):
+            assert matrix.loc[sample].equals(expected_flags(vcf_file, matrix.columns).rename(sample))
+        assert matrix.loc['sample2', 'BRCA1_loh_positive'] == 1 and matrix.to_numpy().sum() == 1
+        events = pd.read_csv(os.path.join(out_dir, 'cohort_events.tsv'), sep='\t')
+        assert events.columns.tolist() == EVENT_COLUMNS
+        assert events[['sample', 'event', 'gene', 'SVTYPE']].values.tolist() == \
+            [['sample2', 'loh_positive', 'BRCA1', 'HEMIZYG']]
+
+        # the finished samples are skipped, the corrupt one is tried again
+        json_mtime = os.stat(os.path.join(out_dir, SAMPLE_DIR, 'sample1.json')).st_mtime_ns
+        assert run_cohort(vcf_files, out_dir, workers=1) == {'done': 3, 'skipped': 3, 'failed': 1}
+        assert os.stat(os.path.join(out_dir, SAMPLE_DIR, 'sample1.json')).st_mtime_ns == json_mtime
+        assert pd.read_csv(os.path.join(out_dir, 'cohort_matrix.tsv'), sep='\t', index_col='sample').equals(matrix)
+
+        # a changed VCF or changed settings are processed again
+        os.utime(vcf_files[1], ns=(0, 0))
+        assert run_cohort(vcf_files, out_dir, workers=1)['skipped'] == 2
+        assert not _is_done(out_dir, 'sample1', vcf_files[1], {'parser_version': -1})
+
+
+if __name__ == '__main__':
+    main()
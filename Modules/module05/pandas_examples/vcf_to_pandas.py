@@ -3,9 +3,24 @@ Standalone python module to show how pandas can be used to consume a VCF file fr
 """
 
 import argparse
-import io
+import gzip
+import os
+import re
+from typing import Iterator, TextIO, Tuple
+
+import numpy as np
 import pandas as pd
 
+from gene_intervals import GenomicIntervalIndex, segment_gene_overlaps
+from vcf_cache import OUTPUT_FORMATS, load_or_parse, write_output
+
+VCF_PARSER_VERSION = 2  # part of the cache key, bump it when get_facets_vcf_df changes its output
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'vcf_to_pandas')
+DEFAULT_CHUNKSIZE = 100_000  # VCF rows parsed at once
+GZIP_MAGIC = b'\x1f\x8b'
+# ##INFO=<ID=SVLEN,Number=1,Type=Integer,Description="...">
+INFO_HEADER_RE = re.compile(r'^##INFO=<ID=(?P<id>[^,>]+),Number=(?P<number>[^,>]+),Type=(?P<type>[^,>]+)')
+
 
 def main() -> None:
     """
@@ -14,16 +29,39 @@ def main() -> None:
     """
 
     args = get_cli_args()
-    # get the data frame from the facets output
-    data_frame = get_facets_vcf_df(facets_vcf_file=args.facets_vcf_file)
-    # update for loh level events in a list of genes
-    update_gene_cols(data_frame=data_frame, svtype_list=['LOH', 'DUP-LOH', 'HEMIZYG'], column_name="loh_positive",
-                     genes=get_loh_genes())
-    # update for deletion level events in a list of genes
-    update_gene_cols(data_frame=data_frame, svtype_list=['DEL'], column_name="loss_positive",
-                     genes=get_del_genes())  # no 'DUP-LOH, 'LOH', 'HEMIZYG'
+    # get the data frame from the facets output, from the cache when this file was parsed before
+    if args.no_cache:
+        data_frame = get_facets_vcf_df(facets_vcf_file=args.facets_vcf_file)
+    else:
+        data_frame = load_or_parse(source_file=args.facets_vcf_file, parse=get_facets_vcf_df,
+                                   parser_version=VCF_PARSER_VERSION, cache_dir=args.cache_dir)
+    # find the genes of each segment once for both gene lists, from CNV_ANN or from the gene coordinates
+    if args.gene_coordinates:
+        gene_table = get_gene_overlap_table(data_frame=data_frame,
+                                            gene_index=GenomicIntervalIndex.from_ensembl_tsv(args.gene_coordinates),
+                                            min_gene_fraction=args.min_gene_fraction)
+    else:
+        gene_table = get_gene_segment_table(data_frame=data_frame)
+    # update for loh level and deletion level events in the lists of genes
+    for column_name, (svtype_list, genes) in get_gene_events().items():
+        update_gene_cols(data_frame=data_frame, svtype_list=svtype_list, column_name=column_name, genes=genes,
+                         gene_table=gene_table)
     # output the results
-    data_frame.to_excel("facets_vcf.xlsx")
+    out_file = write_output(data_frame=data_frame, out_file=args.output_file, output_format=args.output_format)
+    print(f"Wrote {out_file}")
+    if args.excel:
+        # much slower than the other formats, only on request
+        data_frame.to_excel(os.path.splitext(args.output_file)[0] + '.xlsx')
+
+
+def get_gene_events() -> dict:
+    """
+    The gene level events to flag
+    @return: Dict of column name -> (structural variant types, genes)
+    """
+
+    return {'loh_positive': (['LOH', 'DUP-LOH', 'HEMIZYG'], get_loh_genes()),
+            'loss_positive': (['DEL'], get_del_genes())}  # no 'DUP-LOH, 'LOH', 'HEMIZYG'
 
 
 def get_loh_genes() -> list:
@@ -48,56 +86,146 @@ def get_del_genes() -> list:
 
 
 def update_gene_cols(data_frame: pd.DataFrame = None, svtype_list: list = None,
-                     column_name: str = None, genes: list = None) -> None:
+                     column_name: str = None, genes: list = None, gene_table: pd.DataFrame = None) -> None:
     """
-    Update the data frame with new columns if there was a match to certain genes
+    Update the data frame with new columns if there was a match to certain genes.
+    All the genes are flagged at once from the exploded CNV_ANN table, instead of one pass over the rows per gene,
+    and a gene has to be a whole CNV_ANN entry, so BRCA1 does not match BRCA10
     @param data_frame: DataFrame to check
     @param svtype_list: structural variant type to look for
     @param column_name: column name for the dataframe
     @param genes: list of genes to look for
+    @param gene_table: get_gene_segment_table or get_gene_overlap_table of data_frame, pass it in to reuse it for
+                       several calls
     @return: None
     """
-    for gene in genes:
-        data_frame[f'{gene}_{column_name}'] = \
-            data_frame.apply(lambda x, y=gene: _is_gene_positive(row=x, gene=y,
-                                                                 svtype_list=svtype_list), axis=1)
+    if gene_table is None:
+        gene_table = get_gene_segment_table(data_frame=data_frame)
+    genes = list(dict.fromkeys(genes))
+    hits = gene_table[gene_table['gene'].isin(genes) & gene_table['SVTYPE'].isin(svtype_list)]
+    flags = np.zeros((len(data_frame), len(genes)), dtype=bool)
+    flags[hits['row'].to_numpy(), pd.Index(genes).get_indexer(hits['gene'])] = True
+    data_frame[[f'{gene}_{column_name}' for gene in genes]] = flags
 
 
-def _is_gene_positive(row: pd.Series = None, gene: str = None, svtype_list: list = None) -> bool:
+def get_gene_segment_table(data_frame: pd.DataFrame = None) -> pd.DataFrame:
     """
-    Is the Pandas series contain a gene was event of the type SVTYPE passed in
-    @param row: Pandas series
-    @param gene: Gene to search for
-    @return: Bool
+    Parse CNV_ANN once into a long table with one line per gene per segment
+    @param data_frame: DataFrame with the CNV_ANN and SVTYPE columns, CNV_ANN like GENE1,GENE2 or .
+    @return: DataFrame with the columns row (position of the segment in data_frame), gene and SVTYPE
     """
-    return bool(gene in row['CNV_ANN'] and row['SVTYPE'] in svtype_list)
+    genes = pd.Series(data_frame['CNV_ANN'].to_numpy()).str.split(',').explode()
+    genes = genes[genes.notna() & ~genes.isin(['.', ''])]
+    rows = genes.index.to_numpy()
+    return pd.DataFrame({'row': rows,
+                         'gene': genes.str.strip().to_numpy(),
+                         'SVTYPE': data_frame['SVTYPE'].to_numpy()[rows]})
 
 
-def get_facets_vcf_df(facets_vcf_file: str = None) -> pd.DataFrame:
+def get_gene_overlap_table(data_frame: pd.DataFrame = None, gene_index: GenomicIntervalIndex = None,
+                           min_gene_fraction: float = 0.0) -> pd.DataFrame:
     """
-    @param facets_vcf_file: string of the VCF file open
+    Same as get_gene_segment_table, but from the POS and END coordinates of the segments instead of CNV_ANN.
+    The coordinates of the genes have to be on the same assembly as the VCF
+    @param data_frame: DataFrame with the #CHROM, POS, END and SVTYPE columns
+    @param gene_index: gene_intervals.GenomicIntervalIndex of the genes
+    @param min_gene_fraction: Only keep the genes with at least this fraction of their length in the segment
+    @return: DataFrame with the columns row, gene, SVTYPE, overlap_bp, gene_fraction and segment_fraction
+    """
+    overlaps = segment_gene_overlaps(data_frame=data_frame, gene_index=gene_index)
+    overlaps = overlaps[overlaps['gene_fraction'] >= min_gene_fraction]
+    return pd.DataFrame({'row': overlaps['row'].to_numpy(),
+                         'gene': overlaps['gene'].to_numpy(),
+                         'SVTYPE': data_frame['SVTYPE'].to_numpy()[overlaps['row'].to_numpy()],
+                         'overlap_bp': overlaps['overlap_bp'].to_numpy(),
+                         'gene_fraction': overlaps['gene_fraction'].to_numpy(),
+                         'segment_fraction': overlaps['segment_fraction'].to_numpy()})
+
+
+def get_facets_vcf_df(facets_vcf_file: str = None, chunksize: int = DEFAULT_CHUNKSIZE) -> pd.DataFrame:
+    """
+    @param facets_vcf_file: string of the VCF file open, plain or gzip
+    @param chunksize: Number of rows parsed at once
     @return: Return a pandas data frame of the VCF, with discrete elements for the INFO column
     """
-    vcf_df = _read_dataset_and_get_pandas_df(col_vals=_get_columns_from_facets_vcf(),
-                                             file_name=facets_vcf_file,
-                                             ignore_line_starts_with='##')
-    # Parse out the INFO column and create a new data frame that will be merged
-    # Browsing a Series is much faster that iterating across the rows of a dataframe.
-    vcf_df_updated = pd.DataFrame([dict([x.split('=') for x in t.split(';')])
-                                   for t in vcf_df['INFO']], index=vcf_df['ID']).reset_index()
+    chunks = list(iter_vcf_chunks(vcf_file=facets_vcf_file, chunksize=chunksize))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def iter_vcf_chunks(vcf_file: str = None, chunksize: int = DEFAULT_CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream a VCF as DataFrames of at most chunksize rows, so a large VCF can be processed with bounded memory.
+    The INFO column is split into one typed column per ##INFO header line
+    @param vcf_file: VCF file, plain or gzip
+    @param chunksize: Number of rows per DataFrame
+    @return: Iterator of DataFrames
+    """
+    with _open_vcf(vcf_file) as in_fh:
+        info_fields, columns = read_vcf_header(in_fh)
+        col_vals = {column: str for column in columns}
+        col_vals.update({column: dtype for column, dtype in _get_columns_from_facets_vcf().items()
+                         if column in col_vals})
+        # the filehandle is just after the #CHROM line, so pandas reads the data lines only
+        reader = pd.read_csv(in_fh, sep='\t', header=None, names=columns, dtype=col_vals, chunksize=chunksize)
+        for chunk in reader:
+            info_df = parse_info_column(info=chunk['INFO'], info_fields=info_fields)
+            yield pd.concat([chunk, info_df], axis=1)
+
 
-    # update these three columns to numeric types
-    for k, v in {'SVLEN': int, 'CNLR_MEDIAN': float, 'NHET': int}.items():
-        # pylint: disable=unsubscriptable-object
-        # pylint: disable=unsupported-assignment-operation
-        vcf_df_updated[k] = vcf_df_updated[k].astype(v)
+def read_vcf_header(in_fh: TextIO = None) -> Tuple[dict, list]:
+    """
+    Read the ## meta-information lines and the #CHROM line, leaving the filehandle at the first data line
+    @param in_fh: filehandle of the VCF, at the start
+    @return: Tuple of the INFO fields, {ID: (Number, Type)} in header order, and the column names
+    """
+    info_fields = {}
+    # readline and not iteration, so the filehandle position stays right for pandas
+    line = in_fh.readline()
+    while line.startswith('##'):
+        match = INFO_HEADER_RE.match(line)
+        if match:
+            info_fields[match.group('id')] = (match.group('number'), match.group('type'))
+        line = in_fh.readline()
+    if not line.startswith('#CHROM'):
+        raise ValueError(f"VCF header has no #CHROM line, found: {line[:50]!r}")
+    return info_fields, line.rstrip('\r\n').split('\t')
 
-    # two data frames should be the same, so just join on ID for the VCF output, since this is unique for one
-    # Facets VCF file
-    assert len(vcf_df) == len(vcf_df_updated), "data frames were not the same size, and should be"
-    final_df = pd.merge(vcf_df, vcf_df_updated, on='ID')
 
-    return final_df
+def parse_info_column(info: pd.Series = None, info_fields: dict = None) -> pd.DataFrame:
+    """
+    Split the INFO column into one column per field.  Each field is pulled out of all the rows at once with a
+    vectorized regular expression and cast to the type in its ##INFO line: Integer, Float, Flag (bool) or String.
+    Fields with more than one value (Number other than 1) stay as the comma separated string
+    @param info: Series of INFO strings like SVTYPE=DEL;SVLEN=100;CNV_ANN=.
+    @param info_fields: {ID: (Number, Type)} from read_vcf_header
+    @return: DataFrame with the same index as info
+    """
+    info = ';' + info.astype(str)  # so every field starts after a ;
+    columns = {}
+    for field, (number, field_type) in info_fields.items():
+        if field_type == 'Flag':
+            columns[field] = info.str.contains(f';{re.escape(field)}(?:;|$)', regex=True)
+            continue
+        values = info.str.extract(f';{re.escape(field)}=([^;]*)', expand=False)
+        if number == '1' and field_type in ('Integer', 'Float'):
+            values = pd.to_numeric(values, errors='coerce')
+            if field_type == 'Integer':
+                values = values.astype('int64' if values.notna().all() else 'Int64')
+        columns[field] = values
+    return pd.DataFrame(columns, index=info.index)
+
+
+def _open_vcf(vcf_file: str = None) -> TextIO:
+    """
+    Open a VCF for reading, plain text or gzip (detected by the magic number)
+    @param vcf_file: VCF file
+    @return: filehandle in text mode
+    """
+    with open(vcf_file, 'rb') as in_fh:
+        is_gzip = in_fh.read(2) == GZIP_MAGIC
+    if is_gzip:
+        return gzip.open(vcf_file, 'rt', encoding='utf8')
+    return open(vcf_file, 'r', encoding='utf8')
 
 
 def _get_columns_from_facets_vcf() -> dict:
@@ -118,31 +246,6 @@ def _get_columns_from_facets_vcf() -> dict:
     return col_vals
 
 
-def _read_dataset_and_get_pandas_df(col_vals: dict = None, file_name: str = None, keep_default_na: bool = True,
-                                    ignore_line_starts_with: str = "#") -> pd.DataFrame:
-    """
-    @param col_vals: Dictionary of column names and types
-    @param file_name: File to open
-    @param keep_default_na: Boolean to keep the NAs or covert them via Pandas
-    @param ignore_line_starts_with: What character to ignore, default #
-    Input:  The column values as a dictionary with the key = to the column, and the value = type, e.g. int, str, etc
-    @return: pandas data frame
-    """
-
-    with open(file_name, 'r', encoding="utf8") as infh:
-        lines = [lines for lines in infh if not lines.startswith(ignore_line_starts_with)]  # ignore comments
-    # get the dataframe
-    data_frame = pd.read_table(
-        # A text stream using an in-memory text buffer. It inherits TextIOBase.
-        io.StringIO(''.join(lines)),
-        usecols=list(col_vals.keys()),
-        dtype=col_vals,  # pass in the dictionary of key values, key is the column, key is the type, e.g. int, float...
-        keep_default_na=keep_default_na,
-        sep='\t'
-    )
-    return data_frame
-
-
 def get_cli_args() -> argparse:
     """
     Get the argparse instance
@@ -157,6 +260,22 @@ def get_cli_args() -> argparse:
                         type=str,
                         help='VCF file from FACETS output.  Used to calculate the genome-level metrics for LOH',
                         required=True)
+    parser.add_argument('--output_file', dest='output_file', type=str, default='facets_vcf.tsv',
+                        help='Output file, the extension is set by --output_format')
+    parser.add_argument('--output_format', dest='output_format', choices=OUTPUT_FORMATS, default='tsv',
+                        help='Output format, parquet and feather need pyarrow and fall back to npz without it')
+    parser.add_argument('--excel', dest='excel', action='store_true',
+                        help='Also write the output as an Excel .xlsx file (slow)')
+    parser.add_argument('--cache_dir', dest='cache_dir', type=str,
+                        default=os.environ.get('VCF_CACHE_DIR', DEFAULT_CACHE_DIR),
+                        help='Directory of the parsed VCF cache, default $VCF_CACHE_DIR or ~/.cache/vcf_to_pandas')
+    parser.add_argument('--no_cache', dest='no_cache', action='store_true',
+                        help='Always parse the VCF, without the cache')
+    parser.add_argument('--gene_coordinates', dest='gene_coordinates', type=str,
+                        help='Ensembl gene table (e.g. ensembl_gene_data.tsv.gz) to find the genes of each segment '
+                             'from POS and END instead of CNV_ANN, it has to be on the same assembly as the VCF')
+    parser.add_argument('--min_gene_fraction', dest='min_gene_fraction', type=float, default=0.0,
+                        help='With --gene_coordinates, the fraction of a gene a segment has to cover to flag it')
 
     return parser.parse_args()
 
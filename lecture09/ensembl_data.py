@@ -2,6 +2,8 @@ import json
 import pickle
 import time
 
+from ensembl_store import EnsemblStore, build_store
+
 start = time.time()
 with open('ensemblData.json') as json_file:
     data = json.load(json_file)
@@ -22,4 +24,17 @@ with open("ensemblData.pkl", "rb") as in_fh:
     ensembl = pickle.load(in_fh)
 print("Time spent loading into Python:  {0:.3f} sec".format(time.time() - start))
 print(len(ensembl.keys()))
-print(ensembl['5S_rRNA']['00000201285']['biotype'])
\ No newline at end of file
+print(ensembl['5S_rRNA']['00000201285']['biotype'])
+
+
+# indexed store, see ensembl_store.py: converted once, then only the record asked for is read
+start = time.time()
+build_store('ensemblData.json', 'ensemblData.store')
+print("Time spent building the store:  {0:.3f} sec".format(time.time() - start))
+
+
+start = time.time()
+with EnsemblStore('ensemblData.store') as store:
+    print("Time spent opening the store:  {0:.3f} sec".format(time.time() - start))
+    print(len(store.biotypes()))
+    print(store['5S_rRNA', '00000201285']['biotype'])
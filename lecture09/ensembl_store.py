@@ -0,0 +1,277 @@
+"""
+Indexed on-disk store of the Ensembl gene JSON (biotype -> gene id -> record), converted once with build_store
+Opening the store reads only a small metadata file.  The key table is memory mapped, so a lookup is a binary search
+plus decoding the one record asked for, instead of json.load or pickle.load of the whole tree:
+    <store_dir>/meta.json        biotype -> [first, last + 1] position in the key table
+    <store_dir>/keys.npy         sorted fixed width b'<biotype>\\t<gene id>' keys
+    <store_dir>/offsets.npy      uint64 start of every record in records.bin, plus the end of the last one
+    <store_dir>/records.bin      every record as compact JSON, in key order so a biotype's records are contiguous
+    python ensembl_store.py --json_file ensemblData.json --store_dir ensemblData.store
+"""
+import argparse
+import json
+import mmap
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+from typing import Iterator, Tuple
+
+import numpy as np
+
+KEY_SEPARATOR = '\t'
+META_FILE = 'meta.json'
+KEYS_FILE = 'keys.npy'
+OFFSETS_FILE = 'offsets.npy'
+RECORDS_FILE = 'records.bin'
+
+
+def main() -> None:
+    """Business Logic"""
+    args = get_cli_args()
+    if not os.path.exists(os.path.join(args.store_dir, META_FILE)):
+        build_store(args.json_file, args.store_dir)
+    benchmark(args.json_file, args.store_dir, biotype=args.biotype, gene_id=args.gene_id)
+
+
+class EnsemblStore:
+    """Read only access to a store written by build_store"""
+
+    def __init__(self, store_dir: str = None):
+        """
+        @param store_dir: Directory of the store
+        """
+        with open(os.path.join(store_dir, META_FILE), 'r') as in_fh:
+            self.biotype_ranges = json.load(in_fh)['biotypes']
+        self._keys = np.load(os.path.join(store_dir, KEYS_FILE), mmap_mode='r')
+        self._offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self._records_fh = open(os.path.join(store_dir, RECORDS_FILE), 'rb')
+        if os.fstat(self._records_fh.fileno()).st_size:
+            self._records = mmap.mmap(self._records_fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:  # an empty file can not be memory mapped
+            self._records = b''
+
+    def __enter__(self) -> 'EnsemblStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the record file"""
+        if isinstance(self._records, mmap.mmap):
+            self._records.close()
+        self._records_fh.close()
+
+    def __len__(self) -> int:
+        """Number of records"""
+        return len(self._keys)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        """
+        @param key: Tuple of biotype and gene id
+        @return: True when the store has the record
+        """
+        return self._find(*key) is not None
+
+    def __getitem__(self, key: Tuple[str, str]) -> dict:
+        """
+        store['5S_rRNA', '00000201285'] is data['5S_rRNA']['00000201285'] of the JSON
+        @param key: Tuple of biotype and gene id
+        @return: record
+        """
+        return self.get(*key)
+
+    def get(self, biotype: str = None, gene_id: str = None) -> dict:
+        """
+        @param biotype: Biotype, e.g. 5S_rRNA
+        @param gene_id: Gene id, e.g. 00000201285
+        @return: the record of the gene, raises KeyError when it is not in the store
+        """
+        position = self._find(biotype, gene_id)
+        if position is None:
+            raise KeyError((biotype, gene_id))
+        return self._read_record(position)
+
+    def biotypes(self) -> list:
+        """
+        @return: list of the biotypes
+        """
+        return list(self.biotype_ranges)
+
+    def gene_ids(self, biotype: str = None) -> list:
+        """
+        @param biotype: Biotype
+        @return: list of the gene ids of a biotype, without reading their records
+        """
+        first, last = self.biotype_ranges.get(biotype, (0, 0))
+        prefix_len = len(_make_key(biotype, ''))
+        return [key[prefix_len:].decode('utf-8') for key in self._keys[first:last]]
+
+    def iter_biotype(self, biotype: str = None) -> Iterator[Tuple[str, dict]]:
+        """
+        Generator of the records of one biotype, read one at a time from the contiguous block of the biotype
+        @param biotype: Biotype
+        @return: Iterator of (gene id, record)
+        """
+        first, _ = self.biotype_ranges.get(biotype, (0, 0))
+        for position, gene_id in enumerate(self.gene_ids(biotype), start=first):
+            yield gene_id, self._read_record(position)
+
+    def _find(self, biotype: str, gene_id: str):
+        """
+        @param biotype: Biotype
+        @param gene_id: Gene id
+        @return: position of the key in the key table, or None
+        """
+        first, last = self.biotype_ranges.get(biotype, (0, 0))
+        key = _make_key(biotype, gene_id)
+        if first == last or len(key) > self._keys.dtype.itemsize:
+            return None
+        position = first + int(np.searchsorted(self._keys[first:last], key))
+        if position < last and self._keys[position] == key:
+            return position
+        return None
+
+    def _read_record(self, position: int) -> dict:
+        """
+        @param position: position of the key in the key table
+        @return: decoded record
+        """
+        return json.loads(self._records[int(self._offsets[position]):int(self._offsets[position + 1])])
+
+
+def build_store(json_file: str = None, store_dir: str = None) -> None:
+    """
+    Convert the Ensembl JSON into a store, once
+    @param json_file: JSON file of biotype -> gene id -> record
+    @param store_dir: Directory to write the store to, created if needed
+    @return: None
+    """
+    with open(json_file, 'r') as in_fh:
+        data = json.load(in_fh)
+    write_store(data, store_dir)
+
+
+def write_store(data: dict = None, store_dir: str = None) -> None:
+    """
+    Write a biotype -> gene id -> record dictionary as a store
+    @param data: Dictionary of biotype -> gene id -> record
+    @param store_dir: Directory to write the store to, created if needed
+    @return: None
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    keys = sorted((_make_key(biotype, gene_id), biotype, gene_id)
+                  for biotype, genes in data.items() for gene_id in genes)
+    if any(KEY_SEPARATOR in biotype for biotype in data):
+        raise ValueError("A biotype has a tab in it")
+    offsets = np.zeros(len(keys) + 1, dtype=np.uint64)
+    biotype_ranges = {}
+    with open(os.path.join(store_dir, RECORDS_FILE), 'wb') as out_fh:
+        for position, (_, biotype, gene_id) in enumerate(keys):
+            record = json.dumps(data[biotype][gene_id], separators=(',', ':')).encode('utf-8')
+            out_fh.write(record)
+            offsets[position + 1] = offsets[position] + len(record)
+            biotype_ranges.setdefault(biotype, [position, position])[1] = position + 1
+    key_width = max((len(key) for key, _, _ in keys), default=1)
+    np.save(os.path.join(store_dir, KEYS_FILE), np.array([key for key, _, _ in keys], dtype=f'S{key_width}'))
+    np.save(os.path.join(store_dir, OFFSETS_FILE), offsets)
+    # meta.json last: a store without it is incomplete
+    with open(os.path.join(store_dir, META_FILE), 'w') as out_fh:
+        json.dump({'num_records': len(keys), 'biotypes': biotype_ranges}, out_fh)
+
+
+def benchmark(json_file: str = None, store_dir: str = None, biotype: str = '5S_rRNA',
+              gene_id: str = '00000201285') -> None:
+    """
+    Time one lookup after json.load, pickle.load and opening the store, with the peak Python memory of each
+    @param json_file: Ensembl JSON file
+    @param store_dir: Directory of the store of the same JSON
+    @param biotype: Biotype to look up
+    @param gene_id: Gene id to look up
+    @return: None
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_file = os.path.join(tmp_dir, 'ensemblData.pkl')
+        with open(json_file, 'r') as in_fh, open(pickle_file, 'wb') as out_fh:
+            pickle.dump(json.load(in_fh), out_fh, pickle.HIGHEST_PROTOCOL)
+
+        def json_lookup():
+            with open(json_file, 'r') as in_fh:
+                return json.load(in_fh)[biotype][gene_id]
+
+        def pickle_lookup():
+            with open(pickle_file, 'rb') as in_fh:
+                return pickle.load(in_fh)[biotype][gene_id]
+
+        def store_lookup():
+            with EnsemblStore(store_dir) as store:
+                return store[biotype, gene_id]
+
+        for name, lookup in (('json.load', json_lookup), ('pickle.load', pickle_lookup),
+                             ('EnsemblStore', store_lookup)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            record = lookup()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name:>12}: {seconds:.4f} sec, peak {peak / 2 ** 20:.1f} MiB, "
+                  f"biotype {record.get('biotype') if isinstance(record, dict) else record}")
+
+
+def _make_key(biotype: str, gene_id: str) -> bytes:
+    """
+    @param biotype: Biotype
+    @param gene_id: Gene id
+    @return: key of the record in the key table
+    """
+    return f'{biotype}{KEY_SEPARATOR}{gene_id}'.encode('utf-8')
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Convert the Ensembl JSON into an indexed store and benchmark it')
+    parser.add_argument('--json_file', dest='json_file', type=str, default='ensemblData.json',
+                        help='Ensembl JSON of biotype -> gene id -> record')
+    parser.add_argument('--store_dir', dest='store_dir', type=str, default='ensemblData.store',
+                        help='Directory of the store, built from --json_file when it does not exist')
+    parser.add_argument('--biotype', dest='biotype', type=str, default='5S_rRNA', help='Biotype to look up')
+    parser.add_argument('--gene_id', dest='gene_id', type=str, default='00000201285', help='Gene id to look up')
+    return parser.parse_args()
+
+
+def test_code() -> None:
+    """
+    Simple test of the code
+    @return: None
+    """
+    data = {'5S_rRNA': {'00000201285': {'biotype': '5S_rRNA', 'start': 1}, '00000199352': {'biotype': '5S_rRNA'}},
+            'protein_coding': {'00000157764': {'biotype': 'protein_coding', 'name': 'BRAF', 'exons': [1, 2]}},
+            'lncRNA': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_file = os.path.join(tmp_dir, 'ensemblData.json')
+        with open(json_file, 'w') as out_fh:
+            json.dump(data, out_fh)
+        build_store(json_file, os.path.join(tmp_dir, 'store'))
+        with EnsemblStore(os.path.join(tmp_dir, 'store')) as store:
+            assert len(store) == 3
+            assert store['5S_rRNA', '00000201285']['biotype'] == '5S_rRNA'
+            assert store.get('protein_coding', '00000157764') == data['protein_coding']['00000157764']
+            assert ('5S_rRNA', '00000157764') not in store and ('miRNA', '1') not in store
+            assert dict(store.iter_biotype('5S_rRNA')) == data['5S_rRNA']
+            assert list(store.iter_biotype('lncRNA')) == []
+            assert sorted(store.biotypes()) == ['5S_rRNA', 'protein_coding']
+            try:
+                store.get('5S_rRNA', '1')
+                assert False, "missing key"
+            except KeyError:
+                pass
+
+
+if __name__ == '__main__':
+    main()
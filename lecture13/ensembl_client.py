@@ -0,0 +1,597 @@
+"""
+Concurrent client for the Ensembl REST API (https://rest.ensembl.org) with a disk cache of the responses
+Requests run concurrently under asyncio, over a pool of keep-alive http.client connections (the blocking sends run
+in a thread pool, so no extra package is needed).  A token bucket keeps the client under the Ensembl rate limit, and
+429 / 503 responses are retried after their Retry-After.  The batch POST endpoints (lookup/id, lookup/symbol) take up
+to 1000 ids per request.  Every successful response is kept in a ResponseCache, so a repeated lookup never goes to
+the network while its entry is fresh; for the batch endpoints each id is cached on its own.
+    python ensembl_client.py --symbols BRAF EGFR --out_dir .
+writes human_BRAF.json (the xrefs) and output_human_BRAF.txt (the variants of the gene), like the saved files here.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Optional, TextIO
+from urllib.parse import urlencode, urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows, writers are not locked against each other
+    fcntl = None
+
+DEFAULT_SERVER = 'https://rest.ensembl.org'
+REQUESTS_PER_SECOND = 15  # the Ensembl limit for anonymous clients
+POOL_SIZE = 8  # keep-alive connections, and most requests in flight at once
+MAX_BATCH = 1000  # most ids per batch POST
+MAX_RETRIES = 5
+CACHE_DIR_ENV = 'ENSEMBL_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ensembl_rest')
+DEFAULT_TTL = 7 * 24 * 3600  # seconds a response stays fresh
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+LOCK_FILE = '.lock'
+SPECIES = {'human': 'homo_sapiens', 'mouse': 'mus_musculus'}
+
+
+def main() -> None:
+    """Business Logic"""
+    args = get_cli_args()
+    cache = None if args.no_cache else ResponseCache(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR))
+    asyncio.run(annotate_genes(args.symbols, args.out_dir, species=args.species, server=args.server, cache=cache))
+
+
+class EnsemblError(Exception):
+    """A request the server answered with an error"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class ResponseCache:
+    """Disk cache of JSON responses, entries expire after ttl seconds and the least recently used go past max_bytes"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        @param cache_dir: Directory of the cache, created with the first entry
+        @param ttl: Seconds an entry is used for after it was stored
+        @param max_bytes: Largest total size of the entries
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def get(self, key: str):
+        """
+        @param key: Request key, e.g. 'GET /xrefs/symbol/homo_sapiens/BRAF'
+        @return: the cached response, or None when missing or expired
+        """
+        file = self._entry_file(key)
+        try:
+            with open(file, 'r') as in_fh:
+                entry = json.load(in_fh)
+        except (OSError, ValueError):  # not cached, or removed by another process
+            return None
+        if time.time() - entry['stored'] > self.ttl:
+            return None
+        try:
+            os.utime(file)  # mark as recently used, the stored time is in the entry
+        except OSError:
+            pass
+        return entry['response']
+
+    def put(self, key: str, response) -> None:
+        """
+        Add a response, then remove the expired and least recently used entries if the cache is too big
+        @param key: Request key
+        @param response: JSON response
+        @return: None
+        """
+        with self._lock():
+            with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, suffix='.tmp', delete=False) as out_fh:
+                json.dump({'key': key, 'stored': time.time(), 'response': response}, out_fh)
+            os.replace(out_fh.name, self._entry_file(key))
+            self._evict()
+
+    def clear(self) -> None:
+        """
+        Remove every entry
+        @return: None
+        """
+        with self._lock():
+            for file in self._entry_files():
+                _remove(file)
+
+    def _evict(self) -> None:
+        """
+        Remove the expired entries, then the least recently used until the cache fits, without taking the lock
+        @return: None
+        """
+        entries = []
+        for file in self._entry_files():
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file))
+        total = sum(size for _, size, _ in entries)
+        # an entry is never used after ttl, and its mtime is at least its stored time
+        for mtime, size, file in entries:
+            if time.time() - mtime > self.ttl:
+                _remove(file)
+                total -= size
+        for mtime, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if time.time() - mtime <= self.ttl:
+                _remove(file)
+                total -= size
+
+    def _entry_files(self) -> list:
+        """
+        @return: paths of every entry
+        """
+        return glob.glob(os.path.join(self.cache_dir, '*.json'))
+
+    def _entry_file(self, key: str) -> str:
+        """
+        @param key: Request key
+        @return: path of the entry
+        """
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _lock(self) -> '_DirLock':
+        """
+        @return: context manager holding the exclusive writer lock of the cache
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return _DirLock(os.path.join(self.cache_dir, LOCK_FILE))
+
+
+class _DirLock:
+    """Exclusive flock on a file, a no-op where fcntl is not available"""
+
+    def __init__(self, file: str):
+        """
+        @param file: Lock file, created if needed
+        """
+        self.file = file
+        self.handle = None
+
+    def __enter__(self):
+        """Block until the lock is taken"""
+        self.handle = open(self.file, 'a')
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the lock"""
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+class RateLimiter:
+    """Token bucket: at most rate requests per second, with bursts of up to rate requests"""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND):
+        """
+        @param rate: requests per second
+        """
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class EnsemblClient:
+    """Asyncio client for the Ensembl REST API, use it as an async context manager"""
+
+    def __init__(self, server: str = DEFAULT_SERVER, cache: Optional[ResponseCache] = None,
+                 requests_per_second: float = REQUESTS_PER_SECOND, pool_size: int = POOL_SIZE,
+                 timeout: float = 60, max_retries: int = MAX_RETRIES):
+        """
+        @param server: Base URL of the server
+        @param cache: ResponseCache for the responses, None to always ask the server
+        @param requests_per_second: Most requests sent per second
+        @param pool_size: Number of keep-alive connections, and most requests in flight at once
+        @param timeout: Socket timeout in seconds
+        @param max_retries: Retries of a request answered with 429 or 503, or whose connection broke
+        """
+        url = urlsplit(server)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.base_path = url.path.rstrip('/')
+        self.cache = cache
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.requests_sent = 0
+        self._idle = []  # connections not in use
+        self._closed = False
+        self._slots = asyncio.Semaphore(pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    async def __aenter__(self) -> 'EnsemblClient':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Wait for the requests in flight, then close the thread pool and the connections"""
+        self._closed = True
+        # shutdown blocks until the sends running on the worker threads are done, wait for it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        for connection in self._idle:
+            connection.close()
+        self._idle = []
+
+    async def get(self, path: str, **params):
+        """
+        @param path: Endpoint, e.g. /xrefs/symbol/homo_sapiens/BRAF
+        @param params: query parameters, e.g. feature='variation'
+        @return: decoded JSON response
+        """
+        if params:
+            path = f'{path}?{urlencode(params, doseq=True)}'
+        return await self._cached('GET', path)
+
+    async def post(self, path: str, payload: dict = None):
+        """
+        @param path: Endpoint, e.g. /lookup/id
+        @param payload: JSON body
+        @return: decoded JSON response
+        """
+        return await self._cached('POST', path, json.dumps(payload, sort_keys=True))
+
+    async def post_batched(self, path: str, key: str, ids: Iterable[str], batch_size: int = MAX_BATCH,
+                           **payload) -> dict:
+        """
+        Call a batch POST endpoint for any number of ids, batch_size ids per request, the requests running
+        concurrently.  Each id's result is cached on its own, so only the ids missing from the cache are sent
+        @param path: Endpoint answering a dict of id -> result, e.g. /lookup/id
+        @param key: Name of the id list in the body, e.g. 'ids' or 'symbols'
+        @param ids: ids to look up
+        @param batch_size: Most ids per request
+        @param payload: Other fields of the body, e.g. expand=1
+        @return: Dict of id -> result, None for the ids the server does not know
+        """
+        ids = list(dict.fromkeys(ids))
+        item_keys = {item: f"POST {path} {json.dumps(payload, sort_keys=True)} {item}" for item in ids}
+        results, missing = {}, []
+        for item in ids:
+            cached = self.cache.get(item_keys[item]) if self.cache else None
+            if cached is None:
+                missing.append(item)
+            else:
+                results[item] = cached['result']
+
+        batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+        for batch, response in zip(batches, await asyncio.gather(
+                *(self._send('POST', path, json.dumps({key: batch, **payload})) for batch in batches))):
+            for item in batch:
+                results[item] = response.get(item)
+                if self.cache:
+                    self.cache.put(item_keys[item], {'result': results[item]})
+        return {item: results[item] for item in ids}
+
+    async def xrefs_symbol(self, symbol: str, species: str = 'human') -> list:
+        """
+        @param symbol: Gene symbol, e.g. BRAF
+        @param species: Species name or alias
+        @return: list of the Ensembl objects of the symbol, like human_BRAF.json
+        """
+        return await self.get(f'/xrefs/symbol/{SPECIES.get(species, species)}/{symbol}')
+
+    async def lookup_symbols(self, symbols: Iterable[str], species: str = 'human') -> dict:
+        """
+        @param symbols: Gene symbols
+        @param species: Species name or alias
+        @return: Dict of symbol -> lookup record, with POST /lookup/symbol
+        """
+        return await self.post_batched(f'/lookup/symbol/{SPECIES.get(species, species)}', 'symbols', symbols)
+
+    async def lookup_ids(self, ids: Iterable[str]) -> dict:
+        """
+        @param ids: Ensembl stable ids
+        @return: Dict of id -> lookup record, with POST /lookup/id
+        """
+        return await self.post_batched('/lookup/id', 'ids', ids)
+
+    async def overlap_variants(self, gene_id: str) -> list:
+        """
+        @param gene_id: Ensembl gene id
+        @return: list of the variants overlapping the gene
+        """
+        return await self.get(f'/overlap/id/{gene_id}', feature='variation')
+
+    async def _cached(self, method: str, path: str, body: str = None):
+        """
+        @param method: GET or POST
+        @param path: Endpoint with the query string
+        @param body: JSON body of a POST
+        @return: response from the cache, or from the server and then cached
+        """
+        key = f'{method} {path} {body or ""}'
+        if self.cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached['result']
+        response = await self._send(method, path, body)
+        if self.cache:
+            self.cache.put(key, {'result': response})
+        return response
+
+    async def _send(self, method: str, path: str, body: str = None):
+        """
+        Send one request over a pooled connection, under the rate limit, retrying 429, 503 and broken connections
+        @param method: GET or POST
+        @param path: Endpoint with the query string
+        @param body: JSON body of a POST
+        @return: decoded JSON response
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            async with self._slots:
+                connection = self._idle.pop() if self._idle else self.connection_class(self.host,
+                                                                                       timeout=self.timeout)
+                try:
+                    status, headers, data = await loop.run_in_executor(
+                        self._executor, _request, connection, method, self.base_path + path, body)
+                except (http.client.HTTPException, OSError):
+                    # e.g. the server closed an idle keep-alive connection
+                    connection.close()
+                    if attempt == self.max_retries:
+                        raise
+                    continue
+                self.requests_sent += 1
+                if self._closed:  # close() may already have closed the idle connections
+                    connection.close()
+                else:
+                    self._idle.append(connection)
+            if status in (429, 503) and attempt < self.max_retries:
+                await asyncio.sleep(float(headers.get('Retry-After', 1)))
+                continue
+            if status != 200:
+                try:
+                    message = json.loads(data).get('error', data.decode('utf-8', 'replace'))
+                except (ValueError, AttributeError):
+                    message = data.decode('utf-8', 'replace')
+                raise EnsemblError(status, message)
+            return json.loads(data)
+        raise EnsemblError(status, "too many retries")
+
+
+def _request(connection: http.client.HTTPConnection, method: str, path: str, body: str = None) -> tuple:
+    """
+    Blocking request on a keep-alive connection, run in the thread pool
+    @param connection: http.client connection, reconnects by itself when closed
+    @param method: GET or POST
+    @param path: full path with the query string
+    @param body: JSON body of a POST
+    @return: Tuple of the status, headers and body
+    """
+    headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Connection': 'keep-alive'}
+    connection.request(method, path, body=body.encode('utf-8') if body else None, headers=headers)
+    response = connection.getresponse()
+    return response.status, dict(response.getheaders()), response.read()
+
+
+async def annotate_genes(symbols: Iterable[str] = None, out_dir: str = '.', species: str = 'human',
+                         server: str = DEFAULT_SERVER, cache: Optional[ResponseCache] = None, **client_args) -> None:
+    """
+    For every gene symbol write <species>_<symbol>.json (the xrefs) and output_<species>_<symbol>.txt (the
+    variants of the Ensembl gene), all the genes at once
+    @param symbols: Gene symbols
+    @param out_dir: Directory to write to
+    @param species: Species name or alias
+    @param server: Base URL of the server
+    @param cache: ResponseCache, None to always ask the server
+    @param client_args: Other arguments of EnsemblClient
+    @return: None
+    """
+    async with EnsemblClient(server=server, cache=cache, **client_args) as client:
+        async def annotate(symbol: str) -> None:
+            xrefs = await client.xrefs_symbol(symbol, species=species)
+            with open(os.path.join(out_dir, f'{species}_{symbol}.json'), 'w') as out_fh:
+                json.dump(xrefs, out_fh, indent=4)
+            with open(os.path.join(out_dir, f'output_{species}_{symbol}.txt'), 'w') as out_fh:
+                for xref in xrefs:
+                    if xref['type'] == 'gene' and xref['id'].startswith('ENS'):
+                        write_variants(await client.overlap_variants(xref['id']), out_fh)
+
+        await asyncio.gather(*(annotate(symbol) for symbol in dict.fromkeys(symbols)))
+
+
+def write_variants(variants: list = None, out_fh: TextIO = None) -> None:
+    """
+    Write variants as lines like 7:140719328-140719347:1 ==> rs1462356656 (3_prime_UTR_variant)
+    @param variants: list of variant records from overlap/id
+    @param out_fh: filehandle open for writing
+    @return: None
+    """
+    for variant in variants:
+        out_fh.write(f"{variant['seq_region_name']}:{variant['start']}-{variant['end']}:{variant['strand']} ==> "
+                     f"{variant['id']} ({variant['consequence_type']})\n")
+
+
+def _remove(file: str) -> None:
+    """
+    Remove a file that another process may have removed already
+    @param file: path
+    @return: None
+    """
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+
+
+def get_cli_args() -> argparse.Namespace:
+    """
+    Just get the command line options using argparse
+    @return: Instance of argparse arguments
+    """
+    parser = argparse.ArgumentParser(description='Get the Ensembl xrefs and variants of gene symbols')
+    parser.add_argument('--symbols', dest='symbols', nargs='+', required=True, help='Gene symbols, e.g. BRAF EGFR')
+    parser.add_argument('--species', dest='species', type=str, default='human', help='Species name or alias')
+    parser.add_argument('--out_dir', dest='out_dir', type=str, default='.', help='Directory to write to')
+    parser.add_argument('--server', dest='server', type=str, default=DEFAULT_SERVER, help='Ensembl REST server')
+    parser.add_argument('--no_cache', dest='no_cache', action='store_true',
+                        help='Do not use the response cache (set its directory with ENSEMBL_CACHE_DIR)')
+    return parser.parse_args()
+
+
+def _variants_from_output(file: str = None) -> list:
+    """
+    @param file: output_<species>_<symbol>.txt
+    @return: list of the variant records the lines were written from
+    """
+    variants = []
+    with open(file, 'r') as in_fh:
+        for line in in_fh:
+            location, rest = line.rstrip('\n').split(' ==> ')
+            seq_region_name, span, strand = location.split(':')
+            start, end = span.split('-')
+            variant_id, consequence_type = rest.split(' (')
+            variants.append({'seq_region_name': seq_region_name, 'start': int(start), 'end': int(end),
+                             'strand': int(strand), 'id': variant_id, 'consequence_type': consequence_type[:-1]})
+    return variants
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Local stand-in for rest.ensembl.org, serving the JSON files of this directory"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    responses_by_path = {}  # path -> JSON response, set by test_code
+    symbol_records = {}  # symbol -> lookup record
+    requests = []  # (method, path) of every request
+    connections = []  # one entry per connection opened
+    throttle_once = set()  # paths answered 429 the first time
+
+    def setup(self):
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.requests.append(('GET', self.path))
+        if self.path in self.throttle_once:
+            self.throttle_once.discard(self.path)
+            self._reply(429, {'error': 'slow down'}, {'Retry-After': '0'})
+        elif self.path in self.responses_by_path:
+            self._reply(200, self.responses_by_path[self.path])
+        else:
+            self._reply(400, {'error': f'No valid lookup found for {self.path}'})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append(('POST', self.path))
+        self._reply(200, {symbol: self.symbol_records.get(symbol) for symbol in body['symbols']})
+
+    def _reply(self, status: int, response, headers: dict = None):
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        for name, value in {'Content-Type': 'application/json', 'Content-Length': str(len(data)),
+                            **(headers or {})}.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_code() -> None:
+    """
+    Test the client against a local stand-in server serving human_BRAF.json, human_EGFR.json and the variants of
+    output_human_BRAF.txt / output_human_EGFR.txt
+    @return: None
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    responses, variants = {}, {}
+    for symbol in ('BRAF', 'EGFR'):
+        with open(os.path.join(here, f'human_{symbol}.json'), 'r') as in_fh:
+            xrefs = json.load(in_fh)
+        responses[f'/xrefs/symbol/homo_sapiens/{symbol}'] = xrefs
+        variants[symbol] = _variants_from_output(os.path.join(here, f'output_human_{symbol}.txt'))
+        responses[f"/overlap/id/{xrefs[0]['id']}?feature=variation"] = variants[symbol]
+    _StandInHandler.responses_by_path = responses
+    _StandInHandler.symbol_records = {'BRAF': {'id': 'ENSG00000157764'}, 'EGFR': {'id': 'ENSG00000146648'}}
+    _StandInHandler.throttle_once = {'/xrefs/symbol/homo_sapiens/EGFR'}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ResponseCache(os.path.join(tmp_dir, 'cache'))
+            asyncio.run(annotate_genes(['BRAF', 'EGFR'], tmp_dir, server=url, cache=cache, pool_size=2,
+                                       requests_per_second=100))
+            for symbol in ('BRAF', 'EGFR'):
+                with open(os.path.join(tmp_dir, f'output_human_{symbol}.txt'), 'r') as in_fh, \
+                        open(os.path.join(here, f'output_human_{symbol}.txt'), 'r') as expected_fh:
+                    assert in_fh.read() == expected_fh.read()
+            # 2 xrefs (one retried after the 429) and 2 overlaps, over at most 2 keep-alive connections
+            assert len(_StandInHandler.requests) == 5 and len(_StandInHandler.connections) <= 2
+
+            # everything again comes from the cache
+            asyncio.run(annotate_genes(['BRAF', 'EGFR'], tmp_dir, server=url, cache=cache))
+            assert len(_StandInHandler.requests) == 5
+
+            async def lookups():
+                async with EnsemblClient(server=url, cache=cache, requests_per_second=100) as client:
+                    first = await client.lookup_symbols(['BRAF', 'NOPE', 'EGFR'], species='human')
+                    again = await client.lookup_symbols(['EGFR', 'BRAF', 'NOPE'])
+                    try:
+                        await client.xrefs_symbol('NOPE')
+                        assert False, "unknown symbol"
+                    except EnsemblError as err:
+                        assert err.status == 400
+                    return first, again, client.requests_sent
+
+            first, again, requests_sent = asyncio.run(lookups())
+            assert first == {'BRAF': {'id': 'ENSG00000157764'}, 'NOPE': None, 'EGFR': {'id': 'ENSG00000146648'}}
+            assert again == {symbol: first[symbol] for symbol in ('EGFR', 'BRAF', 'NOPE')}
+            assert requests_sent == 2  # one batch POST, then the failed xrefs, the second lookup was cached
+
+            # expired entries are not used, and the size limit evicts the least recently used
+            assert ResponseCache(cache.cache_dir, ttl=-1).get('GET /xrefs/symbol/homo_sapiens/BRAF ') is None
+            small = ResponseCache(os.path.join(tmp_dir, 'small'))
+            small.put('a', {'result': 'x' * 50})
+            small.max_bytes = 2.5 * os.path.getsize(small._entry_file('a'))  # pylint: disable=protected-access
+            small.put('b', {'result': 'y' * 50})
+            os.utime(small._entry_file('a'), (0, time.time() - 10))  # pylint: disable=protected-access
+            small.put('c', {'result': 'z' * 50})
+            assert small.get('a') is None and small.get('c') == {'result': 'z' * 50}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()